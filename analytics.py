@@ -0,0 +1,97 @@
+import os
+from collections import namedtuple
+
+import numpy as np
+
+# Норма рабочего дня в минутах для расчета переработки
+DAILY_NORM_MINUTES = int(os.environ.get('WORKDAY_NORM_MINUTES', 8 * 60))
+
+WEEKDAY_NAMES = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+
+# Завершенные сессии периода в виде столбцов: день (номер дня от 1970-01-01),
+# вход и выход (минуты от полуночи), обед и отработанное время (минуты)
+PeriodArrays = namedtuple('PeriodArrays', ['day', 'start', 'end', 'lunch', 'worked'])
+
+PeriodSummary = namedtuple('PeriodSummary', [
+    'total_minutes', 'sessions', 'days_worked', 'average_day_minutes',
+    'overtime_minutes', 'undertime_minutes', 'norm_minutes',
+    'weekday_minutes', 'weekday_days', 'average_start', 'average_end', 'average_lunch',
+])
+
+
+def rows_to_arrays(rows):
+    """Переводит строки (date, time_in, time_out, lunch_start, lunch_end, lunch_minutes,
+    worked_minutes[, auto_closed]) в столбцы NumPy; незавершенные и закрытые автоматически
+    сессии пропускаются: забытый выход не должен давать рабочий день с нулем минут"""
+    closed = [row for row in rows if row[6] is not None and not any(row[7:8])]
+    if not closed:
+        empty = np.zeros(0, dtype=np.int64)
+        return PeriodArrays(empty, empty, empty, empty, empty)
+
+    dates, time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked = zip(*(row[:7] for row in closed))
+    # None превращается в nan, что позволяет выбрать способ учета обеда без цикла
+    lunch_start = np.array(lunch_start, dtype=np.float64)
+    lunch_end = np.array(lunch_end, dtype=np.float64)
+    lunch_minutes = np.array(lunch_minutes, dtype=np.float64)
+    has_lunch_interval = ~np.isnan(lunch_start) & ~np.isnan(lunch_end)
+    lunch = np.where(has_lunch_interval, lunch_end - lunch_start, np.nan_to_num(lunch_minutes))
+
+    return PeriodArrays(
+        day=np.array(dates, dtype='datetime64[D]').astype(np.int64),
+        start=np.array(time_in, dtype=np.int64),
+        end=np.array(time_out, dtype=np.int64),
+        lunch=lunch.astype(np.int64),
+        worked=np.array(worked, dtype=np.int64),
+    )
+
+
+# Загрузка завершенных пользователем сессий за период (выполняется в пуле чтения)
+def load_period(conn, user_id, start_date, end_date):
+    cursor = conn.cursor()
+    cursor.execute('''SELECT date, time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes
+                      FROM records
+                      WHERE user_id = ? AND date BETWEEN ? AND ? AND worked_minutes IS NOT NULL AND auto_closed = 0
+                      ORDER BY date, time_in''', (user_id, start_date, end_date))
+    return rows_to_arrays(cursor.fetchall())
+
+
+def summarize(arrays, norm_minutes=DAILY_NORM_MINUTES):
+    """Считает итоги периода векторно: суммы по дням, средние, переработку и
+    распределение по дням недели"""
+    if arrays.day.size == 0:
+        return PeriodSummary(0, 0, 0, 0, 0, 0, norm_minutes, [0] * 7, [0] * 7, None, None, 0)
+
+    # Сессии группируются по дню; reduceat требует, чтобы дни шли подряд
+    order = np.argsort(arrays.day, kind='stable')
+    day = arrays.day[order]
+    day_ordinals, first_index, day_index = np.unique(day, return_index=True, return_inverse=True)
+    day_minutes = np.bincount(day_index, weights=arrays.worked[order]).astype(np.int64)
+    first_start = np.minimum.reduceat(arrays.start[order], first_index)
+    last_end = np.maximum.reduceat(arrays.end[order], first_index)
+
+    # 1970-01-01 - четверг, поэтому понедельник получает номер 0
+    weekdays = (day_ordinals + 3) % 7
+    weekday_minutes = np.bincount(weekdays, weights=day_minutes, minlength=7).astype(np.int64)
+    weekday_days = np.bincount(weekdays, minlength=7)
+
+    days_worked = int(day_ordinals.size)
+    total_minutes = int(day_minutes.sum())
+    return PeriodSummary(
+        total_minutes=total_minutes,
+        sessions=int(arrays.day.size),
+        days_worked=days_worked,
+        average_day_minutes=total_minutes // days_worked,
+        overtime_minutes=int(np.clip(day_minutes - norm_minutes, 0, None).sum()),
+        undertime_minutes=int(np.clip(norm_minutes - day_minutes, 0, None).sum()),
+        norm_minutes=norm_minutes,
+        weekday_minutes=weekday_minutes.tolist(),
+        weekday_days=weekday_days.tolist(),
+        average_start=int(first_start.mean().round()),
+        average_end=int(last_end.mean().round()),
+        average_lunch=int(arrays.lunch.mean().round()),
+    )
+
+
+# Загрузка и подсчет итогов одним вызовом для пула чтения
+def period_summary(conn, user_id, start_date, end_date, norm_minutes=DAILY_NORM_MINUTES):
+    return summarize(load_period(conn, user_id, start_date, end_date), norm_minutes)
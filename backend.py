@@ -0,0 +1,215 @@
+"""Интерфейс хранилища бота и выбор реализации.
+
+Обработчики работают только с методами StorageBackend, поэтому хранилище
+можно заменить, не трогая main.py. Реализации:
+
+    sqlite     storage.Repository (один файл) или sharding.ShardedRepository (DB_SHARDS > 1)
+    postgres   postgres_backend.PostgresBackend: общая база для нескольких экземпляров бота
+    memory     memory_backend.MemoryBackend: все в памяти процесса, для проверок
+
+Выбор - переменная DB_BACKEND (по умолчанию sqlite), для postgres нужен DATABASE_URL.
+Одинаковость поведения проверяет python conformance.py.
+
+Даты передаются строками 'ГГГГ-ММ-ДД', время - минутами от полуночи дня записи
+(см. shifts.py). Записи возвращаются кортежами в том же порядке столбцов, что и
+в SQLite-схеме.
+"""
+import os
+from abc import ABC, abstractmethod
+
+from analytics import DAILY_NORM_MINUTES
+
+DB_BACKEND = os.environ.get('DB_BACKEND', 'sqlite').lower()
+BACKENDS = ('sqlite', 'postgres', 'memory')
+
+
+class StorageBackend(ABC):
+    """Асинхронное хранилище: отметки, записи, отчеты, настройки и состояние бота.
+
+    У каждой реализации есть атрибуты cache (report_cache.ReportCache; записи
+    пользователя сбрасывают его отчеты), clock (timezones.UserClock), reminders
+    ({user_id: время напоминания в минутах}, см. scheduler.py) и digests
+    ({user_id: период сводки}, см. digest.py).
+    """
+
+    @abstractmethod
+    async def start(self):
+        """Открывает хранилище; повторный вызов ничего не делает"""
+
+    @abstractmethod
+    async def close(self):
+        """Дожидается незавершенных запросов и закрывает хранилище"""
+
+    # Текущее состояние для метрик (вызываются из любого потока, без запросов к базе)
+
+    def db_stats(self):
+        return {}
+
+    def queue_depths(self):
+        return {}
+
+    def open_sessions_count(self):
+        """Открытые сессии, известные процессу, или None, если процесс их не отслеживает"""
+        return None
+
+    # Настройки пользователя
+
+    def today(self, user_id):
+        """Сегодняшняя дата ('ГГГГ-ММ-ДД') в поясе пользователя"""
+        return self.clock.today_str(user_id)
+
+    @abstractmethod
+    async def set_timezone(self, user_id, timezone):
+        """Сохраняет пояс пользователя (None - пояс по умолчанию) и обновляет clock"""
+
+    @abstractmethod
+    async def set_reminder(self, user_id, reminder_time):
+        """Сохраняет время напоминания о выходе (None - отключить) и обновляет reminders"""
+
+    @abstractmethod
+    async def set_digest(self, user_id, digest):
+        """Сохраняет период сводки ('week', 'month', None - отключить) и обновляет digests"""
+
+    # Отметки в течение дня
+
+    @abstractmethod
+    async def punch_in(self, user_id, date, time_in):
+        """Вход; повторный вход в тот же день исправляет время незакрытой сессии"""
+
+    @abstractmethod
+    async def punch_out(self, user_id, date, time_out):
+        """Выход: закрывает последнюю открытую сессию, начатую не позже date.
+
+        Если от ее входа до выхода больше MAX_SHIFT_HOURS, ничего не меняет и поднимает
+        shifts.StaleSessionError; так же ведут себя отметки обеда"""
+
+    @abstractmethod
+    async def lunch_start(self, user_id, date, lunch_start):
+        """Начало обеда открытой сессии"""
+
+    @abstractmethod
+    async def lunch_end(self, user_id, date, lunch_end):
+        """Конец обеда открытой сессии"""
+
+    @abstractmethod
+    async def lunch_minutes(self, user_id, date, lunch_minutes):
+        """Продолжительность обеда открытой сессии в минутах"""
+
+    @abstractmethod
+    async def open_session(self, user_id):
+        """Последняя открытая сессия пользователя (open_sessions.OpenSession) или None"""
+
+    @abstractmethod
+    async def at_work(self, date=None):
+        """Число открытых сессий, начатых в date (None - всех)"""
+
+    @abstractmethod
+    async def all_open_sessions(self):
+        """(user_id, OpenSession) последней открытой сессии каждого пользователя, одним запросом"""
+
+    @abstractmethod
+    async def auto_close(self, user_id, record_id):
+        """Закрывает забытую сессию без учета времени (auto_closed); закрытая OpenSession или None"""
+
+    # Полные записи
+
+    @abstractmethod
+    async def add_record(self, user_id, date, time_in, time_out, lunch_start=None, lunch_end=None,
+                         lunch_minutes=None):
+        """Добавляет завершенную запись и возвращает отработанные минуты"""
+
+    @abstractmethod
+    async def add_records(self, user_id, rows):
+        """Пачка строк (date, time_in, time_out, lunch_start, lunch_end, lunch_minutes); возвращает их число"""
+
+    @abstractmethod
+    async def delete_day(self, user_id, date):
+        """Удаляет записи дня и возвращает их число"""
+
+    # Чтение и отчеты
+
+    @abstractmethod
+    async def records_by_date(self, user_id, date):
+        """(id, time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes, auto_closed)
+        по времени входа"""
+
+    @abstractmethod
+    async def records_period(self, user_id, start_date, end_date):
+        """(date, time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes, auto_closed)
+        по дате и входу; auto_closed - 0 или 1"""
+
+    @abstractmethod
+    async def map_user_records(self, user_ids, start_date, end_date, func):
+        """{user_id: func(user_id, записи как у records_period)} для пользователей с записями за период.
+
+        Записи читаются одним проходом, сгруппированными по пользователю; func не
+        должна обращаться к хранилищу и может выполняться вне цикла событий.
+        """
+
+    @abstractmethod
+    async def report(self, user_id, period):
+        """Отработанные минуты за period (today, week, month, year) по агрегатам по дням"""
+
+    @abstractmethod
+    async def today_details(self, user_id):
+        """(time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes, auto_closed) за сегодня"""
+
+    @abstractmethod
+    async def period_summary(self, user_id, start_date, end_date, norm_minutes=DAILY_NORM_MINUTES):
+        """analytics.PeriodSummary по завершенным сессиям периода"""
+
+    @abstractmethod
+    async def export(self, user_id, start_date, end_date, file_format):
+        """(file, count), см. exporter.write_export"""
+
+    # Команды (teams.py)
+
+    @abstractmethod
+    async def create_team(self, owner_id, name, owner_name):
+        """Создает команду с владельцем-руководителем и возвращает teams.Team"""
+
+    @abstractmethod
+    async def join_team(self, user_id, join_code, name):
+        """Вступление по коду: teams.Team или None, если код не найден"""
+
+    @abstractmethod
+    async def set_team_role(self, team_id, user_id, role):
+        """Меняет роль участника; ValueError, если его нет или это последний руководитель"""
+
+    @abstractmethod
+    async def user_teams(self, user_id):
+        """Команды пользователя: список teams.Membership"""
+
+    @abstractmethod
+    async def member_totals(self, user_ids, start_date, end_date, norm_minutes=DAILY_NORM_MINUTES):
+        """{user_id: teams.DayTotals} по агрегатам по дням; пользователей без агрегатов за период нет"""
+
+    @abstractmethod
+    async def team_report(self, team_id, start_date, end_date, norm_minutes=DAILY_NORM_MINUTES):
+        """teams.MemberTotals каждого участника за период по агрегатам по дням, по имени"""
+
+    # Состояние бота (persistence.py)
+
+    @abstractmethod
+    async def save_bot_state(self, changes):
+        """changes - (kind, key, data); data = None удаляет ключ"""
+
+    @abstractmethod
+    async def load_bot_state(self):
+        """Все строки (kind, key, data)"""
+
+
+def open_backend(name=DB_BACKEND):
+    """Хранилище по имени из DB_BACKEND"""
+    if name == 'sqlite':
+        from sharding import open_repository
+        return open_repository()
+    if name == 'postgres':
+        from postgres_backend import DATABASE_URL, PostgresBackend
+        if not DATABASE_URL:
+            raise SystemExit("Для DB_BACKEND=postgres нужен DATABASE_URL")
+        return PostgresBackend(DATABASE_URL)
+    if name == 'memory':
+        from memory_backend import MemoryBackend
+        return MemoryBackend()
+    raise SystemExit(f"Неизвестный DB_BACKEND={name!r}, доступны: {', '.join(BACKENDS)}")
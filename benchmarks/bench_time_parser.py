@@ -0,0 +1,41 @@
+"""Микробенчмарк разбора времени: datetime.strptime против time_parser.parse_time.
+
+Запуск из корня проекта: python benchmarks/bench_time_parser.py
+"""
+import sys
+import timeit
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from time_parser import parse_time  # noqa: E402
+
+# Типичный ввод пользователей: утренние отметки, обед, вечер
+SAMPLES = ['09:00', '9:05', '13:00', '14:30', '18:45', '08:30', '17:15', '23:59']
+
+
+# Прежний путь обработчиков: проверка strptime и перевод в минуты
+def strptime_path():
+    for text in SAMPLES:
+        time_dt = datetime.strptime(text, '%H:%M')
+        time_dt.hour * 60 + time_dt.minute
+
+
+def parse_time_path():
+    for text in SAMPLES:
+        parse_time(text)
+
+
+def main():
+    number = 20000
+    results = {}
+    for name, func in (('strptime', strptime_path), ('parse_time', parse_time_path)):
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        results[name] = best / (number * len(SAMPLES)) * 1e9
+        print(f"{name:>12}: {results[name]:8.1f} нс на значение")
+    print(f"{'ускорение':>12}: {results['strptime'] / results['parse_time']:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
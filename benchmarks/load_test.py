@@ -0,0 +1,176 @@
+"""Нагрузочный тест: синтетические пользователи проходят настоящие обработчики бота.
+
+Приложение собирается через main.build_application со всеми ConversationHandler,
+но вместо Bot API стоит FakeRequest, а база - временный файл. Каждый пользователь
+за «день» делает Вход, Обед (начало и конец), Выход и смотрит отчет; моменты
+действий распределены нормально вокруг утреннего пика, обеда и вечера, день
+сжат до --duration секунд. В конце печатаются p50/p95/p99 задержки обработчиков
+по типам шагов, время в БД и обновления в секунду.
+
+Запуск из корня проекта: python benchmarks/load_test.py --users 2000 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from telegram import Update  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+import main  # noqa: E402
+from sharding import open_repository  # noqa: E402
+from webhook import make_text_update  # noqa: E402
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'bot', 'username': 'timesheet_bot',
+            'can_join_groups': True, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+
+# Доли «дня»: центр и разброс момента действия
+ARRIVAL = {'in': (0.15, 0.05), 'lunch': (0.45, 0.04), 'out': (0.80, 0.06)}
+
+
+class FakeRequest(BaseRequest):
+    """Ответы Bot API без сети; api_latency имитирует задержку Telegram"""
+
+    def __init__(self, api_latency=0.0):
+        self._api_latency = api_latency
+        self.calls = defaultdict(int)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        if self._api_latency:
+            await asyncio.sleep(self._api_latency)
+        params = request_data.parameters if request_data else {}
+        if endpoint == 'getMe':
+            result = BOT_USER
+        elif endpoint in ('sendMessage', 'editMessageText', 'sendDocument'):
+            result = {'message_id': 1, 'date': int(time.time()),
+                      'chat': {'id': params.get('chat_id', 1), 'type': 'private'}, 'text': ''}
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+def _clock(minutes):
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def user_plan(rng, duration):
+    """Шаги одного пользователя: (момент в секундах, метка шага, тексты сообщений)"""
+    def moment(kind):
+        center, spread = ARRIVAL[kind]
+        return min(max(rng.gauss(center, spread), 0.0), 1.0) * duration
+
+    time_in = rng.randint(7 * 60 + 30, 10 * 60)
+    lunch_start = rng.randint(12 * 60, 14 * 60)
+    lunch_end = lunch_start + rng.choice((30, 45, 60))
+    time_out = rng.randint(17 * 60, 19 * 60 + 30)
+    lunch_at = moment('lunch')
+    out_at = moment('out')
+    return sorted([
+        (moment('in'), 'Вход', ['Вход', _clock(time_in)]),
+        (lunch_at, 'Обед: начало', ['Обед', 'Начало обеда', _clock(lunch_start)]),
+        (lunch_at + duration * 0.02, 'Обед: конец', ['Обед', 'Конец обеда', _clock(lunch_end)]),
+        (out_at, 'Выход', ['Выход', _clock(time_out)]),
+        (out_at + duration * 0.01, 'Отчет', ['Отчет', rng.choice(('Сегодня', 'Неделя', 'Месяц'))]),
+    ])
+
+
+async def simulate_user(application, user_id, plan, started, latencies, think_time):
+    for at, label, texts in plan:
+        delay = started + at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        for i, text in enumerate(texts):
+            if i:
+                await asyncio.sleep(think_time)
+            update = Update.de_json(make_text_update(user_id, text), application.bot)
+            begin = time.perf_counter()
+            await application.process_update(update)
+            # Отдельно меряется шаг, который пишет в БД или строит отчет
+            kind = label if i == len(texts) - 1 else 'меню'
+            latencies[kind].append(time.perf_counter() - begin)
+
+
+def _percentiles(values):
+    p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+    return f"{len(values):7d} {p50:8.2f} {p95:8.2f} {p99:8.2f} мс"
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        main.repo = open_repository(str(Path(tmp_dir) / 'timesheet.db'), args.shards)
+        request = FakeRequest(args.api_latency / 1000)
+        application = main.build_application('123456:LOAD-TEST', request)
+
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+
+        latencies = defaultdict(list)
+        started = time.perf_counter() + 0.1
+        await asyncio.gather(*(
+            simulate_user(application, 1000 + i, user_plan(rng, args.duration), started, latencies,
+                          args.think_time / 1000)
+            for i in range(args.users)
+        ))
+        wall_time = time.perf_counter() - started
+        db_stats = main.repo.db_stats()
+        cache_stats = main.repo.cache.stats()
+
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    print(f"Пользователей: {args.users}, день сжат до {args.duration} с, задержка API {args.api_latency} мс, "
+          f"шардов БД: {args.shards}")
+    print(f"{'шаг':<14} {'запросов':>7} {'p50':>8} {'p95':>8} {'p99':>11}")
+    for label in sorted(latencies):
+        print(f"{label:<14} {_percentiles(latencies[label])}")
+    print(f"{'все':<14} {_percentiles(all_latencies)}")
+    print(f"\nОбновлений: {len(all_latencies)} за {wall_time:.2f} с, {len(all_latencies) / wall_time:.0f} в секунду")
+    print(f"Запись в БД: {db_stats['write_busy_seconds']:.3f} с, {db_stats['write_jobs']} задач "
+          f"в {db_stats['write_batches']} транзакциях")
+    print(f"Чтение из БД: {db_stats['read_busy_seconds']:.3f} с, {db_stats['read_calls']} запросов")
+    print(f"Кэш отчетов: {cache_stats}")
+    print(f"Вызовы Bot API: {dict(request.calls)}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест обработчиков бота')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=10.0, help='длина сжатого дня в секундах')
+    parser.add_argument('--think-time', type=float, default=20.0, help='пауза между сообщениями шага, мс')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='имитация задержки Bot API, мс')
+    parser.add_argument('--shards', type=int, default=1, help='число файлов-шардов БД (см. sharding.py)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main_cli()
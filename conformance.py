@@ -0,0 +1,273 @@
+"""Проверка того, что реализации StorageBackend ведут себя одинаково.
+
+Каждое хранилище проходит один сценарий: отметки с обедом, ночная смена через
+полночь, ручные и пакетные записи, удаление дня, отчеты, пояс пользователя,
+выгрузка, закрытие забытых сессий, сводки, команды и состояние бота. Запуск из корня проекта:
+
+    python conformance.py                       sqlite (временный файл) и memory
+    python conformance.py sqlite --shards 3     то же на трех шардах
+    python conformance.py postgres --dsn postgresql://localhost/test
+    python conformance.py postgres              временный кластер через initdb/pg_ctl
+
+Без --dsn для postgres нужен установленный сервер PostgreSQL (initdb в PATH или
+в каталоге pg_config --bindir); если его нет, проверка postgres пропускается.
+"""
+import argparse
+import asyncio
+import logging
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+
+from backend import BACKENDS
+from shifts import StaleSessionError
+from timezones import UserClock
+
+USER = 1001
+OTHER_USER = 1002
+SHIFT_USER = 1003
+
+
+def _check(name, actual, expected):
+    if actual != expected:
+        raise AssertionError(f"{name}: ожидалось {expected!r}, получено {actual!r}")
+
+
+async def run_conformance(repo):
+    """Сценарий проверки; хранилище должно быть запущено и пустым"""
+    today = repo.today(USER)
+    today_date = repo.clock.today(USER)
+    yesterday = (today_date - timedelta(days=1)).strftime('%Y-%m-%d')
+    long_ago = (today_date - timedelta(days=400)).strftime('%Y-%m-%d')
+
+    # Отметки: повторный вход исправляет время, обед вычитается
+    await repo.punch_in(USER, today, 8 * 60)
+    await repo.punch_in(USER, today, 9 * 60)
+    _check('сессия открыта', (await repo.open_session(USER)).time_in, 9 * 60)
+    _check('на работе', await repo.at_work(today), 1)
+    await repo.lunch_start(USER, today, 13 * 60)
+    await repo.lunch_end(USER, today, 14 * 60)
+    await repo.punch_out(USER, today, 17 * 60)
+    _check('сессия закрыта', await repo.open_session(USER), None)
+    _check('на работе после выхода', await repo.at_work(), 0)
+    records = await repo.records_by_date(USER, today)
+    _check('записи дня', [record[1:] for record in records], [(540, 1020, 780, 840, None, 420, 0)])
+    _check('отчет за сегодня', await repo.report(USER, 'today'), 420)
+
+    # Ночная смена вчера 22:00 - сегодня 06:00: сегодняшняя часть попадает в отчет за сегодня
+    await repo.punch_in(OTHER_USER, yesterday, 22 * 60)
+    _check('ночная сессия открыта', (await repo.open_session(OTHER_USER)).date, yesterday)
+    await repo.punch_out(OTHER_USER, today, 6 * 60)
+    records = await repo.records_period(OTHER_USER, yesterday, today)
+    _check('ночная запись', records, [(yesterday, 1320, 1800, None, None, None, 480, 0)])
+    _check('ночная смена за сегодня', await repo.report(OTHER_USER, 'today'), 360)
+    _check('отчеты пользователей раздельны', await repo.report(USER, 'today'), 420)
+
+    # Выход в ту же минуту, что и вход, отклоняется, как при ручном вводе и импорте
+    await repo.punch_in(SHIFT_USER, long_ago, 10 * 60)
+    for name, write in (('выход', repo.punch_out(SHIFT_USER, long_ago, 10 * 60)),
+                        ('ручная запись', repo.add_record(SHIFT_USER, long_ago, 10 * 60, 10 * 60))):
+        try:
+            await write
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"{name} в минуту входа сохранен")
+    await repo.punch_out(SHIFT_USER, long_ago, 11 * 60)
+    _check('выход после отклоненного', await repo.records_period(SHIFT_USER, long_ago, long_ago),
+           [(long_ago, 600, 660, None, None, None, 60, 0)])
+
+    # Ручные записи: выход раньше входа - смена через полночь
+    _check('ручная ночная запись', await repo.add_record(USER, long_ago, 20 * 60, 4 * 60, lunch_minutes=30), 450)
+    _check('пакет записей', await repo.add_records(USER, [
+        (yesterday, 9 * 60, 18 * 60, None, None, 60),
+        (yesterday, 19 * 60, 20 * 60, None, None, None),
+    ]), 2)
+    details = await repo.today_details(USER)
+    _check('детали за сегодня', details, [(540, 1020, 780, 840, None, 420, 0)])
+    summary = await repo.period_summary(USER, yesterday, today)
+    _check('сводка: дней', summary.days_worked, 2)
+    _check('сводка: минут', summary.total_minutes, 480 + 60 + 420)
+    year = await repo.report(USER, 'year')
+    _check('отчет за год', year, 420 + (540 if yesterday[:4] == today[:4] else 0))
+
+    # Удаление дня снимает его из агрегатов
+    _check('удалено записей', await repo.delete_day(USER, yesterday), 2)
+    _check('отчет за год после удаления', await repo.report(USER, 'year'), 420)
+    _check('удаление пустого дня', await repo.delete_day(USER, yesterday), 0)
+
+    # Выгрузка
+    file, count = await repo.export(USER, long_ago, today, 'csv')
+    with file:
+        lines = file.read().decode('utf-8-sig').splitlines()
+    _check('выгружено строк', count, 2)
+    _check('строк в файле', len(lines), 3)
+
+    # Пояс: «сегодня» в UTC+14 может отличаться от серверного, но должно совпасть с UserClock
+    await repo.set_timezone(USER, 'Pacific/Kiritimati')
+    _check('пояс', repo.clock.timezone(USER), 'Pacific/Kiritimati')
+    _check('сегодня в поясе', repo.today(USER), _zone_today('Pacific/Kiritimati'))
+    await repo.set_timezone(USER, None)
+    _check('пояс сброшен', repo.clock.timezone(USER), repo.clock.timezone(OTHER_USER))
+
+    # Забытая сессия: выход и обед к ней не относятся; закрывается без учета времени,
+    # повторное закрытие ничего не делает
+    await repo.punch_in(OTHER_USER, long_ago, 8 * 60)
+    for mark in (repo.punch_out, repo.lunch_start, repo.lunch_minutes):
+        try:
+            await mark(OTHER_USER, today, 17 * 60)
+        except StaleSessionError as e:
+            _check('отметка к забытой сессии', e.session_date, long_ago)
+        else:
+            raise AssertionError(f"{mark.__name__}: отметка к сессии старше MAX_SHIFT_HOURS сохранена")
+    _check('открытые сессии', [(user_id, session.date) for user_id, session in await repo.all_open_sessions()],
+           [(OTHER_USER, long_ago)])
+    session = await repo.open_session(OTHER_USER)
+    _check('автозакрытие', await repo.auto_close(OTHER_USER, session.record_id), session)
+    _check('повторное автозакрытие', await repo.auto_close(OTHER_USER, session.record_id), None)
+    _check('после автозакрытия', await repo.all_open_sessions(), [])
+    _check('автозакрытая запись', await repo.records_by_date(OTHER_USER, long_ago),
+           [(session.record_id, 480, 480, None, None, None, 0, 1)])
+    summary = await repo.period_summary(OTHER_USER, long_ago, long_ago)
+    _check('автозакрытая запись не в статистике', (summary.sessions, summary.days_worked), (0, 0))
+    await repo.set_reminder(USER, 18 * 60)
+    _check('напоминание', repo.reminders.get(USER), 18 * 60)
+    await repo.set_reminder(USER, None)
+    _check('напоминание выключено', repo.reminders.get(USER), None)
+
+    # Сводки: подписка и записи нескольких пользователей одним проходом
+    await repo.set_digest(USER, 'week')
+    _check('сводка', repo.digests.get(USER), 'week')
+    await repo.set_digest(USER, None)
+    _check('сводка выключена', repo.digests.get(USER), None)
+    mapped = await repo.map_user_records([OTHER_USER, USER, 999], long_ago, today,
+                                         lambda user_id, records: [record[:3] for record in records])
+    _check('записи по пользователям', mapped, {
+        USER: [(long_ago, 1200, 1680), (today, 540, 1020)],
+        OTHER_USER: [(long_ago, 480, 480), (yesterday, 1320, 1800)],
+    })
+
+    # Команды: итоги участников по агрегатам, руководитель не может остаться один без роли
+    team = await repo.create_team(USER, 'Смена', 'Иван')
+    _check('чужой код', await repo.join_team(OTHER_USER, team.join_code + 'x', 'Петр'), None)
+    _check('вступление', await repo.join_team(OTHER_USER, team.join_code, 'Петр'), team)
+    _check('команды пользователя', [(membership.team, membership.role, membership.members)
+                                    for membership in await repo.user_teams(OTHER_USER)], [(team, 'member', 2)])
+    rows = await repo.team_report(team.id, yesterday, today, norm_minutes=400)
+    _check('отчет по команде', [tuple(row) for row in rows], [
+        (USER, 'Иван', 'manager', 420, 1, 1, 20, 0),
+        (OTHER_USER, 'Петр', 'member', 480, 2, 1, 0, 400 - 120 + 400 - 360),
+    ])
+    _check('итоги по агрегатам', await repo.member_totals([USER, 999], yesterday, today, norm_minutes=400),
+           {USER: (420, 1, 1, 20, 0)})
+    try:
+        await repo.set_team_role(team.id, USER, 'member')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('последний руководитель разжалован')
+    await repo.set_team_role(team.id, OTHER_USER, 'manager')
+    await repo.set_team_role(team.id, USER, 'member')
+    _check('роль', [membership.role for membership in await repo.user_teams(USER)], ['member'])
+
+    # Состояние бота
+    await repo.save_bot_state([('conversation', 'a', '1'), ('user_data', '1001', '{}')])
+    await repo.save_bot_state([('conversation', 'a', '2'), ('user_data', '1001', None)])
+    _check('состояние бота', sorted(await repo.load_bot_state()), [('conversation', 'a', '2')])
+
+
+def _zone_today(timezone):
+    clock = UserClock()
+    clock.set(USER, timezone)
+    return clock.today_str(USER)
+
+
+@contextmanager
+def local_postgres():
+    """DSN временного кластера PostgreSQL или None, если сервер не установлен"""
+    initdb = shutil.which('initdb')
+    if initdb is None and shutil.which('pg_config'):
+        bindir = subprocess.run(['pg_config', '--bindir'], capture_output=True, text=True).stdout.strip()
+        initdb = shutil.which('initdb', path=bindir)
+    if initdb is None:
+        yield None
+        return
+    bindir = Path(initdb).parent
+    with tempfile.TemporaryDirectory() as directory:
+        data = Path(directory) / 'data'
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        subprocess.run([initdb, '-D', data, '-U', 'postgres', '--auth=trust'], check=True, capture_output=True)
+        subprocess.run([bindir / 'pg_ctl', '-D', data, '-l', Path(directory) / 'log', '-w',
+                        '-o', f'-p {port} -k {directory} -c listen_addresses=127.0.0.1', 'start'],
+                       check=True, capture_output=True)
+        try:
+            yield f'postgresql://postgres@127.0.0.1:{port}/postgres'
+        finally:
+            subprocess.run([bindir / 'pg_ctl', '-D', data, '-m', 'immediate', 'stop'], capture_output=True)
+
+
+async def _run_backend(name, args):
+    with tempfile.TemporaryDirectory() as directory, \
+            (local_postgres() if name == 'postgres' and not args.dsn else _no_server()) as dsn:
+        if name == 'sqlite':
+            from sharding import open_repository
+            repo = open_repository(str(Path(directory) / 'timesheet.db'), args.shards)
+        elif name == 'postgres':
+            dsn = args.dsn or dsn
+            if dsn is None:
+                print("postgres: пропущено, сервер PostgreSQL не найден (укажите --dsn)")
+                return True
+            from postgres_backend import PostgresBackend
+            repo = PostgresBackend(dsn)
+        else:
+            from memory_backend import MemoryBackend
+            repo = MemoryBackend()
+        started = time.perf_counter()
+        await repo.start()
+        try:
+            await run_conformance(repo)
+        except AssertionError as e:
+            print(f"{name}: ОШИБКА - {e}")
+            return False
+        finally:
+            await repo.close()
+        print(f"{name}: пройдено за {time.perf_counter() - started:.2f} с")
+        return True
+
+
+@contextmanager
+def _no_server():
+    yield None
+
+
+async def _run(args):
+    ok = True
+    for name in args.backends or ('sqlite', 'memory'):
+        ok = await _run_backend(name, args) and ok
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Одинаковость поведения хранилищ')
+    parser.add_argument('backends', nargs='*', metavar='backend',
+                        help=f"хранилища для проверки: {', '.join(BACKENDS)}")
+    parser.add_argument('--shards', type=int, default=1, help='число шардов для sqlite')
+    parser.add_argument('--dsn', help='база PostgreSQL для проверки; все таблицы в ней должны быть пустыми')
+    args = parser.parse_args(argv)
+    unknown = set(args.backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"неизвестные хранилища: {', '.join(sorted(unknown))}")
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(0 if asyncio.run(_run(args)) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+"""Пути к файлам базы SQLite.
+
+Отдельный модуль без зависимостей, чтобы утилиты вне бота (discharge_data_base.py,
+diagnostics.py) узнавали путь к базе, не загружая хранилище и telegram.
+"""
+from pathlib import Path
+
+DB_PATH = 'timesheet.db'
+
+
+# Файл шарда: шард 0 - сам base_path, шард i - base_path с суффиксом -i рядом (timesheet-i.db)
+def shard_path(base_path, shard):
+    if shard == 0:
+        return str(base_path)
+    base_path = Path(base_path)
+    return str(base_path.with_name(f'{base_path.stem}-{shard}{base_path.suffix}'))
+
+
+# Номера шардов, файлы которых есть рядом с base_path (0 - сам base_path), по возрастанию
+def existing_shards(base_path):
+    base_path = Path(base_path)
+    shards = [0] if base_path.exists() else []
+    prefix = f'{base_path.stem}-'
+    for path in base_path.parent.glob(f'{base_path.stem}-*{base_path.suffix}'):
+        number = path.name[len(prefix):len(path.name) - len(base_path.suffix)]
+        if number.isdigit() and number == str(int(number)) and int(number) > 0:
+            shards.append(int(number))
+    return sorted(shards)
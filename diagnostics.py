@@ -0,0 +1,379 @@
+"""Диагностика запросов и индексов SQLite.
+
+Режим диагностики включается переменной DB_SLOW_QUERY_MS (порог в миллисекундах).
+В этом режиме для каждого нового текста запроса один раз снимается
+EXPLAIN QUERY PLAN. Запросы дольше порога пишутся в лог вместе с планом. При
+остановке бота статистика сохраняется в DB_DIAGNOSTICS_FILE (по умолчанию
+db_diagnostics.json).
+
+Отчет по индексам:
+
+    python diagnostics.py report [--db timesheet.db] [--stats db_diagnostics.json]
+
+Без --stats нагрузка воспроизводится вызовом функций хранилища на пустой базе в
+памяти. Планы в обоих случаях строятся по настоящей базе (только чтение). В отчете
+есть избыточные и неиспользуемые индексы, запросы с полным просмотром таблицы и
+рекомендации частичных и покрывающих индексов.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, timedelta
+from pathlib import Path
+
+from db_paths import DB_PATH
+from metrics import TimedConnection, set_statement_hook
+
+logger = logging.getLogger(__name__)
+
+DIAGNOSTICS_FILE = os.environ.get('DB_DIAGNOSTICS_FILE', 'db_diagnostics.json')
+
+_PLANNED = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+_USED_INDEX = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+_SEARCH = re.compile(r'^(?:SEARCH|SCAN) (\w+)(?: AS \w+)? USING (COVERING )?INDEX (\w+)(?: \((.*)\))?')
+_TABLE_SCAN = re.compile(r'^SCAN (\w+)$')
+_IS_NULL = re.compile(r'\b(\w+)\s+IS\s+NULL\b', re.IGNORECASE)
+_SELECT_LIST = re.compile(r'^\s*SELECT\s+(.*?)\s+FROM\s+(\w+)', re.IGNORECASE | re.DOTALL)
+_IDENTIFIER = re.compile(r'^\w+$')
+_ORDER_BY = re.compile(r'ORDER BY\s+(\w+(?:\s*,\s*\w+)*)\s*$', re.IGNORECASE)
+
+
+def explain(conn, sql, parameters=None):
+    """Строки detail из EXPLAIN QUERY PLAN; обычный курсор, чтобы не попасть в метрики"""
+    cursor = conn.cursor(sqlite3.Cursor)
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, parameters or ())
+        return [row[3] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+class QueryLog:
+    """Статистика по текстам запросов: число, суммарное и максимальное время, план"""
+
+    def __init__(self, slow_seconds):
+        self.slow_seconds = slow_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, conn, sql, parameters, seconds):
+        if not _PLANNED.match(sql):
+            return
+        with self._lock:
+            entry = self._entries.get(sql)
+            if entry is None:
+                entry = self._entries[sql] = {
+                    'sql': sql, 'parameters': None, 'count': 0, 'total_seconds': 0.0,
+                    'max_seconds': 0.0, 'slow': 0, 'plan': None,
+                }
+            entry['count'] += 1
+            entry['total_seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+            need_plan = entry['plan'] is None and parameters is not None
+            if need_plan:
+                entry['parameters'] = _jsonable(parameters)
+            slow = seconds >= self.slow_seconds
+            if slow:
+                entry['slow'] += 1
+        if need_plan or slow:
+            try:
+                plan = explain(conn, sql, parameters)
+            except sqlite3.Error as e:
+                plan = [f'ошибка EXPLAIN: {e}']
+            if need_plan:
+                entry['plan'] = plan
+            if slow:
+                logger.warning(f"Медленный запрос {seconds * 1000:.1f} мс: {' '.join(sql.split())}\n"
+                               f"  параметры: {parameters!r}\n  план: {'; '.join(plan)}")
+
+    def entries(self):
+        with self._lock:
+            return [dict(entry) for entry in self._entries.values()]
+
+    def save(self, path=DIAGNOSTICS_FILE):
+        Path(path).write_text(json.dumps(self.entries(), ensure_ascii=False, indent=2), encoding='utf-8')
+        logger.info(f"Статистика запросов сохранена в {path}")
+
+
+def _jsonable(parameters):
+    if isinstance(parameters, dict):
+        return dict(parameters)
+    return list(parameters)
+
+
+_query_log = None
+
+
+def enable(slow_ms):
+    """Включает диагностику для всех соединений с factory=TimedConnection"""
+    global _query_log
+    _query_log = QueryLog(slow_ms / 1000)
+    set_statement_hook(_query_log)
+    logger.info(f"Диагностика запросов включена, порог медленного запроса {slow_ms} мс")
+    return _query_log
+
+
+def enable_from_env():
+    slow_ms = os.environ.get('DB_SLOW_QUERY_MS')
+    return enable(float(slow_ms)) if slow_ms else None
+
+
+def replay_workload():
+    """Прогоняет функции хранилища на пустой базе в памяти и возвращает их запросы"""
+    from analytics import load_period
+    from exporter import iter_record_chunks
+    from storage import (
+        _create_schema, add_complete_record, add_complete_records, add_lunch_end, add_lunch_minutes,
+        add_lunch_start, add_time_in, add_time_out, adopt_unmapped_users, auto_close_session,
+        delete_records_by_date, delete_user_rows, export_user_rows, generate_report, get_detailed_records_period,
+        get_records_by_date, get_today_details, import_user_rows, load_bot_state, load_open_sessions,
+        load_shard_map, load_user_digests, load_user_reminders, load_user_timezones, map_user_records,
+        rebuild_totals, save_bot_state, set_user_digest, set_user_reminder, set_user_shard, set_user_timezone,
+    )
+    from teams import (
+        create_team, join_team, member_totals, set_member_role, team_members, team_report, user_teams,
+    )
+
+    log = QueryLog(slow_seconds=float('inf'))
+    conn = sqlite3.connect(':memory:', isolation_level=None, factory=TimedConnection)
+    _create_schema(conn.cursor())
+    set_statement_hook(log)
+    try:
+        user_id, today = 1, date.today()
+        day, week_ago = today.isoformat(), (today - timedelta(days=7)).isoformat()
+        add_time_in(conn, user_id, day, 540)
+        add_lunch_start(conn, user_id, day, 780)
+        add_lunch_end(conn, user_id, day, 840)
+        add_lunch_minutes(conn, user_id, day, 60)
+        add_time_out(conn, user_id, day, 1080)
+        add_complete_record(conn, user_id, week_ago, 540, 1080, None, None, 30)
+        add_complete_records(conn, user_id, [(week_ago, 540, 1080, 780, 840, None)])
+        get_records_by_date(conn, user_id, day)
+        get_detailed_records_period(conn, user_id, week_ago, day)
+        get_today_details(conn, user_id, day)
+        for period in ('today', 'week', 'month', 'year'):
+            generate_report(conn, user_id, period, today)
+        load_period(conn, user_id, week_ago, day)
+        for _ in iter_record_chunks(conn, user_id, week_ago, day):
+            pass
+        save_bot_state(conn, [('user', '1', '{}'), ('chat', '1', None)])
+        load_bot_state(conn)
+        set_user_timezone(conn, user_id, 'Europe/Moscow')
+        load_user_timezones(conn)
+        set_user_reminder(conn, user_id, 1080)
+        load_user_reminders(conn)
+        set_user_digest(conn, user_id, 'week')
+        load_user_digests(conn)
+        map_user_records(conn, [user_id], week_ago, day, lambda user, records: records)
+        # Забытая сессия: реестр открытых сессий при запуске и автоматическое закрытие
+        add_time_in(conn, user_id, week_ago, 540)
+        for open_user, session in load_open_sessions(conn).items():
+            auto_close_session(conn, open_user, session.record_id)
+        # Команды
+        team = create_team(conn, user_id, 'Команда', 'Руководитель')
+        join_team(conn, user_id + 1, team.join_code, 'Сотрудник')
+        set_member_role(conn, team.id, user_id + 1, 'member')
+        user_teams(conn, user_id)
+        team_members(conn, team.id)
+        team_report(conn, team.id, week_ago, day, 480)
+        member_totals(conn, [user_id, user_id + 1], week_ago, day, 480)
+        # Шарды: размещение пользователей и перенос между файлами
+        adopt_unmapped_users(conn, 0)
+        set_user_shard(conn, user_id, 0)
+        load_shard_map(conn)
+        rows = export_user_rows(conn, user_id)
+        delete_user_rows(conn, user_id)
+        import_user_rows(conn, user_id, rows)
+        delete_records_by_date(conn, user_id, week_ago)
+        rebuild_totals(conn, user_id)
+    finally:
+        set_statement_hook(_query_log)
+        conn.close()
+    entries = log.entries()
+    # Время на пустой базе в памяти ничего не говорит о настоящей нагрузке
+    for entry in entries:
+        entry.update(count=0, total_seconds=0.0, max_seconds=0.0, slow=0)
+    return entries
+
+
+def _indexes(conn):
+    """Индексы пользовательских таблиц: имя -> (таблица, столбцы, unique, partial)"""
+    indexes = {}
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")]
+    for table in tables:
+        for _, name, unique, origin, partial in conn.execute(f'PRAGMA index_list({table})'):
+            columns = [row[2] for row in conn.execute(f'PRAGMA index_info({name})')]
+            indexes[name] = (table, columns, bool(unique), bool(partial), origin)
+    return indexes
+
+
+def analyze(db_path, entries):
+    """Строит планы запросов по настоящей базе и возвращает текст отчета"""
+    conn = sqlite3.connect(Path(db_path).resolve().as_uri() + '?mode=ro', uri=True)
+    try:
+        indexes = _indexes(conn)
+        used = set()
+        scans = []
+        # Рекомендуемый индекс -> запросы, которым он поможет
+        recommendations = {}
+
+        for entry in sorted(entries, key=lambda item: -item['total_seconds']):
+            sql = entry['sql']
+            try:
+                parameters = entry['parameters']
+                if parameters is None:
+                    # executemany: параметры не сохраняются, для плана достаточно NULL
+                    parameters = [None] * sql.count('?')
+                plan = explain(conn, sql, parameters)
+            except sqlite3.Error as e:
+                plan = [f'ошибка EXPLAIN: {e}']
+            entry['plan'] = plan
+            for detail in plan:
+                used.update(_USED_INDEX.findall(detail))
+                if _TABLE_SCAN.match(detail):
+                    scans.append((entry, detail))
+            for recommendation in _recommend_indexes(sql, plan, indexes):
+                recommendations.setdefault(recommendation, []).append(' '.join(sql.split())[:100])
+
+        lines = [f"База: {db_path}", f"Запросов в нагрузке: {len(entries)}", ""]
+
+        lines.append("Индексы:")
+        by_table = {}
+        for name, (table, columns, unique, partial, origin) in sorted(indexes.items()):
+            by_table.setdefault(table, []).append(name)
+            flags = ', '.join(flag for flag, on in (('unique', unique), ('partial', partial)) if on)
+            if origin != 'c':
+                state = 'первичный ключ' if origin == 'pk' else 'ограничение UNIQUE'
+            else:
+                state = 'используется' if name in used else 'НЕ используется'
+            lines.append(f"  {name} ON {table} ({', '.join(columns)}){f' [{flags}]' if flags else ''} - {state}")
+
+        redundant = _redundant_indexes(indexes)
+        if redundant:
+            lines.append("")
+            lines.append("Избыточные индексы (столбцы - префикс другого индекса):")
+            for name, covering in redundant:
+                lines.append(f"  {name} покрывается {covering}: DROP INDEX {name};")
+
+        unused = [name for name, (*_, origin) in indexes.items()
+                  if name not in used and origin == 'c' and name not in dict(redundant)]
+        if unused:
+            lines.append("")
+            lines.append("Неиспользуемые индексы (только стоимость записи):")
+            for name in sorted(unused):
+                lines.append(f"  {name}: проверьте редкие запросы, затем DROP INDEX {name};")
+
+        lines.append("")
+        lines.append("Обновляемых индексов на каждую вставку:")
+        for table, names in sorted(by_table.items()):
+            lines.append(f"  {table}: {len(names)}")
+
+        if scans:
+            lines.append("")
+            lines.append("Полный просмотр таблицы:")
+            for entry, detail in scans:
+                lines.append(f"  {detail}: {' '.join(entry['sql'].split())[:150]}")
+
+        if recommendations:
+            lines.append("")
+            lines.append("Рекомендуемые индексы:")
+            for recommendation, queries in recommendations.items():
+                lines.append(f"  {recommendation}")
+                lines.extend(f"    -- {query}" for query in queries)
+
+        lines.append("")
+        lines.append("Планы запросов (по убыванию суммарного времени):")
+        for entry in sorted(entries, key=lambda item: -item['total_seconds']):
+            timing = ''
+            if entry['count']:
+                timing = (f" [{entry['count']} раз, всего {entry['total_seconds'] * 1000:.1f} мс, "
+                          f"макс {entry['max_seconds'] * 1000:.2f} мс, медленных {entry['slow']}]")
+            lines.append(f"  {' '.join(entry['sql'].split())[:150]}{timing}")
+            lines.extend(f"    {detail}" for detail in entry['plan'])
+        return '\n'.join(lines)
+    finally:
+        conn.close()
+
+
+def _redundant_indexes(indexes):
+    redundant = []
+    for name, (table, columns, unique, partial, origin) in indexes.items():
+        if unique or partial:
+            continue
+        for other, (other_table, other_columns, _, other_partial, _) in indexes.items():
+            if (other != name and other_table == table and not other_partial
+                    and len(other_columns) > len(columns) and other_columns[:len(columns)] == columns):
+                redundant.append((name, other))
+                break
+    return sorted(redundant)
+
+
+# Условие равенства находит не больше одной строки: его столбцы включают столбцы UNIQUE-индекса
+# или первичного ключа. Покрывающий индекс такому поиску ничего не дает, а запись замедляет
+def _unique_lookup(table, equality, indexes):
+    return any(other_table == table and unique and not partial and set(columns) <= set(equality)
+               for other_table, columns, unique, partial, _ in indexes.values())
+
+
+def _recommend_indexes(sql, plan, indexes):
+    """Частичные индексы для условий IS NULL, индексы без сортировки для ORDER BY
+    и покрывающие индексы для узких выборок, кроме поиска одной строки по уникальному ключу"""
+    search = next(filter(None, (_SEARCH.match(detail) for detail in plan)), None)
+    if not search:
+        return []
+    table, covering, index_name, condition = search.groups()
+    if index_name not in indexes or indexes[index_name][3]:
+        return []
+    equality = re.findall(r'(\w+)=\?', condition or '')
+    if not equality:
+        return []
+    recommendations = []
+
+    null_columns = [column for column in _IS_NULL.findall(sql) if column not in equality]
+    if null_columns:
+        recommendations.append(f"CREATE INDEX idx_{table}_open ON {table} ({', '.join(equality)}) "
+                               f"WHERE {null_columns[0]} IS NULL;")
+
+    order_by = _ORDER_BY.search(sql)
+    if order_by and any(detail.startswith('USE TEMP B-TREE') for detail in plan):
+        ranged = [column for column in re.findall(r'(\w+)[<>]', condition or '') if column not in equality]
+        columns = list(dict.fromkeys(equality + ranged + [column.strip() for column in order_by.group(1).split(',')]))
+        recommendations.append(f"CREATE INDEX idx_{table}_{'_'.join(columns)} ON {table} ({', '.join(columns)});"
+                               f"  -- заменяет {index_name}, убирает сортировку")
+
+    select = _SELECT_LIST.match(sql)
+    if (not null_columns and not order_by and not covering and select and select.group(2) == table
+            and not _unique_lookup(table, equality, indexes)):
+        selected = [re.sub(r'^\w+\((\w+)\)$', r'\1', column.strip()) for column in select.group(1).split(',')]
+        extra = [column for column in dict.fromkeys(selected) if column not in equality]
+        if all(_IDENTIFIER.match(column) for column in selected) and 0 < len(extra) <= 2:
+            columns = equality + extra
+            recommendations.append(f"CREATE INDEX idx_{table}_{'_'.join(columns)} ON {table} ({', '.join(columns)});"
+                                   f"  -- покрывающий")
+    return recommendations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Диагностика запросов и индексов базы табеля')
+    commands = parser.add_subparsers(dest='command', required=True)
+    report_parser = commands.add_parser('report', help='отчет по индексам и планам запросов')
+    report_parser.add_argument('--db', default=DB_PATH)
+    report_parser.add_argument('--stats', help='файл статистики из режима DB_SLOW_QUERY_MS')
+    args = parser.parse_args(argv)
+
+    if not Path(args.db).exists():
+        raise SystemExit(f"База не найдена: {args.db}")
+    if args.stats:
+        entries = json.loads(Path(args.stats).read_text(encoding='utf-8'))
+    else:
+        entries = replay_workload()
+    print(analyze(args.db, entries))
+
+
+if __name__ == '__main__':
+    main()
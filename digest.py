@@ -0,0 +1,183 @@
+"""Сводки за прошлую неделю или месяц, которые бот присылает сам.
+
+Пользователь подписывается командой /digest week или /digest month (off -
+отписаться). Раз в сутки в DIGEST_TIME по времени сервера (DEFAULT_TIMEZONE,
+если он задан) - в часы наименьшей нагрузки - задача JobQueue готовит сводки тем,
+у кого по их поясу наступил понедельник (неделя) или первое число (месяц):
+
+- подписчики одного периода читаются пачками по DIGEST_BATCH одним проходом по
+  records, сгруппированным по пользователю (map_user_records); страницы
+  форматируются там же, вне цикла событий, тем же render_period_report, что и
+  отчет по запросу;
+- готовые страницы кладутся в кэш отчетов под ключом (user_id, период, начало)
+  на DIGEST_CACHE_TTL секунд, поэтому листание сводки по кнопкам - попадания в
+  кэш до первой записи пользователя (или вытеснения из кэша);
+- отправка идет через ThrottledSender (см. notifications.py) с темпом ниже лимита
+  Telegram и паузой по RetryAfter; заблокировавшие бота отписываются.
+
+Кроме того, в DIGEST_WARM_TIME (до вечернего пика, когда все открывают «Неделя»)
+та же задача готовит подписчикам отчет за текущую неделю и кладет его в кэш под
+ключом отчета по запросу. Любая отметка пользователя сбрасывает его кэш, поэтому
+попаданием становятся запросы тех, кто после прогрева ничего не отмечал (например,
+ушел раньше или смотрит отчет за неделю без новых отметок); остальным отчет
+считается по запросу, как и без прогрева.
+
+Если бот не работал в DIGEST_TIME, сводки этого дня не отправляются.
+
+    DIGEST_TIME=04:00       время рассылки (off отключает)
+    DIGEST_WARM_TIME=16:00  время прогрева отчета за текущую неделю (off отключает)
+    DIGEST_BATCH=500        подписчиков на один проход по records
+"""
+import logging
+import os
+import time
+import warnings
+from collections import defaultdict, namedtuple
+from datetime import datetime, time as dtime, timedelta
+from functools import partial
+
+from telegram.error import Forbidden
+from telegram.warnings import PTBUserWarning
+
+from notifications import ThrottledSender
+from report_cache import CachedReport
+from reports import render_period_report
+from storage import period_bounds
+from time_parser import parse_time
+from timezones import DEFAULT_TIMEZONE, get_zone
+
+logger = logging.getLogger(__name__)
+
+DIGEST_TIME = os.environ.get('DIGEST_TIME', '04:00')
+DIGEST_WARM_TIME = os.environ.get('DIGEST_WARM_TIME', '16:00')
+DIGEST_BATCH = int(os.environ.get('DIGEST_BATCH', 500))
+DIGEST_CACHE_TTL = 24 * 3600
+
+DIGEST_PERIODS = ('week', 'month')
+DIGEST_NAMES = {'week': 'еженедельная', 'month': 'ежемесячная'}
+
+DigestResult = namedtuple('DigestResult', ['subscribers', 'due', 'sent', 'unsubscribed', 'seconds'])
+WarmResult = namedtuple('WarmResult', ['subscribers', 'cached', 'seconds'])
+
+
+# Границы сводки, которая положена пользователю сегодня: прошлая неделя по понедельникам,
+# прошлый месяц первого числа; иначе None
+def digest_bounds(period, today):
+    if period == 'week' and today.weekday() == 0:
+        return period_bounds('week', today - timedelta(days=7))
+    if period == 'month' and today.day == 1:
+        return period_bounds('month', today - timedelta(days=1))
+    return None
+
+
+# Страницы сводки одного пользователя; выполняется в потоке чтения хранилища
+def render_digest(period, start_date, end_date, user_id, records):
+    total_minutes, pages = render_period_report(period, start_date, end_date, records)
+    return CachedReport(total_minutes, tuple(pages))
+
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class DigestJob:
+    """Ежедневная подготовка и рассылка сводок подписчикам.
+
+    keyboard(period, start_date, page, has_next) - кнопки листания, те же, что у
+    отчета по запросу, чтобы листание сводки обрабатывал report_page_callback.
+    Используется из цикла событий.
+    """
+
+    def __init__(self, repo, keyboard, sender=None, batch_size=DIGEST_BATCH):
+        self._repo = repo
+        self._keyboard = keyboard
+        self._sender = sender or ThrottledSender()
+        self._batch_size = batch_size
+
+    def schedule(self, application, at=DIGEST_TIME, warm_at=DIGEST_WARM_TIME):
+        """Ставит рассылку и прогрев в JobQueue; False, если JobQueue недоступна или обе задачи отключены"""
+        times = {name: value for name, value in (('digest', at), ('digest-warm', warm_at))
+                 if value and value.lower() != 'off'}
+        if not times:
+            return False
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', PTBUserWarning)
+            job_queue = application.job_queue
+        if job_queue is None:
+            logger.warning("JobQueue недоступна: сводки не рассылаются. Установите python-telegram-bot[job-queue]")
+            return False
+        zone = get_zone(DEFAULT_TIMEZONE) if DEFAULT_TIMEZONE else datetime.now().astimezone().tzinfo
+        callbacks = {'digest': self._run_job, 'digest-warm': self._warm_job}
+        for name, value in times.items():
+            minutes = parse_time(value)
+            job_queue.run_daily(callbacks[name], time=dtime(minutes // 60, minutes % 60, tzinfo=zone), name=name)
+        return True
+
+    async def _run_job(self, context):
+        await self.run(context.bot)
+
+    async def _warm_job(self, context):
+        await self.warm()
+
+    async def _prepare(self, period, start_date, end_date, user_ids):
+        """Готовит страницы пачками, кладет их в кэш отчетов и выдает {user_id: CachedReport} каждой пачки"""
+        render = partial(render_digest, period, start_date, end_date)
+        for batch in _batches(sorted(user_ids), self._batch_size):
+            # Версия до чтения: запись пользователя во время подготовки не даст положить отчет в кэш
+            versions = {user_id: self._repo.cache.version(user_id) for user_id in batch}
+            reports = await self._repo.map_user_records(
+                batch, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'), render)
+            for user_id, report in reports.items():
+                self._repo.cache.put((user_id, period, start_date), report, versions[user_id],
+                                     ttl=DIGEST_CACHE_TTL)
+            yield reports
+
+    async def warm(self, now=None):
+        """Кладет в кэш отчет за текущую неделю каждого подписчика; now (секунды эпохи) задается в проверках"""
+        started = time.perf_counter()
+        subscribers = list(self._repo.digests)
+        weeks = defaultdict(list)
+        for user_id in subscribers:
+            weeks[period_bounds('week', self._repo.clock.today(user_id, now))].append(user_id)
+
+        cached = 0
+        for (start_date, end_date), user_ids in weeks.items():
+            async for reports in self._prepare('week', start_date, end_date, user_ids):
+                cached += len(reports)
+
+        result = WarmResult(len(subscribers), cached, round(time.perf_counter() - started, 2))
+        if result.cached:
+            logger.info(f"Прогрев отчетов за неделю: {result}")
+        return result
+
+    async def run(self, bot, now=None):
+        """Одна рассылка; now (секунды эпохи) задается в проверках"""
+        started = time.perf_counter()
+        subscribers = list(self._repo.digests.items())
+        due = defaultdict(list)
+        for user_id, period in subscribers:
+            bounds = digest_bounds(period, self._repo.clock.today(user_id, now))
+            if bounds is not None:
+                due[(period, *bounds)].append(user_id)
+
+        sent = unsubscribed = 0
+        for (period, start_date, end_date), user_ids in due.items():
+            async for reports in self._prepare(period, start_date, end_date, user_ids):
+                # Без записей за период сводка не отправляется
+                for user_id, report in reports.items():
+                    has_next = len(report.pages) > 1
+                    reply_markup = self._keyboard(period, start_date, 0, has_next) if has_next else None
+                    try:
+                        # Личный чат с пользователем имеет тот же id
+                        sent += await self._sender.send(bot, user_id, report.pages[0], reply_markup=reply_markup)
+                    except Forbidden:
+                        # Пользователь заблокировал бота
+                        await self._repo.set_digest(user_id, None)
+                        unsubscribed += 1
+
+        result = DigestResult(len(subscribers), sum(len(user_ids) for user_ids in due.values()), sent,
+                              unsubscribed, round(time.perf_counter() - started, 2))
+        if result.due:
+            logger.info(f"Рассылка сводок: {result}")
+        return result
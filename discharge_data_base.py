@@ -1,36 +1,202 @@
+"""Резервная копия и выгрузка базы без остановки бота.
+
+    python discharge_data_base.py backup backup.db
+    python discharge_data_base.py dump --user 123 --from 2024-01-01 --format csv -o user.csv
+
+backup копирует базу через sqlite3.Connection.backup() порциями страниц с паузой
+между ними: между шагами база не заблокирована, и поток записи бота не ждет.
+dump потоково выгружает записи журнала (с фильтром по пользователю и датам) в
+JSON Lines или CSV, не загружая выборку в память. Ход работы и скорость
+выводятся в stderr, поэтому данные можно перенаправлять в stdout.
+
+Если рядом с базой есть файлы шардов (timesheet-N.db, см. sharding.py), backup
+копирует каждый в файл с тем же суффиксом рядом с копией (backup.db,
+backup-1.db, ...), а dump выгружает записи всех шардов подряд.
+"""
+import argparse
+import csv
+import json
 import sqlite3
+import sys
+import time
+from pathlib import Path
+
+from db_paths import DB_PATH, existing_shards, shard_path
+
+# Сколько строк забирать из курсора за раз
+DUMP_CHUNK_SIZE = 5000
+# Как часто (в строках) печатать ход выгрузки
+DUMP_PROGRESS_EVERY = 50000
+
+RECORD_COLUMNS = ('id', 'user_id', 'date', 'time_in', 'time_out', 'lunch_start', 'lunch_end',
+                  'lunch_minutes', 'worked_minutes', 'auto_closed')
+
+
+def _connect_ro(db_path):
+    if not Path(db_path).exists():
+        raise SystemExit(f"База не найдена: {db_path}")
+    return sqlite3.connect(Path(db_path).resolve().as_uri() + '?mode=ro', uri=True)
+
+
+def _log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def backup(db_path, dest, pages, pause):
+    """Копирует базу по pages страниц за шаг, засыпая на pause секунд между шагами.
+
+    Если другое соединение меняет базу во время копирования, SQLite начинает
+    копирование заново; это видно в ходе работы как рост оставшихся страниц.
+    """
+    started = time.perf_counter()
+    state = {'remaining': None, 'restarts': 0}
+
+    def progress(status, remaining, total):
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            _log("База изменилась во время копирования, копирование начато заново")
+        state['remaining'] = remaining
+        done = total - remaining
+        elapsed = time.perf_counter() - started
+        rate = done * page_size / elapsed / 2 ** 20 if elapsed else 0.0
+        _log(f"Скопировано {done}/{total} страниц ({done * 100 // max(total, 1)}%), {rate:.1f} МБ/с")
+        if remaining and pause:
+            time.sleep(pause)
+
+    with _connect_ro(db_path) as source:
+        page_size = source.execute('PRAGMA page_size').fetchone()[0]
+        target = sqlite3.connect(dest)
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        finally:
+            target.close()
+    source.close()
+
+    elapsed = time.perf_counter() - started
+    size = Path(dest).stat().st_size
+    _log(f"Готово: {dest}, {size / 2 ** 20:.1f} МБ за {elapsed:.2f} с "
+         f"({size / 2 ** 20 / elapsed if elapsed else 0:.1f} МБ/с), перезапусков: {state['restarts']}")
+
+
+# Пары (номер шарда, файл) базы db_path; без файлов шардов - одна пара (0, db_path)
+def _shard_files(db_path):
+    if not Path(db_path).exists():
+        raise SystemExit(f"База не найдена: {db_path}")
+    return [(shard, shard_path(db_path, shard)) for shard in existing_shards(db_path)]
+
+
+def backup_shards(db_path, dest, pages, pause):
+    """Копирует основную базу и все файлы шардов: шард N - в файл dest с суффиксом -N"""
+    shards = _shard_files(db_path)
+    for shard, path in shards:
+        if len(shards) > 1:
+            _log(f"Шард {shard}: {path}")
+        backup(path, shard_path(dest, shard), pages, pause)
 
 
-"""Выводит все данные из всех таблиц в консоль"""
-with sqlite3.connect('timesheet.db') as conn:
-    conn.row_factory = sqlite3.Row
+def _select_records(conn, user_id, date_from, date_to):
+    conditions, params = [], []
+    if user_id is not None:
+        conditions.append('user_id = ?')
+        params.append(user_id)
+    if date_from:
+        conditions.append('date >= ?')
+        params.append(date_from)
+    if date_to:
+        conditions.append('date <= ?')
+        params.append(date_to)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    # Порядок по user_id и date идет по индексу idx_user_date без сортировки
     cursor = conn.cursor()
+    cursor.execute(f"SELECT {', '.join(RECORD_COLUMNS)} FROM records {where} ORDER BY user_id, date, time_in",
+                   params)
+    return cursor
+
+
+def _jsonl_writer(output):
+    def write(rows):
+        output.writelines(json.dumps(dict(zip(RECORD_COLUMNS, row))) + '\n' for row in rows)
+    return write
+
+
+def _csv_writer(output):
+    writer = csv.writer(output)
+    writer.writerow(RECORD_COLUMNS)
+    return writer.writerows
+
+
+def dump(db_path, output, file_format, user_id=None, date_from=None, date_to=None):
+    """Выгружает записи журнала основной базы и всех шардов пачками по DUMP_CHUNK_SIZE строк"""
+    write = _csv_writer(output) if file_format == 'csv' else _jsonl_writer(output)
+    started = time.perf_counter()
+    count = 0
+    next_report = DUMP_PROGRESS_EVERY
+
+    # Пользователь лежит целиком в одном шарде, поэтому порядок по user_id сохраняется внутри шарда
+    for shard, path in _shard_files(db_path):
+        with _connect_ro(path) as conn:
+            cursor = _select_records(conn, user_id, date_from, date_to)
+            while True:
+                rows = cursor.fetchmany(DUMP_CHUNK_SIZE)
+                if not rows:
+                    break
+                write(rows)
+                count += len(rows)
+                if count >= next_report:
+                    elapsed = time.perf_counter() - started
+                    _log(f"Выгружено {count} строк, {count / elapsed:.0f} строк/с")
+                    next_report += DUMP_PROGRESS_EVERY
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    _log(f"Готово: {count} строк за {elapsed:.2f} с ({count / elapsed if elapsed else 0:.0f} строк/с)")
+
+
+def _iso_date(text):
+    try:
+        return time.strftime('%Y-%m-%d', time.strptime(text, '%Y-%m-%d'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"неверная дата {text!r}, ожидается ГГГГ-ММ-ДД")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Резервная копия и выгрузка базы табеля')
+    parser.add_argument('--db', default=DB_PATH, help=f'путь к базе (по умолчанию {DB_PATH})')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    backup_parser = commands.add_parser('backup', help='онлайн-копия базы через backup API')
+    backup_parser.add_argument('dest', help='файл копии')
+    backup_parser.add_argument('--pages', type=int, default=1024,
+                               help='страниц за шаг, -1 - все сразу (по умолчанию 1024)')
+    backup_parser.add_argument('--pause', type=float, default=0.01,
+                               help='пауза между шагами в секундах (по умолчанию 0.01)')
+
+    dump_parser = commands.add_parser('dump', help='потоковая выгрузка записей журнала')
+    dump_parser.add_argument('--user', type=int, help='только записи этого пользователя')
+    dump_parser.add_argument('--from', dest='date_from', type=_iso_date, help='с даты ГГГГ-ММ-ДД')
+    dump_parser.add_argument('--to', dest='date_to', type=_iso_date, help='по дату ГГГГ-ММ-ДД')
+    dump_parser.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl')
+    dump_parser.add_argument('-o', '--output', help='файл результата (по умолчанию stdout)')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == 'backup':
+        shards = _shard_files(args.db)
+        sources = {Path(path).resolve() for _, path in shards}
+        if any(Path(shard_path(args.dest, shard)).resolve() in sources for shard, _ in shards):
+            raise SystemExit("Файл копии совпадает с базой или ее шардом")
+        backup_shards(args.db, args.dest, args.pages, args.pause)
+        return
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as output:
+            dump(args.db, output, args.format, args.user, args.date_from, args.date_to)
+    else:
+        dump(args.db, sys.stdout, args.format, args.user, args.date_from, args.date_to)
+
 
-    # Получаем список всех таблиц
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-    tables = cursor.fetchall()
-
-    print("\n" + "=" * 50)
-    print("ПОЛНЫЙ ДАМП БАЗЫ ДАННЫХ")
-    print("=" * 50)
-
-    for table in tables:
-        table_name = table['name']
-        print(f"\nТаблица: {table_name}")
-        print("-" * 50)
-
-        # Получаем данные из таблицы
-        cursor.execute(f"SELECT * FROM {table_name}")
-        rows = cursor.fetchall()
-
-        # Выводим заголовки столбцов
-        if rows:
-            columns = rows[0].keys()
-            print(" | ".join(columns))
-            print("-" * 50)
-
-            # Выводим данные
-            for row in rows:
-                print(" | ".join(str(row[col]) for col in columns))
-        else:
-            print("Таблица пуста")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import csv
+import io
+import tempfile
+from datetime import datetime
+
+from importer import COLUMNS
+from reports import minutes_to_clock_str, minutes_to_time_str
+from teams import ROLE_NAMES
+
+# Сколько строк за раз забирать из курсора
+EXPORT_CHUNK_SIZE = 1000
+# До этого размера файл держится в памяти, дальше сбрасывается на диск
+EXPORT_SPOOL_SIZE = 4 * 1024 * 1024
+# Ограничение Bot API на размер отправляемого документа
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+EXPORT_FORMATS = ('csv', 'xlsx', 'parquet')
+
+# Столбцы CSV/XLSX совпадают с форматом импорта, отработанное время - дополнительный столбец
+EXPORT_COLUMNS = COLUMNS + ('Отработано',)
+
+# В Parquet столбцы типизированы: дата и минуты как числа, без форматирования
+PARQUET_COLUMNS = ('date', 'time_in', 'time_out', 'lunch_start', 'lunch_end', 'lunch_minutes', 'worked_minutes')
+
+
+def iter_record_chunks(conn, user_id, start_date, end_date, chunk_size=EXPORT_CHUNK_SIZE):
+    """Выдает записи периода пачками через fetchmany, не загружая выборку целиком.
+
+    Строки: (date, time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes).
+    """
+    cursor = conn.cursor()
+    cursor.execute('''SELECT date, time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes
+                      FROM records
+                      WHERE user_id = ? AND date BETWEEN ? AND ?
+                      ORDER BY date, time_in''', (user_id, start_date, end_date))
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+# Строка в том виде, в каком ее принимает /import
+def _display_row(row):
+    date_str, time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes = row
+    return (
+        datetime.strptime(date_str, '%Y-%m-%d').strftime('%d.%m.%Y'),
+        minutes_to_clock_str(time_in),
+        '' if time_out is None else minutes_to_clock_str(time_out),
+        '' if lunch_start is None else minutes_to_clock_str(lunch_start),
+        '' if lunch_end is None else minutes_to_clock_str(lunch_end),
+        '' if lunch_minutes is None else lunch_minutes,
+        '' if worked_minutes is None else minutes_to_time_str(worked_minutes),
+    )
+
+
+# Отчет по команде (teams.MemberTotals): время в ЧЧ:ММ, как в сообщениях бота
+TEAM_REPORT_FORMATS = ('csv', 'xlsx')
+TEAM_REPORT_COLUMNS = ('ID', 'Сотрудник', 'Роль', 'Отработано', 'Дней', 'Сессий', 'Переработка', 'Недоработка')
+
+
+def _team_row(row):
+    return (row.user_id, row.name, ROLE_NAMES.get(row.role, row.role), minutes_to_time_str(row.minutes), row.days,
+            row.sessions, minutes_to_time_str(row.overtime_minutes), minutes_to_time_str(row.undertime_minutes))
+
+
+def _write_csv(chunks, file, columns=EXPORT_COLUMNS, display_row=_display_row, title=None):
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='', write_through=True)
+    writer = csv.writer(text, delimiter=';')
+    writer.writerow(columns)
+    count = 0
+    for rows in chunks:
+        writer.writerows(display_row(row) for row in rows)
+        count += len(rows)
+    text.detach()
+    return count
+
+
+def _write_xlsx(chunks, file, columns=EXPORT_COLUMNS, display_row=_display_row, title='Журнал'):
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ValueError("для выгрузки в XLSX на сервере должен быть установлен openpyxl")
+    # В режиме write_only строки не копятся в памяти, а сразу пишутся во временный XML
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title)
+    sheet.append(columns)
+    count = 0
+    for rows in chunks:
+        for row in rows:
+            sheet.append(display_row(row))
+        count += len(rows)
+    workbook.save(file)
+    return count
+
+
+def _write_parquet(chunks, file):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("для выгрузки в Parquet на сервере должен быть установлен pyarrow")
+    schema = pa.schema([('date', pa.date32())] + [(name, pa.int32()) for name in PARQUET_COLUMNS[1:]])
+    count = 0
+    # Каждая пачка становится отдельной группой строк файла
+    with pq.ParquetWriter(file, schema) as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            columns[0] = [datetime.strptime(value, '%Y-%m-%d').date() for value in columns[0]]
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema))
+            count += len(rows)
+    return count
+
+
+_WRITERS = {'csv': _write_csv, 'xlsx': _write_xlsx, 'parquet': _write_parquet}
+
+
+def write_export(chunks, file_format, **options):
+    """Пишет пачки строк в SpooledTemporaryFile.
+
+    Возвращает (file, count); файл перемотан в начало, закрывает его вызывающий.
+    Неподдерживаемый формат или отсутствующая библиотека - ValueError.
+    options (columns, display_row, title) заменяют столбцы журнала в CSV/XLSX.
+    """
+    writer = _WRITERS.get(file_format)
+    if writer is None:
+        raise ValueError(f"неизвестный формат {file_format!r}, доступны: {', '.join(EXPORT_FORMATS)}")
+    file = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    try:
+        count = writer(chunks, file, **options)
+        file.seek(0)
+    except BaseException:
+        file.close()
+        raise
+    return file, count
+
+
+# Выгрузка из SQLite (выполняется в пуле чтения)
+def build_export(conn, user_id, start_date, end_date, file_format, chunk_size=EXPORT_CHUNK_SIZE):
+    return write_export(iter_record_chunks(conn, user_id, start_date, end_date, chunk_size), file_format)
+
+
+# Таблица отчета по команде для вложения в сообщение
+def write_team_report(rows, file_format):
+    if file_format not in TEAM_REPORT_FORMATS:
+        raise ValueError(f"неизвестный формат {file_format!r}, доступны: {', '.join(TEAM_REPORT_FORMATS)}")
+    return write_export([rows], file_format, columns=TEAM_REPORT_COLUMNS, display_row=_team_row, title='Команда')
@@ -0,0 +1,194 @@
+import asyncio
+import csv
+import io
+import logging
+import re
+from datetime import date, datetime, time
+
+from shifts import MINUTES_PER_DAY, normalize_shift
+from time_parser import parse_time
+
+logger = logging.getLogger(__name__)
+
+# Размер пачки строк: одна пачка - одна транзакция потока записи
+IMPORT_CHUNK_SIZE = 500
+# Сколько ошибок показывать пользователю в итоговом сообщении
+MAX_REPORTED_ERRORS = 20
+
+# Порядок столбцов файла: дата, вход, выход, начало обеда, конец обеда, минуты обеда
+COLUMNS = ('Дата', 'Вход', 'Выход', 'Начало обеда', 'Конец обеда', 'Минуты обеда')
+
+_NEXT_DAY = re.compile(r'(.+?)\s*\(\+(\d+)\)')
+
+
+class ImportResult:
+    """Итог импорта: число добавленных записей и ошибки по номерам строк"""
+
+    def __init__(self):
+        self.imported = 0
+        self.errors = []
+        self.failure = None
+
+    def summary(self):
+        message = f"✅ Импортировано записей: {self.imported}\n"
+        if self.failure:
+            message += f"⚠️ Импорт прерван: {self.failure}\n"
+        if not self.errors:
+            return message + "Ошибок нет."
+        message += f"❌ Строк с ошибками: {len(self.errors)}\n\n"
+        for line_number, error in self.errors[:MAX_REPORTED_ERRORS]:
+            message += f"Строка {line_number}: {error}\n"
+        if len(self.errors) > MAX_REPORTED_ERRORS:
+            message += f"... и еще {len(self.errors) - MAX_REPORTED_ERRORS}"
+        return message.rstrip('\n')
+
+
+# Значение ячейки в виде строки (в XLSX даты и время приходят объектами)
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%d.%m.%Y') if value.time() == time() else value.strftime('%H:%M')
+    if isinstance(value, date):
+        return value.strftime('%d.%m.%Y')
+    if isinstance(value, time):
+        return value.strftime('%H:%M')
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _parse_date(text):
+    for date_format in ('%d.%m.%Y', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(text, date_format).strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    raise ValueError(f"неверная дата {text!r}, ожидается ДД.ММ.ГГГГ")
+
+
+def _parse_optional_time(text, column):
+    if not text:
+        return None
+    # Экспорт записывает время следующих суток ночной смены как 06:00 (+1)
+    clock, days = text, 0
+    match = _NEXT_DAY.fullmatch(text)
+    if match:
+        clock, days = match.group(1), int(match.group(2))
+    try:
+        return parse_time(clock) + days * MINUTES_PER_DAY
+    except ValueError:
+        raise ValueError(f"неверное время в столбце «{column}»: {text!r}")
+
+
+def parse_row(cells):
+    """Проверяет строку файла по тем же правилам, что и пошаговое добавление записи.
+
+    Возвращает (date, time_in, time_out, lunch_start, lunch_end, lunch_minutes)
+    или бросает ValueError с описанием ошибки.
+    """
+    cells = [_cell_text(value) for value in cells] + [''] * len(COLUMNS)
+    date_text, time_in_text, time_out_text, lunch_start_text, lunch_end_text, lunch_minutes_text = cells[:6]
+
+    record_date = _parse_date(date_text)
+    time_in = _parse_optional_time(time_in_text, 'Вход')
+    time_out = _parse_optional_time(time_out_text, 'Выход')
+    if time_in is None or time_out is None:
+        raise ValueError("не указано время входа или выхода")
+    if time_in >= MINUTES_PER_DAY:
+        raise ValueError("время входа должно быть временем суток дня записи")
+
+    lunch_start = _parse_optional_time(lunch_start_text, 'Начало обеда')
+    lunch_end = _parse_optional_time(lunch_end_text, 'Конец обеда')
+    if (lunch_start is None) != (lunch_end is None):
+        raise ValueError("у обеда должны быть указаны и начало, и конец")
+    # Выход раньше входа - ночная смена, он и обед после полуночи относятся к следующему дню;
+    # выход, равный входу, normalize_shift отклоняет
+    time_in, time_out, lunch_start, lunch_end = normalize_shift(time_in, time_out, lunch_start, lunch_end)
+    if lunch_start is not None and lunch_end > time_out:
+        raise ValueError("обед выходит за пределы смены")
+
+    lunch_minutes = None
+    if lunch_minutes_text:
+        try:
+            lunch_minutes = int(lunch_minutes_text)
+        except ValueError:
+            raise ValueError(f"минуты обеда должны быть целым числом: {lunch_minutes_text!r}")
+        if lunch_minutes < 0:
+            raise ValueError("минуты обеда не могут быть отрицательными")
+
+    return record_date, time_in, time_out, lunch_start, lunch_end, lunch_minutes
+
+
+def iter_csv_rows(path):
+    """Построчно читает CSV (разделитель ; или ,), не загружая файл целиком"""
+    with open(path, 'rb') as raw:
+        text = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+        first_line = text.readline()
+        delimiter = ';' if first_line.count(';') >= first_line.count(',') else ','
+        yield from csv.reader([first_line], delimiter=delimiter)
+        yield from csv.reader(text, delimiter=delimiter)
+
+
+def iter_xlsx_rows(path):
+    """Построчно читает первый лист XLSX в режиме read_only"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("для импорта XLSX на сервере должен быть установлен openpyxl")
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+# Следующая пачка корректных строк; ошибки складываются в result
+def _next_chunk(rows, result, chunk_size, line_counter):
+    chunk = []
+    for cells in rows:
+        line_counter[0] += 1
+        line_number = line_counter[0]
+        if not any(_cell_text(value) for value in cells):
+            continue
+        try:
+            chunk.append(parse_row(cells))
+        except ValueError as e:
+            # Первая строка может быть заголовком с названиями столбцов
+            if line_number == 1 and not _cell_text(cells[0])[:1].isdigit():
+                continue
+            result.errors.append((line_number, str(e)))
+            continue
+        if len(chunk) >= chunk_size:
+            break
+    return chunk
+
+
+async def import_timesheet(repo, user_id, path, file_format, chunk_size=IMPORT_CHUNK_SIZE):
+    """Потоково разбирает файл в фоновом потоке и записывает его пачками.
+
+    Пачки, записанные до ошибки чтения файла или записи в базу, остаются в
+    базе и учтены в result.imported; сама ошибка попадает в result.failure.
+    """
+    rows = iter_xlsx_rows(path) if file_format == 'xlsx' else iter_csv_rows(path)
+    result = ImportResult()
+    line_counter = [0]
+    try:
+        while True:
+            try:
+                chunk = await asyncio.to_thread(_next_chunk, rows, result, chunk_size, line_counter)
+            except Exception as e:
+                # Кроме ValueError/OSError разбора это csv.Error и ошибки zip/openpyxl на битом файле
+                result.failure = str(e) or type(e).__name__
+                break
+            if not chunk:
+                break
+            try:
+                result.imported += await repo.add_records(user_id, chunk)
+            except Exception:
+                logger.exception(f"Ошибка записи импорта пользователя {user_id}")
+                result.failure = "не удалось сохранить записи, повторите импорт оставшихся строк позже"
+                break
+    finally:
+        rows.close()
+    return result
@@ -1,10 +1,37 @@
-import logging
-from datetime import datetime, timedelta
-import sqlite3
-from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ConversationHandler
 import asyncio
+import logging
+import tempfile
+from datetime import date, datetime
+from itertools import islice
+from telegram import (
+    InlineKeyboardButton, InlineKeyboardMarkup, InputFile, ReplyKeyboardMarkup, ReplyKeyboardRemove
+)
+from telegram.ext import (
+    Application, CallbackQueryHandler, CommandHandler, MessageHandler, filters, ConversationHandler
+)
 from pathlib import Path
+from report_cache import CachedReport
+from diagnostics import enable_from_env as enable_diagnostics_from_env
+from exporter import EXPORT_FORMATS, MAX_DOCUMENT_SIZE, TEAM_REPORT_FORMATS, write_team_report
+from importer import import_timesheet
+from metrics import (
+    TimedHTTPXRequest, instrument_application, register_runtime_gauges, start_metrics_server
+)
+from notifications import ThrottledSender
+from persistence import SqlitePersistence
+from reports import (
+    MESSAGE_LIMIT, closed_minutes, format_member_line, format_norm_lines, format_record_line, format_statistics,
+    format_team_summary, iter_report_pages, minutes_to_clock_str, minutes_to_time_str, render_period_report, text_length
+)
+from backend import open_backend
+from digest import DIGEST_NAMES, DigestJob
+from storage import calculate_work_minutes, period_bounds
+from scheduler import SessionSweeper
+from shifts import MAX_SHIFT_HOURS, StaleSessionError, normalize_shift
+from teams import ROLE_MANAGER, ROLE_NAMES, ROLES
+from time_parser import parse_time
+from timezones import format_offset, get_zone
+from webhook import WebhookConfig, create_web_app, run_webhook
 
 # Настройка логирования
 logging.basicConfig(
@@ -19,37 +46,15 @@ logger = logging.getLogger(__name__)
     ADD_RECORD_DATE, ADD_RECORD_TIME_IN, ADD_RECORD_TIME_OUT,
     ADD_RECORD_LUNCH_START, ADD_RECORD_LUNCH_END, ADD_RECORD_LUNCH_MINUTES,
     CALC_TIME_IN, CALC_TIME_OUT, CALC_LUNCH_MINUTES,
-    DELETE_RECORD_DATE, DELETE_CONFIRM
-) = range(15)
-
-
-# Функция для преобразования часов в формате float в строку времени (ЧЧ:ММ)
-def float_hours_to_time_str(hours_float):
-    """Преобразует часы в формате float в строку времени ЧЧ:ММ"""
-    if hours_float is None:
-        return "0:00"
-
-    hours = int(hours_float)
-    minutes = int(round((hours_float - hours) * 60))
-
-    # Обработка случая, когда минуты достигают 60
-    if minutes >= 60:
-        hours += 1
-        minutes = 0
-
-    return f"{hours}:{minutes:02d}"
-
-
-# Функция для преобразования минут в строку времени (ЧЧ:ММ)
-def minutes_to_time_str(total_minutes):
-    """Преобразует минуты в строку времени ЧЧ:ММ"""
-    if total_minutes is None:
-        return "0:00"
+    DELETE_RECORD_DATE, DELETE_CONFIRM,
+    IMPORT_FILE
+) = range(16)
 
-    hours = total_minutes // 60
-    minutes = total_minutes % 60
 
-    return f"{hours}:{minutes:02d}"
+# Периоды в аргументах /team_report и /digest
+PERIOD_ARGS = {'неделя': 'week', 'week': 'week', 'месяц': 'month', 'month': 'month'}
+# Сколько строк отчета по команде еще показывать сообщением, а не файлом
+TEAM_TABLE_ROWS = 40
 
 
 # Чтение токена из файла
@@ -64,265 +69,10 @@ def get_token():
         return None
 
 
-# Инициализация базы данных с оптимизацией
-def init_db():
-    conn = sqlite3.connect('timesheet.db', check_same_thread=False)
-    conn.execute('PRAGMA journal_mode=WAL')
-    cursor = conn.cursor()
-    cursor.execute('''
-                   CREATE TABLE IF NOT EXISTS records
-                   (
-                       id
-                       INTEGER
-                       PRIMARY
-                       KEY
-                       AUTOINCREMENT,
-                       user_id
-                       INTEGER,
-                       date
-                       TEXT,
-                       time_in
-                       TEXT,
-                       time_out
-                       TEXT,
-                       lunch_start
-                       TEXT,
-                       lunch_end
-                       TEXT,
-                       lunch_minutes
-                       INTEGER,
-                       total_hours
-                       REAL
-                   )
-                   ''')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_date ON records (user_id, date)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user ON records (user_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_date ON records (date)')
-    conn.commit()
-    conn.close()
-
-
-# Глобальное соединение с БД
-_db_connection = None
-
-
-def get_db_connection():
-    global _db_connection
-    if _db_connection is None:
-        _db_connection = sqlite3.connect('timesheet.db', check_same_thread=False)
-        _db_connection.execute('PRAGMA journal_mode=WAL')
-    return _db_connection
-
-
-# Расчет рабочих часов с учетом обеда (только если >4 часов)
-def calculate_work_hours(time_in, time_out, lunch_start=None, lunch_end=None, lunch_minutes=None):
-    try:
-        time_in_dt = datetime.strptime(time_in, '%H:%M')
-        time_out_dt = datetime.strptime(time_out, '%H:%M')
-
-        # Общее время между входом и выходом
-        total_time = (time_out_dt - time_in_dt).total_seconds() / 3600
-
-        # Вычитаем время обеда только если рабочее время больше 4 часов
-        if total_time > 4:
-            if lunch_start and lunch_end:
-                lunch_start_dt = datetime.strptime(lunch_start, '%H:%M')
-                lunch_end_dt = datetime.strptime(lunch_end, '%H:%M')
-                lunch_duration = (lunch_end_dt - lunch_start_dt).total_seconds() / 3600
-                total_time -= lunch_duration
-            elif lunch_minutes:
-                total_time -= lunch_minutes / 60
-
-        return max(0, round(total_time, 2))
-    except ValueError:
-        return 0
-
-
-# Получение записей за определенную дату
-def get_records_by_date(user_id, date):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''SELECT id, time_in, time_out, lunch_start, lunch_end, lunch_minutes, total_hours
-                      FROM records
-                      WHERE user_id = ? AND date =?
-                      ORDER BY time_in''', (user_id, date))
-    records = cursor.fetchall()
-    return records
-
-
-# Получение детализированных записей за период
-def get_detailed_records_period(user_id, start_date, end_date):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''SELECT date, time_in, time_out, lunch_start, lunch_end, lunch_minutes, total_hours
-                      FROM records
-                      WHERE user_id=? AND date BETWEEN ? AND ?
-                      ORDER BY date, time_in''',
-                   (user_id, start_date, end_date))
-    records = cursor.fetchall()
-    return records
-
-
-# Удаление записей за определенную дату
-def delete_records_by_date(user_id, date):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM records WHERE user_id=? AND date=?', (user_id, date))
-    deleted_count = cursor.rowcount
-    conn.commit()
-    return deleted_count
-
-
-# Добавление полной записи
-def add_complete_record(user_id, date, time_in, time_out, lunch_start=None, lunch_end=None, lunch_minutes=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    total_hours = calculate_work_hours(time_in, time_out, lunch_start, lunch_end, lunch_minutes)
-
-    cursor.execute('''INSERT INTO records
-                      (user_id, date, time_in, time_out, lunch_start, lunch_end, lunch_minutes, total_hours)
-                      VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                   (user_id, date, time_in, time_out, lunch_start, lunch_end, lunch_minutes, total_hours))
-    conn.commit()
-    return total_hours
-
-
-# Добавление записи о входе
-def add_time_in(user_id, date, time_in):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Проверяем, есть ли уже запись на эту дату
-    cursor.execute('SELECT id FROM records WHERE user_id=? AND date=? AND time_out IS NULL',
-                   (user_id, date))
-    existing = cursor.fetchone()
-
-    if existing:
-        cursor.execute('UPDATE records SET time_in=? WHERE id=?', (time_in, existing[0]))
-    else:
-        cursor.execute('INSERT INTO records (user_id, date, time_in) VALUES (?, ?, ?)',
-                       (user_id, date, time_in))
-    conn.commit()
-
-
-# Обновление записи о выходе и расчет часов
-def add_time_out(user_id, date, time_out):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        'SELECT id, time_in, lunch_start, lunch_end, lunch_minutes FROM records WHERE user_id=? AND date=? AND time_out IS NULL',
-        (user_id, date))
-    result = cursor.fetchone()
-
-    if result:
-        record_id, time_in, lunch_start, lunch_end, lunch_minutes = result
-        total_hours = calculate_work_hours(time_in, time_out, lunch_start, lunch_end, lunch_minutes)
-
-        cursor.execute('''UPDATE records
-                          SET time_out=?,
-                              total_hours=?
-                          WHERE id = ?''', (time_out, total_hours, record_id))
-    conn.commit()
-
-
-# Добавление времени начала обеда
-def add_lunch_start(user_id, date, lunch_start):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, time_in FROM records WHERE user_id=? AND date=? AND time_out IS NULL',
-                   (user_id, date))
-    result = cursor.fetchone()
-
-    if result:
-        record_id, time_in = result
-        cursor.execute('UPDATE records SET lunch_start=? WHERE id=?', (lunch_start, record_id))
-    conn.commit()
-
-
-# Добавление времени конца обеда
-def add_lunch_end(user_id, date, lunch_end):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, time_in, lunch_start FROM records WHERE user_id=? AND date=? AND time_out IS NULL',
-                   (user_id, date))
-    result = cursor.fetchone()
-
-    if result:
-        record_id, time_in, lunch_start = result
-        cursor.execute('UPDATE records SET lunch_end=? WHERE id=?', (lunch_end, record_id))
-    conn.commit()
-
-
-# Добавление минут обеда
-def add_lunch_minutes(user_id, date, lunch_minutes):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, time_in FROM records WHERE user_id=? AND date=? AND time_out IS NULL',
-                   (user_id, date))
-    result = cursor.fetchone()
-
-    if result:
-        record_id, time_in = result
-        cursor.execute('UPDATE records SET lunch_minutes=? WHERE id=?', (lunch_minutes, record_id))
-    conn.commit()
-
-
-# Генерация отчетов за период
-def generate_report(user_id, period):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    today = datetime.now().date()
-
-    if period == 'today':
-        current_date = today.strftime('%Y-%m-%d')
-        cursor.execute('''SELECT SUM(total_hours)
-                          FROM records
-                          WHERE user_id = ? AND date =?''', (user_id, current_date))
-    elif period == 'week':
-        # Начало недели (понедельник)
-        start_of_week = today - timedelta(days=today.weekday())
-        # Конец недели (воскресенье)
-        end_of_week = start_of_week + timedelta(days=6)
-        cursor.execute('''SELECT SUM(total_hours)
-                          FROM records
-                          WHERE user_id = ? AND date BETWEEN ? AND ?''',
-                       (user_id, start_of_week.strftime('%Y-%m-%d'), end_of_week.strftime('%Y-%m-%d')))
-    elif period == 'month':
-        # Начало месяца
-        start_of_month = today.replace(day=1)
-        # Конец месяца
-        if today.month == 12:
-            end_of_month = today.replace(year=today.year + 1, month=1, day=1) - timedelta(days=1)
-        else:
-            end_of_month = today.replace(month=today.month + 1, day=1) - timedelta(days=1)
-        cursor.execute('''SELECT SUM(total_hours)
-                          FROM records
-                          WHERE user_id = ? AND date BETWEEN ? AND ?''',
-                       (user_id, start_of_month.strftime('%Y-%m-%d'), end_of_month.strftime('%Y-%m-%d')))
-    else:  # year
-        start_date = (datetime.now() - timedelta(days=365)).strftime('%Y-%m-%d')
-        cursor.execute('''SELECT SUM(total_hours)
-                          FROM records
-                          WHERE user_id = ? AND date >= ?''', (user_id, start_date))
-
-    result = cursor.fetchone()
-    return result[0] or 0
-
-
-# Получение деталей за сегодня
-def get_today_details(user_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    current_date = datetime.now().strftime('%Y-%m-%d')
-
-    cursor.execute('''SELECT time_in, time_out, lunch_start, lunch_end, lunch_minutes, total_hours
-                      FROM records
-                      WHERE user_id = ? AND date =?
-                      ORDER BY time_in''', (user_id, current_date))
-    records = cursor.fetchall()
-    return records
+# Хранилище: поток записи и пул чтения открываются при старте приложения
+repo = open_backend()
+# Общий темп сообщений, которые бот отправляет сам
+notification_sender = ThrottledSender()
 
 
 # Команда старт
@@ -363,9 +113,7 @@ async def delete_record_date(update, context):
         date_db = date_obj.strftime('%Y-%m-%d')
 
         # Получаем записи за эту дату
-        records = await asyncio.get_event_loop().run_in_executor(
-            None, get_records_by_date, user_id, date_db
-        )
+        records = await repo.records_by_date(user_id, date_db)
 
         if not records:
             await update.message.reply_text(
@@ -380,23 +128,23 @@ async def delete_record_date(update, context):
 
         # Формируем сообщение с найденными записями
         message = f"Найдены записи за {date_str}:\n\n"
-        total_hours = 0
+        total_minutes = 0
 
         for i, record in enumerate(records, 1):
-            record_id, time_in, time_out, lunch_start, lunch_end, lunch_minutes, hours = record
-            message += f"{i}. ⏰ {time_in} - {time_out}"
-            if lunch_start and lunch_end:
-                message += f" | 🍽 {lunch_start}-{lunch_end}"
+            record_id, time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes = record[:7]
+            message += f"{i}. ⏰ {minutes_to_clock_str(time_in)} - {minutes_to_clock_str(time_out)}"
+            if lunch_start is not None and lunch_end is not None:
+                message += f" | 🍽 {minutes_to_clock_str(lunch_start)}-{minutes_to_clock_str(lunch_end)}"
             elif lunch_minutes:
                 message += f" | 🍽 {lunch_minutes} мин"
-            if hours:
-                time_str = float_hours_to_time_str(hours)
+            if worked_minutes is not None:
+                time_str = minutes_to_time_str(worked_minutes)
                 message += f" | ⏱ {time_str} ч.\n"
-                total_hours += hours
+                total_minutes += worked_minutes
             else:
                 message += " | ⏱ расчет...\n"
 
-        total_time_str = float_hours_to_time_str(total_hours)
+        total_time_str = minutes_to_time_str(total_minutes)
         message += f"\n📈 Всего за день: {total_time_str} часов\n\n"
         message += "Вы уверены, что хотите удалить эти записи? (да/нет)"
 
@@ -421,9 +169,7 @@ async def delete_confirm(update, context):
         date_display = context.user_data['delete_date_display']
 
         # Удаляем записи
-        deleted_count = await asyncio.get_event_loop().run_in_executor(
-            None, delete_records_by_date, user_id, date_db
-        )
+        deleted_count = await repo.delete_day(user_id, date_db)
 
         # Очищаем временные данные
         context.user_data.pop('delete_date', None)
@@ -466,8 +212,7 @@ async def worktime_calculation(update, context):
 async def calc_time_in(update, context):
     time_in_str = update.message.text
     try:
-        datetime.strptime(time_in_str, '%H:%M')
-        context.user_data['calc_time_in'] = time_in_str
+        context.user_data['calc_time_in'] = parse_time(time_in_str)
         await update.message.reply_text(
             'Введите время выхода в формате ЧЧ:ММ (например, 18:00):'
         )
@@ -481,8 +226,11 @@ async def calc_time_in(update, context):
 async def calc_time_out(update, context):
     time_out_str = update.message.text
     try:
-        datetime.strptime(time_out_str, '%H:%M')
-        context.user_data['calc_time_out'] = time_out_str
+        time_out = parse_time(time_out_str)
+        if time_out == context.user_data.get('calc_time_in'):
+            await update.message.reply_text('Время выхода совпадает со временем входа! Введите время выхода ЧЧ:ММ:')
+            return CALC_TIME_OUT
+        context.user_data['calc_time_out'] = time_out
         await update.message.reply_text(
             'Введите продолжительность обеда в минутах (например, 60):\n'
             'Если обеда не было, введите 0'
@@ -504,15 +252,17 @@ async def calc_lunch_minutes(update, context):
         # Получаем сохраненные данные
         time_in = context.user_data.get('calc_time_in')
         time_out = context.user_data.get('calc_time_out')
+        # Выход раньше входа - смена закончилась на следующий день
+        time_in, time_out, _, _ = normalize_shift(time_in, time_out)
 
         # Вычисляем рабочее время
-        total_hours = calculate_work_hours(time_in, time_out, lunch_minutes=lunch_minutes)
-        total_time_str = float_hours_to_time_str(total_hours)
+        worked_minutes = calculate_work_minutes(time_in, time_out, lunch_minutes=lunch_minutes)
+        total_time_str = minutes_to_time_str(worked_minutes)
 
         # Формируем сообщение с результатом
         message = f"📊 Результат расчета:\n\n"
-        message += f"⏰ Время входа: {time_in}\n"
-        message += f"⏰ Время выхода: {time_out}\n"
+        message += f"⏰ Время входа: {minutes_to_clock_str(time_in)}\n"
+        message += f"⏰ Время выхода: {minutes_to_clock_str(time_out)}\n"
         message += f"🍽 Обед: {lunch_minutes} минут\n"
         message += f"⏱ Отработано: {total_time_str} часов"
 
@@ -585,15 +335,13 @@ async def lunch_minutes(update, context):
 # Сохранение времени входа
 async def save_time_in(update, context):
     user_id = update.message.from_user.id
-    current_date = datetime.now().strftime('%Y-%m-%d')
+    current_date = repo.today(user_id)
     time_in_str = update.message.text
 
     try:
-        datetime.strptime(time_in_str, '%H:%M')
+        minutes = parse_time(time_in_str)
 
-        await asyncio.get_event_loop().run_in_executor(
-            None, add_time_in, user_id, current_date, time_in_str
-        )
+        await repo.punch_in(user_id, current_date, minutes)
 
         await update.message.reply_text('Время входа сохранено!', reply_markup=main_keyboard())
     except ValueError:
@@ -603,20 +351,38 @@ async def save_time_in(update, context):
     return ConversationHandler.END
 
 
+# Отметка не сохранена: открытая сессия начата больше MAX_SHIFT_HOURS часов назад и, видимо, забыта
+async def reply_stale_session(update, error):
+    session_date = datetime.strptime(error.session_date, '%Y-%m-%d').strftime('%d.%m.%Y')
+    await update.message.reply_text(
+        f'⚠️ Отметка не сохранена: не закрыта сессия от {session_date}, '
+        f'а смена не может быть длиннее {MAX_SHIFT_HOURS:g} ч.\n'
+        'Удалите запись за тот день через «Коррекция журнала», при необходимости внесите ее заново '
+        'через «Добавить запись» и отметьте вход.',
+        reply_markup=main_keyboard()
+    )
+
+
 # Сохранение времени выхода
 async def save_time_out(update, context):
     user_id = update.message.from_user.id
-    current_date = datetime.now().strftime('%Y-%m-%d')
+    current_date = repo.today(user_id)
     time_out_str = update.message.text
 
     try:
-        datetime.strptime(time_out_str, '%H:%M')
+        minutes = parse_time(time_out_str)
 
-        await asyncio.get_event_loop().run_in_executor(
-            None, add_time_out, user_id, current_date, time_out_str
-        )
+        # Выход в ту же минуту, что и вход, - скорее опечатка, чем смена на сутки
+        session = await repo.open_session(user_id)
+        if session is not None and session.date == current_date and session.time_in == minutes:
+            await update.message.reply_text('Время выхода совпадает со временем входа! Введите время выхода ЧЧ:ММ')
+            return TIME_OUT
+
+        await repo.punch_out(user_id, current_date, minutes)
 
         await update.message.reply_text('Время выхода сохранено!', reply_markup=main_keyboard())
+    except StaleSessionError as e:
+        await reply_stale_session(update, e)
     except ValueError:
         await update.message.reply_text('Неверный формат времени! Используйте ЧЧ:ММ')
         return TIME_OUT
@@ -627,17 +393,17 @@ async def save_time_out(update, context):
 # Сохранение времени начала обеда
 async def save_lunch_start(update, context):
     user_id = update.message.from_user.id
-    current_date = datetime.now().strftime('%Y-%m-%d')
+    current_date = repo.today(user_id)
     lunch_start_str = update.message.text
 
     try:
-        datetime.strptime(lunch_start_str, '%H:%M')
+        minutes = parse_time(lunch_start_str)
 
-        await asyncio.get_event_loop().run_in_executor(
-            None, add_lunch_start, user_id, current_date, lunch_start_str
-        )
+        await repo.lunch_start(user_id, current_date, minutes)
 
         await update.message.reply_text('Время начала обеда сохранено!', reply_markup=main_keyboard())
+    except StaleSessionError as e:
+        await reply_stale_session(update, e)
     except ValueError:
         await update.message.reply_text('Неверный формат времени! Используйте ЧЧ:ММ')
         return LUNCH_START
@@ -648,17 +414,17 @@ async def save_lunch_start(update, context):
 # Сохранение времени конца обеда
 async def save_lunch_end(update, context):
     user_id = update.message.from_user.id
-    current_date = datetime.now().strftime('%Y-%m-%d')
+    current_date = repo.today(user_id)
     lunch_end_str = update.message.text
 
     try:
-        datetime.strptime(lunch_end_str, '%H:%M')
+        minutes = parse_time(lunch_end_str)
 
-        await asyncio.get_event_loop().run_in_executor(
-            None, add_lunch_end, user_id, current_date, lunch_end_str
-        )
+        await repo.lunch_end(user_id, current_date, minutes)
 
         await update.message.reply_text('Время конца обеда сохранено!', reply_markup=main_keyboard())
+    except StaleSessionError as e:
+        await reply_stale_session(update, e)
     except ValueError:
         await update.message.reply_text('Неверный формат времени! Используйте ЧЧ:ММ')
         return LUNCH_END
@@ -669,7 +435,7 @@ async def save_lunch_end(update, context):
 # Сохранение минут обеда
 async def save_lunch_minutes(update, context):
     user_id = update.message.from_user.id
-    current_date = datetime.now().strftime('%Y-%m-%d')
+    current_date = repo.today(user_id)
     lunch_minutes_str = update.message.text
 
     try:
@@ -677,11 +443,11 @@ async def save_lunch_minutes(update, context):
         if lunch_minutes < 0:
             raise ValueError("Отрицательное значение")
 
-        await asyncio.get_event_loop().run_in_executor(
-            None, add_lunch_minutes, user_id, current_date, lunch_minutes
-        )
+        await repo.lunch_minutes(user_id, current_date, lunch_minutes)
 
         await update.message.reply_text('Продолжительность обеда сохранена!', reply_markup=main_keyboard())
+    except StaleSessionError as e:
+        await reply_stale_session(update, e)
     except ValueError:
         await update.message.reply_text('Неверный формат! Введите целое число минут')
         return ADD_RECORD_LUNCH_MINUTES
@@ -727,8 +493,7 @@ async def add_record_time_in(update, context):
     time_in_str = update.message.text
 
     try:
-        datetime.strptime(time_in_str, '%H:%M')
-        context.user_data['adding_record']['time_in'] = time_in_str
+        context.user_data['adding_record']['time_in'] = parse_time(time_in_str)
 
         await update.message.reply_text(
             'Введите время выхода в формате ЧЧ:ММ (например, 18:00):\n'
@@ -748,8 +513,14 @@ async def add_record_time_out(update, context):
     time_out_str = update.message.text
 
     try:
-        datetime.strptime(time_out_str, '%H:%M')
-        context.user_data['adding_record']['time_out'] = time_out_str
+        time_out = parse_time(time_out_str)
+        if time_out == context.user_data['adding_record']['time_in']:
+            await update.message.reply_text(
+                'Время выхода совпадает со временем входа! Введите время выхода ЧЧ:ММ:\n'
+                'Или нажмите /cancel для отмены'
+            )
+            return ADD_RECORD_TIME_OUT
+        context.user_data['adding_record']['time_out'] = time_out
 
         keyboard = [['Время обеда', 'Минуты обеда'], ['Пропустить обед']]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -797,8 +568,7 @@ async def add_record_lunch_start(update, context):
     lunch_start_str = update.message.text
 
     try:
-        datetime.strptime(lunch_start_str, '%H:%M')
-        context.user_data['adding_record']['lunch_start'] = lunch_start_str
+        context.user_data['adding_record']['lunch_start'] = parse_time(lunch_start_str)
 
         await update.message.reply_text(
             'Введите время конца обеда в формате ЧЧ:ММ (например, 14:00):\n'
@@ -818,8 +588,7 @@ async def add_record_lunch_end(update, context):
     lunch_end_str = update.message.text
 
     try:
-        datetime.strptime(lunch_end_str, '%H:%M')
-        context.user_data['adding_record']['lunch_end'] = lunch_end_str
+        context.user_data['adding_record']['lunch_end'] = parse_time(lunch_end_str)
 
         return await save_complete_record(update, context)
     except ValueError:
@@ -856,8 +625,7 @@ async def save_complete_record(update, context):
     user_id = update.message.from_user.id
     record_data = context.user_data['adding_record']
 
-    total_hours = await asyncio.get_event_loop().run_in_executor(
-        None, add_complete_record,
+    worked_minutes = await repo.add_record(
         user_id,
         record_data['date'],
         record_data['time_in'],
@@ -867,14 +635,16 @@ async def save_complete_record(update, context):
         record_data.get('lunch_minutes')
     )
 
-    total_time_str = float_hours_to_time_str(total_hours)
+    total_time_str = minutes_to_time_str(worked_minutes)
 
     message = f"✅ Запись успешно добавлена!\n\n"
     message += f"📅 Дата: {datetime.strptime(record_data['date'], '%Y-%m-%d').strftime('%d.%m.%Y')}\n"
-    message += f"⏰ Время: {record_data['time_in']} - {record_data['time_out']}\n"
+    time_in, time_out, lunch_start, lunch_end = normalize_shift(
+        record_data['time_in'], record_data['time_out'], record_data.get('lunch_start'), record_data.get('lunch_end'))
+    message += f"⏰ Время: {minutes_to_clock_str(time_in)} - {minutes_to_clock_str(time_out)}\n"
 
-    if record_data.get('lunch_start') and record_data.get('lunch_end'):
-        message += f"🍽 Обед: {record_data['lunch_start']} - {record_data['lunch_end']}\n"
+    if lunch_start is not None and lunch_end is not None:
+        message += f"🍽 Обед: {minutes_to_clock_str(lunch_start)} - {minutes_to_clock_str(lunch_end)}\n"
     elif record_data.get('lunch_minutes'):
         message += f"🍽 Обед: {record_data['lunch_minutes']} минут\n"
     else:
@@ -892,7 +662,7 @@ async def save_complete_record(update, context):
 
 # Меню отчетов
 async def report_menu(update, context):
-    keyboard = [['Сегодня', 'Неделя', 'Месяц'], ['Год', 'Назад']]
+    keyboard = [['Сегодня', 'Неделя', 'Месяц'], ['Год', 'Статистика', 'Назад']]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     await update.message.reply_text(
         'Выберите период для отчета:',
@@ -900,6 +670,60 @@ async def report_menu(update, context):
     )
 
 
+# Сборка отчета за период: итог в минутах и генератор страниц сообщения
+async def build_report(user_id, period, start_date, end_date):
+    if period == 'today':
+        # Детализированный отчет за сегодня (существующий функционал)
+        details = await repo.today_details(user_id)
+
+        if not details:
+            return 0, iter(["ℹ️ За сегодня нет записей о рабочем времени."])
+
+        total_minutes = closed_minutes(details)
+        header = f"📊 Отчет за сегодня ({start_date.strftime('%d.%m.%Y')}):\n\n"
+        lines = (format_record_line(i, *record) for i, record in enumerate(details, 1))
+        footer = f"\n📈 Всего за день: {minutes_to_time_str(total_minutes)} часов"
+        return total_minutes, iter_report_pages(header, lines, footer)
+
+    if period in ['week', 'month']:
+        # Детализированные отчеты за неделю и месяц: дни упаковываются в страницы по мере форматирования
+        detailed_records = await repo.records_period(
+            user_id, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+        )
+        return render_period_report(period, start_date, end_date, detailed_records)
+
+    if period == 'stats':
+        # Средние времена и разбивка по дням недели требуют сырых записей периода
+        summary = await repo.period_summary(
+            user_id, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+        )
+        return summary.total_minutes, iter([format_statistics(summary, start_date, end_date)])
+
+    # year - без детализации: итог по помесячным агрегатам, дни и норма - по агрегатам по дням
+    total_minutes, totals = await asyncio.gather(
+        repo.report(user_id, period),
+        repo.member_totals([user_id], start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+    )
+    message = f'📊 Отработано за год: {minutes_to_time_str(total_minutes)} часов'
+    day_totals = totals.get(user_id)
+    if day_totals and day_totals.days:
+        message += f"\n📅 Рабочих дней: {day_totals.days}, "
+        message += f"в среднем {minutes_to_time_str(day_totals.minutes // day_totals.days)} часов\n"
+        message += format_norm_lines(day_totals).rstrip('\n')
+    return total_minutes, iter([message.rstrip('\n')])
+
+
+# Кнопки листания многостраничного отчета
+def report_pages_keyboard(period, start_date, page, has_next):
+    callback_prefix = f"report:{period}:{start_date.isoformat()}"
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton('◀ Назад', callback_data=f"{callback_prefix}:{page - 1}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton('Далее ▶', callback_data=f"{callback_prefix}:{page + 1}"))
+    return InlineKeyboardMarkup([buttons])
+
+
 # Генерация отчета с детализацией для недели и месяца
 async def generate_report_handler(update, context):
     user_id = update.message.from_user.id
@@ -913,137 +737,71 @@ async def generate_report_handler(update, context):
         'сегодня': 'today',
         'неделя': 'week',
         'месяц': 'month',
-        'год': 'year'
+        'год': 'year',
+        'статистика': 'stats'
     }
 
-    if period_text in period_map:
-        period = period_map[period_text]
-
-        if period == 'today':
-            # Детализированный отчет за сегодня (существующий функционал)
-            total_hours = await asyncio.get_event_loop().run_in_executor(
-                None, generate_report, user_id, period
-            )
+    if period_text not in period_map:
+        await update.message.reply_text('Неверный период отчета')
+        return
 
-            details = await asyncio.get_event_loop().run_in_executor(
-                None, get_today_details, user_id
-            )
+    period = period_map[period_text]
+    start_date, end_date = period_bounds(period, repo.clock.today(user_id))
 
-            if details:
-                message = f"📊 Отчет за сегодня ({datetime.now().strftime('%d.%m.%Y')}):\n\n"
-                total_day_hours = 0
-
-                for i, record in enumerate(details, 1):
-                    time_in, time_out, lunch_start, lunch_end, lunch_minutes, hours = record
-                    if time_out and hours is not None:
-                        time_str = float_hours_to_time_str(hours)
-                        message += f"{i}. ⏰ {time_in} - {time_out}"
-                        if lunch_start and lunch_end:
-                            message += f" | 🍽 {lunch_start}-{lunch_end}"
-                        elif lunch_minutes:
-                            message += f" | 🍽 {lunch_minutes} мин"
-                        message += f" | ⏱ {time_str} ч.\n"
-                        total_day_hours += hours
-                    else:
-                        message += f"{i}. ⏰ {time_in} - --:-- | ❌ незавершенный вход\n"
-
-                total_day_time_str = float_hours_to_time_str(total_day_hours)
-                message += f"\n📈 Всего за день: {total_day_time_str} часов"
-            else:
-                message = "ℹ️ За сегодня нет записей о рабочем времени."
-
-        elif period in ['week', 'month']:
-            # Детализированные отчеты за неделю и месяц
-            today = datetime.now().date()
-
-            if period == 'week':
-                start_date = today - timedelta(days=today.weekday())
-                end_date = start_date + timedelta(days=6)
-                period_name = 'неделю'
-            else:  # month
-                start_date = today.replace(day=1)
-                if today.month == 12:
-                    end_date = today.replace(year=today.year + 1, month=1, day=1) - timedelta(days=1)
-                else:
-                    end_date = today.replace(month=today.month + 1, day=1) - timedelta(days=1)
-                period_name = 'месяц'
-
-            # Получаем детализированные записи за период
-            detailed_records = await asyncio.get_event_loop().run_in_executor(
-                None, get_detailed_records_period, user_id,
-                start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
-            )
+    # Повторные запросы того же отчета отдаем из кэша до первой записи пользователя
+    cache_key = (user_id, period, start_date)
+    report = repo.cache.get(cache_key)
+    if report is not None:
+        pages = report.pages
+        first_page, has_next = pages[0], len(pages) > 1
+    else:
+        version = repo.cache.version(user_id)
+        total_minutes, page_iter = await build_report(user_id, period, start_date, end_date)
+        first_page = next(page_iter)
+        second_page = next(page_iter, None)
+        has_next = second_page is not None
+
+    if has_next:
+        reply_markup = report_pages_keyboard(period, start_date, 0, has_next)
+    else:
+        reply_markup = main_keyboard()
+    # Первая страница уходит пользователю до форматирования остальных
+    await update.message.reply_text(first_page, reply_markup=reply_markup)
+
+    if report is None:
+        pages = [first_page]
+        if has_next:
+            pages.append(second_page)
+            pages.extend(page_iter)
+        repo.cache.put(cache_key, CachedReport(total_minutes, tuple(pages)), version)
+
+
+# Листание страниц отчета по inline-кнопкам
+async def report_page_callback(update, context):
+    query = update.callback_query
+    await query.answer()
+
+    _, period, start_iso, page = query.data.split(':')
+    page = int(page)
+    start_date = date.fromisoformat(start_iso)
+    user_id = query.from_user.id
+
+    report = repo.cache.get((user_id, period, start_date))
+    if report is not None:
+        pages = report.pages
+    else:
+        # Кэш сброшен записью пользователя или устарел - форматируем только до нужной страницы
+        _, end_date = period_bounds(period, start_date)
+        _, page_iter = await build_report(user_id, period, start_date, end_date)
+        pages = list(islice(page_iter, page + 2))
 
-            # Группируем записи по датам
-            records_by_date = {}
-            for record in detailed_records:
-                date_str, time_in, time_out, lunch_start, lunch_end, lunch_minutes, hours = record
-                if date_str not in records_by_date:
-                    records_by_date[date_str] = []
-                records_by_date[date_str].append({
-                    'time_in': time_in,
-                    'time_out': time_out,
-                    'lunch_start': lunch_start,
-                    'lunch_end': lunch_end,
-                    'lunch_minutes': lunch_minutes,
-                    'hours': hours
-                })
-
-            # Формируем сообщение с детализацией
-            total_period_hours = 0
-            message = f"📊 Детализированный отчет за {period_name} "
-            message += f"(с {start_date.strftime('%d.%m.%Y')} по {end_date.strftime('%d.%m.%Y')}):\n\n"
-
-            # Сортируем даты по возрастанию
-            sorted_dates = sorted(records_by_date.keys())
-
-            for date_str in sorted_dates:
-                date_display = datetime.strptime(date_str, '%Y-%m-%d').strftime('%d.%m.%Y')
-                day_records = records_by_date[date_str]
-                day_total = 0
-
-                message += f"📅 {date_display}:\n"
-
-                for i, record in enumerate(day_records, 1):
-                    time_in = record['time_in']
-                    time_out = record['time_out']
-                    lunch_start = record['lunch_start']
-                    lunch_end = record['lunch_end']
-                    lunch_minutes = record['lunch_minutes']
-                    hours = record['hours']
-
-                    if time_out and hours is not None:
-                        time_str = float_hours_to_time_str(hours)
-                        message += f"  {i}. ⏰ {time_in} - {time_out}"
-                        if lunch_start and lunch_end:
-                            message += f" | 🍽 {lunch_start}-{lunch_end}"
-                        elif lunch_minutes:
-                            message += f" | 🍽 {lunch_minutes} мин"
-                        message += f" | ⏱ {time_str} ч.\n"
-                        day_total += hours
-                    else:
-                        message += f"  {i}. ⏰ {time_in} - --:-- | ❌ незавершенный вход\n"
-
-                if day_total > 0:
-                    day_time_str = float_hours_to_time_str(day_total)
-                    message += f"  📈 Итого за день: {day_time_str} часов\n"
-                    total_period_hours += day_total
-
-                message += "\n"
-
-            total_time_str = float_hours_to_time_str(total_period_hours)
-            message += f"📊 Всего за {period_name}: {total_time_str} часов"
-
-        else:  # year - без детализации
-            total_hours = await asyncio.get_event_loop().run_in_executor(
-                None, generate_report, user_id, period
-            )
-            total_time_str = float_hours_to_time_str(total_hours)
-            message = f'📊 Отработано за год: {total_time_str} часов'
+    if page >= len(pages):
+        return
 
-        await update.message.reply_text(message, reply_markup=main_keyboard())
-    else:
-        await update.message.reply_text('Неверный период отчета')
+    await query.edit_message_text(
+        pages[page],
+        reply_markup=report_pages_keyboard(period, start_date, page, page + 1 < len(pages))
+    )
 
 
 # Обработчик кнопки "Назад" в меню обеда
@@ -1051,6 +809,378 @@ async def lunch_back(update, context):
     await update.message.reply_text('Главное меню', reply_markup=main_keyboard())
 
 
+# Обработчик команды /import
+async def import_start(update, context):
+    await update.message.reply_text(
+        'Отправьте файл CSV или XLSX с записями, по одной строке на сессию. Столбцы:\n'
+        'Дата (ДД.ММ.ГГГГ); Вход; Выход; Начало обеда; Конец обеда; Минуты обеда\n'
+        'Обед указывается либо временем начала и конца, либо минутами.\n'
+        'Или нажмите /cancel для отмены',
+        reply_markup=ReplyKeyboardRemove()
+    )
+    return IMPORT_FILE
+
+
+# Обработчик присланного файла для импорта
+async def import_file(update, context):
+    user_id = update.message.from_user.id
+    document = update.message.document
+    file_name = (document.file_name or '').lower()
+
+    if file_name.endswith('.xlsx'):
+        file_format = 'xlsx'
+    elif file_name.endswith('.csv') or document.mime_type == 'text/csv':
+        file_format = 'csv'
+    else:
+        await update.message.reply_text(
+            'Поддерживаются только файлы .csv и .xlsx\n'
+            'Или нажмите /cancel для отмены'
+        )
+        return IMPORT_FILE
+
+    await update.message.reply_text('⏳ Импортирую записи...')
+
+    try:
+        telegram_file = await document.get_file()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / f'import.{file_format}'
+            await telegram_file.download_to_drive(path)
+            result = await import_timesheet(repo, user_id, path, file_format)
+    except Exception:
+        # Ошибки чтения файла и записи import_timesheet разбирает сам; здесь - загрузка файла и прочее
+        logger.exception(f"Ошибка импорта пользователя {user_id}")
+        await update.message.reply_text('❌ Не удалось загрузить файл, записи не импортированы. '
+                                        'Попробуйте еще раз через /import', reply_markup=main_keyboard())
+        return ConversationHandler.END
+
+    await update.message.reply_text(result.summary(), reply_markup=main_keyboard())
+    return ConversationHandler.END
+
+
+# Напоминание прислать файл в диалоге импорта
+async def import_expect_file(update, context):
+    await update.message.reply_text(
+        'Пожалуйста, отправьте файл .csv или .xlsx\n'
+        'Или нажмите /cancel для отмены'
+    )
+    return IMPORT_FILE
+
+
+# Обработчик команды /at_work: сколько человек сейчас на работе (по реестру открытых сессий)
+async def at_work_handler(update, context):
+    user_id = update.message.from_user.id
+    current_date = repo.today(user_id)
+
+    message = f"👥 Сейчас на работе: {await repo.at_work(current_date)}"
+    session = await repo.open_session(user_id)
+    if session is not None and session.date == current_date:
+        message += f"\n⏰ Вы на работе с {minutes_to_clock_str(session.time_in)}"
+    await update.message.reply_text(message, reply_markup=main_keyboard())
+
+
+# Обработчик команды /timezone [Пояс]: показать или сменить часовой пояс пользователя
+async def timezone_handler(update, context):
+    user_id = update.message.from_user.id
+
+    if not context.args:
+        timezone = repo.clock.timezone(user_id)
+        if timezone is None:
+            message = "🕒 Часовой пояс: время сервера"
+        else:
+            message = f"🕒 Часовой пояс: {timezone} ({format_offset(timezone)})"
+        message += f"\n📅 Сегодня: {repo.clock.today(user_id).strftime('%d.%m.%Y')}\n\n"
+        message += "Сменить: /timezone Europe/Moscow (имя пояса IANA), сбросить: /timezone reset"
+        await update.message.reply_text(message, reply_markup=main_keyboard())
+        return
+
+    timezone = context.args[0]
+    if timezone.lower() == 'reset':
+        timezone = None
+    else:
+        try:
+            get_zone(timezone)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {e}\nПример: /timezone Europe/Moscow", reply_markup=main_keyboard())
+            return
+
+    await repo.set_timezone(user_id, timezone)
+    if timezone is None:
+        message = "✅ Часовой пояс сброшен"
+    else:
+        message = f"✅ Часовой пояс: {timezone} ({format_offset(timezone)})"
+    message += f"\n📅 Сегодня: {repo.clock.today(user_id).strftime('%d.%m.%Y')}"
+    await update.message.reply_text(message, reply_markup=main_keyboard())
+
+
+# Обработчик команды /reminder [ЧЧ:ММ|off]: напоминание отметить выход
+async def reminder_handler(update, context):
+    user_id = update.message.from_user.id
+
+    if not context.args:
+        reminder_time = repo.reminders.get(user_id)
+        if reminder_time is None:
+            message = "🔕 Напоминание о выходе выключено"
+        else:
+            message = f"⏰ Напоминание о выходе в {minutes_to_clock_str(reminder_time)}, если вы еще на работе"
+        message += "\n\nВключить: /reminder 18:30, выключить: /reminder off"
+        await update.message.reply_text(message, reply_markup=main_keyboard())
+        return
+
+    if context.args[0].lower() == 'off':
+        reminder_time = None
+    else:
+        try:
+            reminder_time = parse_time(context.args[0])
+        except ValueError:
+            await update.message.reply_text('❌ Неверный формат времени! Пример: /reminder 18:30',
+                                            reply_markup=main_keyboard())
+            return
+
+    await repo.set_reminder(user_id, reminder_time)
+    if reminder_time is None:
+        message = "🔕 Напоминание о выходе выключено"
+    else:
+        message = f"✅ Напомню отметить выход в {minutes_to_clock_str(reminder_time)}, если вы еще на работе"
+    await update.message.reply_text(message, reply_markup=main_keyboard())
+
+
+# Обработчик команды /digest [неделя|месяц|off]: сводка за прошлый период, которую бот присылает сам
+async def digest_handler(update, context):
+    user_id = update.message.from_user.id
+
+    if not context.args:
+        digest = repo.digests.get(user_id)
+        if digest is None:
+            message = "🔕 Сводка не рассылается"
+        else:
+            message = f"📬 {DIGEST_NAMES[digest].capitalize()} сводка включена"
+        message += ("\n\nЕженедельная (по понедельникам): /digest неделя\n"
+                    "Ежемесячная (1-го числа): /digest месяц\n"
+                    "Выключить: /digest off")
+        await update.message.reply_text(message, reply_markup=main_keyboard())
+        return
+
+    argument = context.args[0].lower()
+    if argument == 'off':
+        digest = None
+    elif argument in PERIOD_ARGS:
+        digest = PERIOD_ARGS[argument]
+    else:
+        await update.message.reply_text('Использование: /digest неделя|месяц|off', reply_markup=main_keyboard())
+        return
+
+    await repo.set_digest(user_id, digest)
+    if digest is None:
+        message = "🔕 Сводка выключена"
+    elif digest == 'week':
+        message = "✅ Сводку за прошлую неделю пришлю в понедельник"
+    else:
+        message = "✅ Сводку за прошлый месяц пришлю 1-го числа"
+    await update.message.reply_text(message, reply_markup=main_keyboard())
+
+
+# Обработчик команды /team: команды пользователя и подсказка по командам
+async def team_handler(update, context):
+    user_id = update.message.from_user.id
+    memberships = await repo.user_teams(user_id)
+
+    message = ''
+    if memberships:
+        message += "👥 Ваши команды:\n"
+        for membership in memberships:
+            team = membership.team
+            message += f"{team.id}. {team.name} - {ROLE_NAMES[membership.role]}, участников: {membership.members}"
+            if membership.role == ROLE_MANAGER:
+                message += f", код для вступления: {team.join_code}"
+            message += "\n"
+        message += "\n"
+    message += (
+        "Создать команду: /team_create Название\n"
+        "Вступить: /team_join КОД\n"
+        "Отчет руководителя: /team_report [ID] [неделя|месяц|ДД.ММ.ГГГГ ДД.ММ.ГГГГ] [csv|xlsx]\n"
+        "Роль участника: /team_role ID user_id manager|member"
+    )
+    await update.message.reply_text(message, reply_markup=main_keyboard())
+
+
+# Обработчик команды /team_create Название
+async def team_create_handler(update, context):
+    name = ' '.join(context.args).strip()
+    if not name:
+        await update.message.reply_text('Использование: /team_create Название', reply_markup=main_keyboard())
+        return
+
+    user = update.message.from_user
+    team = await repo.create_team(user.id, name[:64], user.full_name)
+    await update.message.reply_text(
+        f"✅ Команда «{team.name}» создана (ID {team.id}), вы - руководитель.\n"
+        f"Сотрудники вступают командой: /team_join {team.join_code}",
+        reply_markup=main_keyboard()
+    )
+
+
+# Обработчик команды /team_join КОД
+async def team_join_handler(update, context):
+    if len(context.args) != 1:
+        await update.message.reply_text('Использование: /team_join КОД', reply_markup=main_keyboard())
+        return
+
+    user = update.message.from_user
+    team = await repo.join_team(user.id, context.args[0], user.full_name)
+    if team is None:
+        await update.message.reply_text('❌ Команда с таким кодом не найдена', reply_markup=main_keyboard())
+        return
+    await update.message.reply_text(f"✅ Вы в команде «{team.name}»", reply_markup=main_keyboard())
+
+
+# Команда, которой руководит пользователь: по ID из аргументов или единственная.
+# Возвращает (команда, текст ошибки)
+async def managed_team(user_id, team_id=None):
+    managed = [membership.team for membership in await repo.user_teams(user_id)
+               if membership.role == ROLE_MANAGER]
+    if team_id is not None:
+        team = next((team for team in managed if team.id == team_id), None)
+        return team, None if team is not None else '❌ Вы не руководитель команды с таким ID'
+    if len(managed) == 1:
+        return managed[0], None
+    if not managed:
+        return None, 'ℹ️ Вы не руководите ни одной командой. Создать: /team_create Название'
+    return None, 'Укажите ID команды, список: /team'
+
+
+# Обработчик команды /team_role ID user_id manager|member
+async def team_role_handler(update, context):
+    args = context.args
+    if len(args) != 3 or not args[0].isdigit() or not args[1].isdigit() or args[2] not in ROLES:
+        await update.message.reply_text(
+            'Использование: /team_role ID user_id manager|member\n'
+            'user_id участников - в файле /team_report ID csv',
+            reply_markup=main_keyboard()
+        )
+        return
+
+    team, error = await managed_team(update.message.from_user.id, int(args[0]))
+    if team is None:
+        await update.message.reply_text(error, reply_markup=main_keyboard())
+        return
+    try:
+        await repo.set_team_role(team.id, int(args[1]), args[2])
+    except ValueError as e:
+        await update.message.reply_text(f'❌ {e}', reply_markup=main_keyboard())
+        return
+    await update.message.reply_text(f"✅ Роль изменена: {ROLE_NAMES[args[2]]}", reply_markup=main_keyboard())
+
+
+# Обработчик команды /team_report [ID] [неделя|месяц|ДД.ММ.ГГГГ ДД.ММ.ГГГГ] [csv|xlsx]
+async def team_report_handler(update, context):
+    user_id = update.message.from_user.id
+    args = [arg.lower() for arg in context.args]
+
+    team_id = int(args.pop(0)) if args and args[0].isdigit() else None
+    file_format = args.pop() if args and args[-1] in TEAM_REPORT_FORMATS else None
+    period = 'month'
+    dates = None
+    if len(args) == 1:
+        period = PERIOD_ARGS.get(args[0])
+    elif len(args) == 2:
+        try:
+            dates = sorted(datetime.strptime(arg, '%d.%m.%Y').date() for arg in args)
+        except ValueError:
+            period = None
+    elif args:
+        period = None
+    if period is None:
+        await update.message.reply_text(
+            'Использование: /team_report [ID] [неделя|месяц|ДД.ММ.ГГГГ ДД.ММ.ГГГГ] [csv|xlsx]',
+            reply_markup=main_keyboard()
+        )
+        return
+
+    team, error = await managed_team(user_id, team_id)
+    if team is None:
+        await update.message.reply_text(error, reply_markup=main_keyboard())
+        return
+
+    start_date, end_date = dates or period_bounds(period, repo.clock.today(user_id))
+    rows = await repo.team_report(team.id, start_date.isoformat(), end_date.isoformat())
+    summary = format_team_summary(team.name, rows, start_date, end_date)
+
+    if file_format is None:
+        message = summary + "\n\n" + ''.join(format_member_line(i, row) for i, row in enumerate(rows, 1))
+        if len(rows) <= TEAM_TABLE_ROWS and text_length(message) <= MESSAGE_LIMIT:
+            await update.message.reply_text(message.rstrip('\n'), reply_markup=main_keyboard())
+            return
+        # Большая команда: в сообщении только итог, построчно - во вложении
+        file_format = 'csv'
+
+    file, count = write_team_report(rows, file_format)
+    filename = f'team_{team.id}_{start_date.isoformat()}_{end_date.isoformat()}.{file_format}'
+    with file:
+        await update.message.reply_document(
+            document=document_input(file, filename),
+            caption=summary,
+            reply_markup=main_keyboard()
+        )
+
+
+# Файл выгрузки для reply_document: у SpooledTemporaryFile нет имени, поэтому оно задается явно,
+# а содержимое не читается целиком, а передается HTTP-клиенту потоком
+def document_input(file, filename):
+    return InputFile(file, filename=filename, read_file_handle=False)
+
+
+# Обработчик команды /export [формат] [ДД.ММ.ГГГГ [ДД.ММ.ГГГГ]]
+async def export_handler(update, context):
+    user_id = update.message.from_user.id
+    args = list(context.args)
+
+    file_format = 'csv'
+    if args and args[0].lower() in EXPORT_FORMATS:
+        file_format = args.pop(0).lower()
+
+    try:
+        dates = [datetime.strptime(arg, '%d.%m.%Y').date() for arg in args]
+    except ValueError:
+        dates = None
+    if dates is None or len(dates) > 2:
+        await update.message.reply_text(
+            'Использование: /export [csv|xlsx|parquet] [ДД.ММ.ГГГГ [ДД.ММ.ГГГГ]]\n'
+            'Без дат выгружается весь журнал, с одной датой - записи начиная с нее.',
+            reply_markup=main_keyboard()
+        )
+        return
+
+    start_date = dates[0] if dates else date.min
+    end_date = dates[1] if len(dates) == 2 else date.max
+    if start_date > end_date:
+        start_date, end_date = end_date, start_date
+
+    await update.message.reply_text('⏳ Готовлю выгрузку...')
+    try:
+        file, count = await repo.export(user_id, start_date.isoformat(), end_date.isoformat(), file_format)
+    except ValueError as e:
+        await update.message.reply_text(f'❌ Не удалось выгрузить: {e}', reply_markup=main_keyboard())
+        return
+
+    with file:
+        if not count:
+            await update.message.reply_text('ℹ️ За этот период нет записей.', reply_markup=main_keyboard())
+            return
+        size = file.seek(0, 2)
+        file.seek(0)
+        if size > MAX_DOCUMENT_SIZE:
+            await update.message.reply_text(
+                '❌ Файл слишком большой для Telegram, выберите период короче.',
+                reply_markup=main_keyboard()
+            )
+            return
+        await update.message.reply_document(
+            document=document_input(file, f'timesheet_{user_id}.{file_format}'),
+            caption=f'📤 Записей: {count}',
+            reply_markup=main_keyboard()
+        )
+
+
 # Отмена диалога
 async def cancel(update, context):
     # Очищаем все временные данные
@@ -1064,22 +1194,30 @@ async def cancel(update, context):
     return ConversationHandler.END
 
 
-# Закрытие соединения с БД при завершении
-def close_db_connection():
-    global _db_connection
-    if _db_connection:
-        _db_connection.close()
+# Открытие хранилища при запуске приложения (если его еще не открыла SqlitePersistence)
+async def open_storage(application):
+    await repo.start()
 
 
-def main():
-    token = get_token()
-    if not token:
-        print("Не удалось загрузить токен бота. Убедитесь, что файл .token существует и содержит токен.")
-        return
+# Закрытие хранилища при остановке: дожидаемся незавершенных запросов
+async def close_storage(application):
+    await repo.close()
 
-    init_db()
 
-    application = Application.builder().token(token).build()
+# Сборка приложения со всеми обработчиками; request позволяет подменить HTTP-клиент Bot API
+def build_application(token, request=None):
+    builder = (
+        Application.builder()
+        .token(token)
+        .persistence(SqlitePersistence(repo))
+        .post_init(open_storage)
+        .post_shutdown(close_storage)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    else:
+        builder = builder.request(TimedHTTPXRequest(connection_pool_size=256))
+    application = builder.build()
 
     # ConversationHandler для коррекции журнала (удаления записей)
     delete_record_handler = ConversationHandler(
@@ -1091,7 +1229,9 @@ def main():
             DELETE_CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, delete_confirm)],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
-        allow_reentry=True
+        allow_reentry=True,
+        name='delete_record',
+        persistent=True
     )
 
     # ConversationHandler для расчета рабочего времени
@@ -1105,7 +1245,9 @@ def main():
             CALC_LUNCH_MINUTES: [MessageHandler(filters.TEXT & ~filters.COMMAND, calc_lunch_minutes)],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
-        allow_reentry=True
+        allow_reentry=True,
+        name='calc_worktime',
+        persistent=True
     )
 
     # ConversationHandler для добавления полной записи
@@ -1125,7 +1267,9 @@ def main():
             ADD_RECORD_LUNCH_MINUTES: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_record_lunch_minutes)],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
-        allow_reentry=True
+        allow_reentry=True,
+        name='add_record',
+        persistent=True
     )
 
     # ConversationHandler для обеда
@@ -1140,7 +1284,9 @@ def main():
             LUNCH_END: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_lunch_end)],
             ADD_RECORD_LUNCH_MINUTES: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_lunch_minutes)]
         },
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name='lunch',
+        persistent=True
     )
 
     # ConversationHandler для входа/выхода
@@ -1153,7 +1299,24 @@ def main():
             TIME_IN: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_time_in)],
             TIME_OUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_time_out)]
         },
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name='time',
+        persistent=True
+    )
+
+    # ConversationHandler для импорта записей из файла
+    import_conv_handler = ConversationHandler(
+        entry_points=[CommandHandler('import', import_start)],
+        states={
+            IMPORT_FILE: [
+                MessageHandler(filters.Document.ALL, import_file),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, import_expect_file)
+            ],
+        },
+        fallbacks=[CommandHandler('cancel', cancel)],
+        allow_reentry=True,
+        name='import',
+        persistent=True
     )
 
     # Порядок ВАЖЕН: сначала самые специфичные обработчики
@@ -1162,21 +1325,60 @@ def main():
     application.add_handler(add_record_conv_handler)
     application.add_handler(lunch_conv_handler)
     application.add_handler(time_conv_handler)
+    application.add_handler(import_conv_handler)
 
     # Затем общие обработчики
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("export", export_handler))
+    application.add_handler(CommandHandler("at_work", at_work_handler))
+    application.add_handler(CommandHandler("timezone", timezone_handler))
+    application.add_handler(CommandHandler("reminder", reminder_handler))
+    application.add_handler(CommandHandler("digest", digest_handler))
+    application.add_handler(CommandHandler("team", team_handler))
+    application.add_handler(CommandHandler("team_create", team_create_handler))
+    application.add_handler(CommandHandler("team_join", team_join_handler))
+    application.add_handler(CommandHandler("team_role", team_role_handler))
+    application.add_handler(CommandHandler("team_report", team_report_handler))
     application.add_handler(MessageHandler(filters.Regex('^Обед$'), lunch))
     application.add_handler(MessageHandler(filters.Regex('^Назад$'), lunch_back))
     application.add_handler(MessageHandler(filters.Regex('^Отчет$'), report_menu))
 
     # Убрал "Назад" из этого обработчика, чтобы не конфликтовал
     application.add_handler(
-        MessageHandler(filters.Regex('^(Сегодня|Неделя|Месяц|Год)$'), generate_report_handler))
+        MessageHandler(filters.Regex('^(Сегодня|Неделя|Месяц|Год|Статистика)$'), generate_report_handler))
+    application.add_handler(CallbackQueryHandler(report_page_callback, pattern='^report:'))
+
+    # Задачи JobQueue создаются здесь, а не при импорте: они должны работать с текущим repo
+    # (нагрузочный тест подменяет main.repo до build_application)
+    SessionSweeper(repo, sender=notification_sender).schedule(application)
+    DigestJob(repo, report_pages_keyboard, sender=notification_sender).schedule(application)
+    instrument_application(application)
+    register_runtime_gauges(application, repo)
+    return application
+
+
+def main():
+    token = get_token()
+    if not token:
+        print("Не удалось загрузить токен бота. Убедитесь, что файл .token существует и содержит токен.")
+        return
+
+    application = build_application(token)
+    query_log = enable_diagnostics_from_env()
 
+    config = WebhookConfig.from_env()
+    # /metrics только на локальном адресе METRICS_HOST, а не на публичном слушателе webhook
+    metrics_server = start_metrics_server()
     try:
-        application.run_polling()
+        if config.enabled:
+            run_webhook(application, config, create_web_app(application, config))
+        else:
+            application.run_polling()
     finally:
-        close_db_connection()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+    if query_log is not None:
+        query_log.save()
 
 
 if __name__ == '__main__':
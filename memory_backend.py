@@ -0,0 +1,306 @@
+"""Хранилище в памяти процесса с тем же поведением, что и SQLite.
+
+Нужно для проверок без базы (conformance.py) и для быстрых экспериментов с
+обработчиками: DB_BACKEND=memory. Данные пропадают при остановке бота.
+"""
+from collections import defaultdict
+
+from analytics import DAILY_NORM_MINUTES, rows_to_arrays, summarize
+from backend import StorageBackend
+from exporter import write_export
+from open_sessions import OpenSession
+from report_cache import ReportCache
+from shifts import check_session_age, day_offset, normalize_shift, session_minutes, shift_totals
+from storage import calculate_work_minutes, period_bounds
+from teams import ROLE_MANAGER, ROLE_MEMBER, ROLES, Membership, Team, day_totals, merge_member_totals, new_join_code
+from timezones import UserClock
+
+# Столбцы записи в том же порядке, что и в таблице records
+ID, USER_ID, DATE, TIME_IN, TIME_OUT, LUNCH_START, LUNCH_END, LUNCH_MINUTES, WORKED, AUTO_CLOSED = range(10)
+
+
+class MemoryBackend(StorageBackend):
+    """Записи - списки в словаре по id, агрегаты - словари по (user_id, день/месяц).
+
+    Все методы выполняются в цикле событий без ожиданий внутри, поэтому каждый
+    из них атомарен так же, как транзакция в SQLite.
+    """
+
+    def __init__(self):
+        self.cache = ReportCache()
+        self.clock = UserClock()
+        self._records = {}
+        self._records_by_user = defaultdict(set)
+        self._next_id = 1
+        self._daily = {}
+        self._monthly = {}
+        self._bot_state = {}
+        self._timezones = {}
+        self.reminders = {}
+        self.digests = {}
+        self._teams = {}
+        # team_id -> {user_id: [name, role]}
+        self._team_members = {}
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def open_sessions_count(self):
+        return sum(1 for user_id in list(self._records_by_user) if self._latest_open(user_id))
+
+    # Вспомогательные функции
+
+    def _user_records(self, user_id):
+        return [self._records[record_id] for record_id in sorted(self._records_by_user.get(user_id, ()))]
+
+    def _latest_open(self, user_id, date=None, same_day=False):
+        """Последняя открытая запись: начатая именно в date (same_day) или не позже date"""
+        candidates = [record for record in self._user_records(user_id) if record[TIME_OUT] is None and (
+            date is None or (record[DATE] == date if same_day else record[DATE] <= date))]
+        return max(candidates, key=lambda record: (record[DATE], record[ID]), default=None)
+
+    def _insert(self, user_id, date, time_in, time_out=None, lunch_start=None, lunch_end=None,
+                lunch_minutes=None, worked_minutes=None):
+        record = [self._next_id, user_id, date, time_in, time_out, lunch_start, lunch_end, lunch_minutes,
+                  worked_minutes, 0]
+        self._records[self._next_id] = record
+        self._records_by_user[user_id].add(self._next_id)
+        self._next_id += 1
+        return record
+
+    def _apply_totals(self, user_id, totals, sign=1):
+        for date, (minutes, sessions) in totals.items():
+            for table, key in ((self._daily, (user_id, date)), (self._monthly, (user_id, date[:7]))):
+                total_minutes, total_sessions = table.get(key, (0, 0))
+                total_minutes += sign * minutes
+                total_sessions += sign * sessions
+                if total_minutes <= 0 and total_sessions <= 0:
+                    table.pop(key, None)
+                else:
+                    table[key] = (total_minutes, total_sessions)
+
+    @staticmethod
+    def _record_totals(record):
+        return shift_totals({}, record[DATE], *record[TIME_IN:WORKED + 1])
+
+    @staticmethod
+    def _session_minutes(record, date, minutes, is_time_out=False):
+        return session_minutes(record[DATE], record[TIME_IN], date, minutes, is_time_out)
+
+    @staticmethod
+    def _session(record):
+        return OpenSession(record[ID], record[DATE], *record[TIME_IN:TIME_OUT], *record[LUNCH_START:WORKED])
+
+    def _changed(self, user_id):
+        self.cache.invalidate_user(user_id)
+
+    # Настройки и отметки
+
+    async def set_timezone(self, user_id, timezone):
+        self._timezones[user_id] = timezone
+        self.clock.set(user_id, timezone)
+        self._changed(user_id)
+
+    async def set_reminder(self, user_id, reminder_time):
+        if reminder_time is None:
+            self.reminders.pop(user_id, None)
+        else:
+            self.reminders[user_id] = reminder_time
+        self._changed(user_id)
+
+    async def set_digest(self, user_id, digest):
+        if digest is None:
+            self.digests.pop(user_id, None)
+        else:
+            self.digests[user_id] = digest
+        self._changed(user_id)
+
+    async def punch_in(self, user_id, date, time_in):
+        record = self._latest_open(user_id, date, same_day=True)
+        if record:
+            record[TIME_IN] = time_in
+        else:
+            self._insert(user_id, date, time_in)
+        self._changed(user_id)
+
+    async def punch_out(self, user_id, date, time_out):
+        record = self._latest_open(user_id, date)
+        if record:
+            record[TIME_OUT] = self._session_minutes(record, date, time_out, is_time_out=True)
+            record[WORKED] = calculate_work_minutes(*record[TIME_IN:LUNCH_MINUTES + 1])
+            self._apply_totals(user_id, self._record_totals(record))
+        self._changed(user_id)
+
+    def _update_lunch(self, user_id, date, column, value):
+        record = self._latest_open(user_id, date)
+        if record:
+            check_session_age(record[DATE], record[TIME_IN], day_offset(record[DATE], date, 0))
+            record[column] = value if column == LUNCH_MINUTES else self._session_minutes(record, date, value)
+        self._changed(user_id)
+
+    async def lunch_start(self, user_id, date, lunch_start):
+        self._update_lunch(user_id, date, LUNCH_START, lunch_start)
+
+    async def lunch_end(self, user_id, date, lunch_end):
+        self._update_lunch(user_id, date, LUNCH_END, lunch_end)
+
+    async def lunch_minutes(self, user_id, date, lunch_minutes):
+        self._update_lunch(user_id, date, LUNCH_MINUTES, lunch_minutes)
+
+    async def open_session(self, user_id):
+        record = self._latest_open(user_id)
+        return self._session(record) if record else None
+
+    async def at_work(self, date=None):
+        sessions = (self._latest_open(user_id) for user_id in list(self._records_by_user))
+        return sum(1 for record in sessions if record and (date is None or record[DATE] == date))
+
+    async def all_open_sessions(self):
+        sessions = []
+        for user_id in list(self._records_by_user):
+            session = await self.open_session(user_id)
+            if session is not None:
+                sessions.append((user_id, session))
+        return sessions
+
+    async def auto_close(self, user_id, record_id):
+        record = self._records.get(record_id)
+        if record is None or record[USER_ID] != user_id or record[TIME_OUT] is not None:
+            return None
+        session = self._session(record)
+        record[TIME_OUT], record[WORKED], record[AUTO_CLOSED] = record[TIME_IN], 0, 1
+        self._apply_totals(user_id, self._record_totals(record))
+        self._changed(user_id)
+        return session
+
+    # Полные записи
+
+    async def add_record(self, user_id, date, time_in, time_out, lunch_start=None, lunch_end=None,
+                         lunch_minutes=None):
+        time_in, time_out, lunch_start, lunch_end = normalize_shift(time_in, time_out, lunch_start, lunch_end)
+        worked_minutes = calculate_work_minutes(time_in, time_out, lunch_start, lunch_end, lunch_minutes)
+        record = self._insert(user_id, date, time_in, time_out, lunch_start, lunch_end, lunch_minutes,
+                              worked_minutes)
+        self._apply_totals(user_id, self._record_totals(record))
+        self._changed(user_id)
+        return worked_minutes
+
+    async def add_records(self, user_id, rows):
+        for row in rows:
+            await self.add_record(user_id, *row)
+        return len(rows)
+
+    async def delete_day(self, user_id, date):
+        records = [record for record in self._user_records(user_id) if record[DATE] == date]
+        for record in records:
+            if record[WORKED] is not None:
+                self._apply_totals(user_id, self._record_totals(record), -1)
+            del self._records[record[ID]]
+            self._records_by_user[user_id].discard(record[ID])
+        self._changed(user_id)
+        return len(records)
+
+    # Чтение и отчеты
+
+    def _period_records(self, user_id, start_date, end_date):
+        records = [record for record in self._user_records(user_id) if start_date <= record[DATE] <= end_date]
+        records.sort(key=lambda record: (record[DATE], record[TIME_IN], record[ID]))
+        return [(record[DATE], *record[TIME_IN:]) for record in records]
+
+    async def records_by_date(self, user_id, date):
+        records = sorted((record for record in self._user_records(user_id) if record[DATE] == date),
+                         key=lambda record: (record[TIME_IN], record[ID]))
+        return [(record[ID], *record[TIME_IN:]) for record in records]
+
+    async def records_period(self, user_id, start_date, end_date):
+        return self._period_records(user_id, start_date, end_date)
+
+    async def map_user_records(self, user_ids, start_date, end_date, func):
+        results = {}
+        for user_id in sorted(user_ids):
+            records = self._period_records(user_id, start_date, end_date)
+            if records:
+                results[user_id] = func(user_id, records)
+        return results
+
+    async def report(self, user_id, period):
+        today = self.clock.today(user_id)
+        start_date, end_date = period_bounds(period, today)
+        if period == 'month':
+            return self._monthly.get((user_id, today.strftime('%Y-%m')), (0, 0))[0]
+        start, end = start_date.isoformat(), end_date.isoformat()
+        return sum(minutes for (total_user_id, date), (minutes, sessions) in self._daily.items()
+                   if total_user_id == user_id and (start <= date <= end if period != 'year' else start <= date))
+
+    async def today_details(self, user_id):
+        today = self.today(user_id)
+        return [row[1:] for row in self._period_records(user_id, today, today)]
+
+    async def period_summary(self, user_id, start_date, end_date, norm_minutes=DAILY_NORM_MINUTES):
+        return summarize(rows_to_arrays(self._period_records(user_id, start_date, end_date)), norm_minutes)
+
+    async def export(self, user_id, start_date, end_date, file_format):
+        # В выгрузке нет столбца auto_closed
+        rows = [row[:-1] for row in self._period_records(user_id, start_date, end_date)]
+        return write_export([rows], file_format)
+
+    # Команды
+
+    async def create_team(self, owner_id, name, owner_name):
+        team = Team(len(self._teams) + 1, name, new_join_code())
+        self._teams[team.id] = team
+        self._team_members[team.id] = {owner_id: [owner_name, ROLE_MANAGER]}
+        return team
+
+    async def join_team(self, user_id, join_code, name):
+        team = next((team for team in self._teams.values() if team.join_code == join_code), None)
+        if team is not None:
+            self._team_members[team.id].setdefault(user_id, [name, ROLE_MEMBER])[0] = name
+        return team
+
+    async def set_team_role(self, team_id, user_id, role):
+        if role not in ROLES:
+            raise ValueError(f"неизвестная роль {role!r}, доступны: {', '.join(ROLES)}")
+        members = self._team_members.get(team_id, {})
+        if user_id not in members:
+            raise ValueError("пользователь не состоит в команде")
+        managers = sum(1 for name, member_role in members.values() if member_role == ROLE_MANAGER)
+        if members[user_id][1] == ROLE_MANAGER and role != ROLE_MANAGER and managers == 1:
+            raise ValueError("в команде должен остаться хотя бы один руководитель")
+        members[user_id][1] = role
+
+    async def user_teams(self, user_id):
+        return [Membership(self._teams[team_id], members[user_id][1], len(members))
+                for team_id, members in sorted(self._team_members.items()) if user_id in members]
+
+    async def member_totals(self, user_ids, start_date, end_date, norm_minutes=DAILY_NORM_MINUTES):
+        user_ids = set(user_ids)
+        days = defaultdict(list)
+        sessions = defaultdict(int)
+        for (user_id, date), (minutes, day_sessions) in self._daily.items():
+            if user_id in user_ids and start_date <= date <= end_date:
+                days[user_id].append(minutes)
+                sessions[user_id] += day_sessions
+        return {user_id: day_totals(day_minutes, sessions[user_id], norm_minutes)
+                for user_id, day_minutes in days.items()}
+
+    async def team_report(self, team_id, start_date, end_date, norm_minutes=DAILY_NORM_MINUTES):
+        members = sorted(((user_id, name, role) for user_id, (name, role) in self._team_members[team_id].items()),
+                         key=lambda member: (member[1], member[0]))
+        totals = await self.member_totals([member[0] for member in members], start_date, end_date, norm_minutes)
+        return merge_member_totals(members, totals)
+
+    # Состояние бота
+
+    async def save_bot_state(self, changes):
+        for kind, key, data in changes:
+            if data is None:
+                self._bot_state.pop((kind, key), None)
+            else:
+                self._bot_state[(kind, key)] = data
+
+    async def load_bot_state(self):
+        return [(kind, key, data) for (kind, key), data in self._bot_state.items()]
@@ -0,0 +1,333 @@
+"""Метрики бота в текстовом формате Prometheus.
+
+Гистограммы задержек:
+    timesheet_handler_seconds{handler}   обработчики (instrument_application)
+    timesheet_sql_seconds{statement}     SQL-запросы (соединения с factory=TimedConnection)
+    timesheet_bot_api_seconds{method}    вызовы Bot API (TimedHTTPXRequest)
+Значения, которые считаются в момент опроса: глубина очередей, число активных
+диалогов по состояниям, статистика кэша отчетов (register_runtime_gauges).
+
+Наблюдение - bisect по границам корзин под коротким замком, поэтому метрики
+можно держать включенными постоянно. Отдаются на /metrics отдельным
+HTTP-сервером на METRICS_HOST:METRICS_PORT (127.0.0.1 по умолчанию; без
+METRICS_PORT сервер не запускается) в режимах polling и webhook: публичный
+слушатель webhook метрики не отдает.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+HANDLER_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+# Метрики по имени; повторная регистрация (новое приложение в том же процессе) заменяет старую
+_REGISTRY = {}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами; observe() безопасен из любых потоков"""
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        _REGISTRY[name] = self
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Счетчики корзин (последняя - +Inf), сумма значений
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self):
+        with self._lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labels, counts, total in sorted(snapshot):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+class CallbackMetric:
+    """Gauge или counter, значения которого func() возвращает в момент опроса:
+    список пар (значения меток, число)"""
+
+    def __init__(self, name, documentation, metric_type, labelnames, func):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.labelnames = tuple(labelnames)
+        self.func = func
+        _REGISTRY[name] = self
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        try:
+            samples = self.func()
+        except Exception as e:
+            logger.error(f"Ошибка сбора метрики {self.name}: {e}")
+            return lines
+        for labels, value in samples:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+HANDLER_SECONDS = Histogram('timesheet_handler_seconds', 'Время работы обработчика', ['handler'],
+                            HANDLER_BUCKETS)
+SQL_SECONDS = Histogram('timesheet_sql_seconds', 'Время выполнения SQL и выборки строк', ['statement'],
+                        SQL_BUCKETS)
+BOT_API_SECONDS = Histogram('timesheet_bot_api_seconds', 'Время вызова Bot API', ['method'],
+                            HANDLER_BUCKETS)
+_handler_errors = Counter()
+CallbackMetric('timesheet_handler_errors_total', 'Исключения в обработчиках', 'counter', ['handler'],
+               lambda: sorted(((name,), count) for name, count in _handler_errors.copy().items()))
+
+
+def render():
+    lines = []
+    for metric in _REGISTRY.values():
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+# SQL-запросы
+
+_statement_labels = {}
+_WHITESPACE = re.compile(r'\s+')
+# Дополнительный обработчик каждого запроса hook(conn, sql, parameters, seconds), см. diagnostics.py
+_statement_hook = None
+
+
+def set_statement_hook(hook):
+    global _statement_hook
+    _statement_hook = hook
+
+
+def _statement_label(sql):
+    label = _statement_labels.get(sql)
+    if label is None:
+        # Запросы параметризованы, поэтому набор текстов конечен и метки не разрастаются
+        label = _statement_labels[sql] = _WHITESPACE.sub(' ', sql).strip()[:120]
+    return label
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, измеряющий execute и выборку строк; время выборки относится к последнему запросу"""
+
+    _label = ''
+
+    def execute(self, sql, parameters=()):
+        self._label = _statement_label(sql)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            SQL_SECONDS.observe(elapsed, self._label)
+            if _statement_hook is not None:
+                _statement_hook(self.connection, sql, parameters, elapsed)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._label = _statement_label(sql)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            SQL_SECONDS.observe(elapsed, self._label)
+            if _statement_hook is not None:
+                _statement_hook(self.connection, sql, None, elapsed)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            SQL_SECONDS.observe(time.perf_counter() - started, self._label)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            SQL_SECONDS.observe(time.perf_counter() - started, self._label)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, все курсоры которого - TimedCursor (sqlite3.connect(..., factory=TimedConnection))"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# Bot API
+
+class TimedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest, измеряющий каждый вызов Bot API по имени метода"""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            BOT_API_SECONDS.observe(time.perf_counter() - started, url.rsplit('/', 1)[-1])
+
+
+# Обработчики
+
+def _timed_callback(callback):
+    name = getattr(callback, '__name__', repr(callback))
+
+    @wraps(callback)
+    async def timed(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            _handler_errors[name] += 1
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+    timed.timed_callback = True
+    return timed
+
+
+def _iter_handlers(handlers):
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            yield from _iter_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                yield from _iter_handlers(state_handlers)
+            yield from _iter_handlers(handler.fallbacks)
+        else:
+            yield handler
+
+
+def _conversation_handlers(application):
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                yield handler
+
+
+def instrument_application(application):
+    """Оборачивает callback каждого обработчика (включая вложенные в ConversationHandler)"""
+    for handlers in application.handlers.values():
+        for handler in _iter_handlers(handlers):
+            if not getattr(handler.callback, 'timed_callback', False):
+                handler.callback = _timed_callback(handler.callback)
+
+
+def register_runtime_gauges(application, repo):
+    """Значения, которые считываются в момент опроса /metrics"""
+    def queue_depths():
+        depths = repo.queue_depths()
+        depths['updates'] = application.update_queue.qsize()
+        return sorted(((name,), depth) for name, depth in depths.items())
+
+    def conversations():
+        samples = []
+        for handler in _conversation_handlers(application):
+            # _conversations меняется в цикле событий; copy() атомарна под GIL
+            states = Counter(handler._conversations.copy().values())
+            samples.extend(((handler.name, state), count) for state, count in sorted(states.items()))
+        return samples
+
+    def cache_events():
+        stats = repo.cache.stats()
+        return [((event,), stats[event]) for event in ('hits', 'misses', 'evictions', 'invalidations')]
+
+    CallbackMetric('timesheet_queue_depth', 'Ожидающие задачи в очередях', 'gauge', ['queue'], queue_depths)
+    CallbackMetric('timesheet_conversations', 'Активные диалоги по состояниям', 'gauge',
+                   ['conversation', 'state'], conversations)
+
+    def open_sessions():
+        count = repo.open_sessions_count()
+        return [] if count is None else [((), count)]
+
+    CallbackMetric('timesheet_open_sessions', 'Открытые сессии в реестре', 'gauge', [], open_sessions)
+    CallbackMetric('timesheet_report_cache_entries', 'Отчетов в кэше', 'gauge', [],
+                   lambda: [((), repo.cache.stats()['entries'])])
+    CallbackMetric('timesheet_report_cache_events_total', 'События кэша отчетов', 'counter', ['event'],
+                   cache_events)
+
+
+# Отдача /metrics
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Запускает /metrics в фоновом потоке; возвращает сервер или None, если порт 0 или занят"""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    except OSError as e:
+        # Метрики не должны мешать работе бота: без них бот продолжает работать
+        logger.error(f"Не удалось открыть {host}:{port} для метрик, /metrics недоступен: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,70 @@
+"""Отправка сообщений, которые бот шлет сам (напоминания, сводки), с учетом лимитов Telegram.
+
+Bot API допускает около 30 сообщений в секунду на бота; при превышении он
+отвечает RetryAfter с паузой, которую нужно выждать. ThrottledSender держит
+общий темп отправки ниже лимита, а RetryAfter останавливает всю отправку на
+указанное время, после чего сообщение повторяется.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import timedelta
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Сообщений в секунду для рассылок; запас под ответы на сообщения пользователей
+SEND_RATE = float(os.environ.get('SEND_RATE', 20))
+SEND_ATTEMPTS = 3
+
+
+# Пауза из RetryAfter: в PTB 22 это int или timedelta в зависимости от настройки PTB_TIMEDELTA
+def retry_seconds(error):
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else retry_after
+
+
+class ThrottledSender:
+    """Отправка не чаще rate сообщений в секунду из всех задач вместе.
+
+    Используется из цикла событий. Forbidden (пользователь заблокировал бота)
+    пробрасывается вызывающему; остальные ошибки Telegram пишутся в лог.
+    """
+
+    def __init__(self, rate=SEND_RATE, attempts=SEND_ATTEMPTS):
+        self._interval = 1 / rate
+        self._attempts = attempts
+        self._next_slot = 0.0
+        self.sent = 0
+        self.retries = 0
+
+    async def _wait_slot(self):
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self._interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def send(self, bot, chat_id, text, **kwargs):
+        """True - отправлено, False - не удалось после всех попыток"""
+        for attempt in range(self._attempts):
+            await self._wait_slot()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            except RetryAfter as e:
+                # Пауза касается всех отправок: следующие слоты сдвигаются за нее
+                pause = retry_seconds(e)
+                self._next_slot = max(self._next_slot, time.monotonic() + pause)
+                self.retries += 1
+                logger.info(f"Лимит Telegram, отправка приостановлена на {pause} с")
+                continue
+            except Forbidden:
+                raise
+            except TelegramError as e:
+                logger.warning(f"Не удалось отправить сообщение {chat_id}: {e}")
+                return False
+            self.sent += 1
+            return True
+        return False
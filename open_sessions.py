@@ -0,0 +1,73 @@
+from collections import namedtuple
+
+# Незакрытая сессия пользователя: запись, день и то, что нужно для расчета при выходе
+OpenSession = namedtuple('OpenSession', ['record_id', 'date', 'time_in', 'lunch_start', 'lunch_end',
+                                         'lunch_minutes'])
+
+_REMOVED = object()
+
+
+class OpenSessions:
+    """Реестр открытых сессий: user_id -> последняя незакрытая OpenSession.
+
+    Меняется только в потоке записи и только вместе с транзакцией: задача пишет
+    изменения в свой слой, при RELEASE SAVEPOINT они переходят в слой пачки, при
+    COMMIT - в общий словарь (см. DbWriter). Откат задачи или пачки их отбрасывает,
+    поэтому реестр не расходится с базой. Цикл событий читает только общий словарь.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._batch = {}
+        self._job = {}
+
+    def load(self, sessions):
+        self._sessions = dict(sessions)
+        self._batch.clear()
+        self._job.clear()
+
+    # Чтение и изменение в потоке записи (видны незафиксированные изменения)
+
+    def get(self, user_id):
+        for layer in (self._job, self._batch):
+            if user_id in layer:
+                session = layer[user_id]
+                return None if session is _REMOVED else session
+        return self._sessions.get(user_id)
+
+    def set(self, user_id, session):
+        self._job[user_id] = _REMOVED if session is None else session
+
+    def release_job(self):
+        self._batch.update(self._job)
+        self._job.clear()
+
+    def rollback_job(self):
+        self._job.clear()
+
+    def commit(self):
+        for user_id, session in self._batch.items():
+            if session is _REMOVED:
+                self._sessions.pop(user_id, None)
+            else:
+                self._sessions[user_id] = session
+        self._batch.clear()
+
+    def rollback(self):
+        self._batch.clear()
+        self._job.clear()
+
+    # Чтение из цикла событий (только зафиксированное состояние)
+
+    def committed(self, user_id):
+        return self._sessions.get(user_id)
+
+    def items(self):
+        """Список (user_id, OpenSession); copy() атомарна, поэтому поток записи не мешает"""
+        return list(self._sessions.copy().items())
+
+    def count(self, date=None):
+        sessions = self._sessions.copy().values()
+        if date is None:
+            return len(sessions)
+        return sum(1 for session in sessions if session.date == date)
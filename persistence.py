@@ -0,0 +1,148 @@
+import asyncio
+import json
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Как часто Application передает состояние в хранилище (секунды)
+PERSISTENCE_UPDATE_INTERVAL = 5
+# Задержка записи: изменения одного прохода update_persistence уходят одной транзакцией
+FLUSH_DELAY = 0.5
+
+
+def _conversation_kind(name):
+    return f'conversation:{name}'
+
+
+class SqlitePersistence(BasePersistence):
+    """Хранит user_data, chat_data, bot_data и состояния диалогов в таблице bot_state.
+
+    Состояние держится в памяти; update_* только отмечают изменившиеся ключи
+    (значение сравнивается с последним записанным JSON, поэтому неизменные
+    user_data не пишутся повторно). Запись идет через поток записи хранилища
+    одной транзакцией на проход: через FLUSH_DELAY после первого изменения и
+    при остановке приложения во flush(). Данные должны сериализоваться в JSON.
+    """
+
+    def __init__(self, repo, update_interval=PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(callback_data=False),
+            update_interval=update_interval,
+        )
+        self._repo = repo
+        self._state = None
+        self._saved = {}
+        self._dirty = {}
+        self._flush_task = None
+
+    # Состояние читается из базы один раз; PTB запрашивает его до post_init,
+    # поэтому хранилище открывается здесь (повторный start() ничего не делает)
+    async def _load(self):
+        if self._state is None:
+            await self._repo.start()
+            rows = await self._repo.load_bot_state()
+            self._state = {}
+            for kind, key, data in rows:
+                self._saved[(kind, key)] = data
+                self._state.setdefault(kind, {})[key] = json.loads(data)
+        return self._state
+
+    async def _get_mapping(self, kind):
+        state = await self._load()
+        return {int(key): data for key, data in state.get(kind, {}).items()}
+
+    def _mark(self, kind, key, value):
+        # Пустые словари не храним: отсутствующий ключ PTB восстановит пустым
+        if value is None or value == {}:
+            data = None
+        else:
+            try:
+                data = json.dumps(value, ensure_ascii=False, sort_keys=True)
+            except (TypeError, ValueError) as e:
+                logger.error(f"Состояние {kind}/{key} не сериализуется в JSON: {e}")
+                return
+        if self._saved.get((kind, key)) == data:
+            self._dirty.pop((kind, key), None)
+            return
+        self._dirty[(kind, key)] = data
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(FLUSH_DELAY)
+        self._flush_task = None
+        await self._write_dirty()
+
+    async def _write_dirty(self):
+        if not self._dirty:
+            return
+        changes, self._dirty = self._dirty, {}
+        try:
+            await self._repo.save_bot_state([(kind, key, data) for (kind, key), data in changes.items()])
+        except Exception as e:
+            logger.error(f"Не удалось сохранить состояние бота: {e}")
+            # Более свежие изменения, пришедшие во время записи, не перезаписываем
+            for item, data in changes.items():
+                self._dirty.setdefault(item, data)
+            return
+        for item, data in changes.items():
+            if data is None:
+                self._saved.pop(item, None)
+            else:
+                self._saved[item] = data
+
+    async def get_user_data(self):
+        return await self._get_mapping('user')
+
+    async def get_chat_data(self):
+        return await self._get_mapping('chat')
+
+    async def get_bot_data(self):
+        state = await self._load()
+        return state.get('bot', {}).get('', {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        state = await self._load()
+        return {tuple(json.loads(key)): value
+                for key, value in state.get(_conversation_kind(name), {}).items()}
+
+    async def update_conversation(self, name, key, new_state):
+        self._mark(_conversation_kind(name), json.dumps(list(key)), new_state)
+
+    async def update_user_data(self, user_id, data):
+        self._mark('user', str(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._mark('chat', str(chat_id), data)
+
+    async def update_bot_data(self, data):
+        self._mark('bot', '', data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._mark('user', str(user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        self._mark('chat', str(chat_id), None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._write_dirty()
@@ -0,0 +1,82 @@
+import time
+from collections import OrderedDict, namedtuple
+
+# Закэшированный отчет: итог в минутах и готовые страницы сообщения
+CachedReport = namedtuple('CachedReport', ['total_minutes', 'pages'])
+
+
+class ReportCache:
+    """LRU-кэш отчетов с ограничением по времени жизни.
+
+    Ключ - (user_id, period, period_start). Любая запись пользователя сбрасывает
+    все его отчеты и увеличивает версию пользователя: put() с устаревшей версией
+    игнорируется, чтобы отчет, собранный параллельно с записью, не попал в кэш.
+    Используется только из цикла событий, поэтому блокировки не нужны.
+
+    ttl в put() задает время жизни отдельной записи, например для сводок,
+    подготовленных заранее (см. digest.py).
+    """
+
+    def __init__(self, max_entries=2048, ttl=600):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def version(self, user_id):
+        return self._versions.get(user_id, 0)
+
+    def put(self, key, value, version, ttl=None):
+        user_id = key[0]
+        if version != self.version(user_id):
+            return
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        self._entries[key] = (time.monotonic() + (self._ttl if ttl is None else ttl), value)
+        self._keys_by_user.setdefault(user_id, set()).add(key)
+        while len(self._entries) > self._max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        self._versions[user_id] = self.version(user_id) + 1
+        for key in self._keys_by_user.pop(user_id, ()):
+            del self._entries[key]
+            self.invalidations += 1
+
+    def _remove(self, key):
+        del self._entries[key]
+        keys = self._keys_by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[key[0]]
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
@@ -0,0 +1,187 @@
+from datetime import datetime
+from itertools import groupby
+
+from analytics import WEEKDAY_NAMES, rows_to_arrays, summarize
+from shifts import MINUTES_PER_DAY
+
+# Максимальная длина текста одного сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+
+# Длина текста так, как ее считает Telegram (в единицах UTF-16: эмодзи занимают две)
+def text_length(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+# Функция для преобразования минут в строку времени (ЧЧ:ММ)
+def minutes_to_time_str(total_minutes):
+    """Преобразует минуты в строку времени ЧЧ:ММ"""
+    if total_minutes is None:
+        return "0:00"
+
+    hours = total_minutes // 60
+    minutes = total_minutes % 60
+
+    return f"{hours}:{minutes:02d}"
+
+
+# Функция для преобразования минут от полуночи во время суток (ЧЧ:ММ)
+def minutes_to_clock_str(minutes_of_day):
+    """Преобразует минуты от полуночи во время суток ЧЧ:ММ; время следующих
+    суток ночной смены получает отметку (+N)"""
+    if minutes_of_day is None:
+        return "--:--"
+
+    days, minutes_of_day = divmod(minutes_of_day, MINUTES_PER_DAY)
+    clock = f"{minutes_of_day // 60:02d}:{minutes_of_day % 60:02d}"
+    return f"{clock} (+{days})" if days else clock
+
+
+# Строка одной сессии в отчете
+def format_record_line(number, time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes,
+                       auto_closed=False, indent=''):
+    if time_out is None or worked_minutes is None:
+        return f"{indent}{number}. ⏰ {minutes_to_clock_str(time_in)} - --:-- | ❌ незавершенный вход\n"
+    if auto_closed:
+        # Забытый вход, закрытый автоматически (scheduler.py): время не засчитано
+        return (f"{indent}{number}. ⏰ {minutes_to_clock_str(time_in)} - --:-- "
+                f"| ⚠️ выход не отмечен, закрыто автоматически\n")
+
+    line = f"{indent}{number}. ⏰ {minutes_to_clock_str(time_in)} - {minutes_to_clock_str(time_out)}"
+    if lunch_start is not None and lunch_end is not None:
+        line += f" | 🍽 {minutes_to_clock_str(lunch_start)}-{minutes_to_clock_str(lunch_end)}"
+    elif lunch_minutes:
+        line += f" | 🍽 {lunch_minutes} мин"
+    return line + f" | ⏱ {minutes_to_time_str(worked_minutes)} ч.\n"
+
+
+# Сумма отработанных минут по завершенным сессиям (worked_minutes - предпоследний столбец, перед auto_closed)
+def closed_minutes(records):
+    return sum(record[-2] for record in records if record[-2] is not None)
+
+
+def iter_day_blocks(records):
+    """Выдает текст по каждому дню периода.
+
+    records - строки (date, time_in, time_out, lunch_start, lunch_end, lunch_minutes,
+    worked_minutes, auto_closed), упорядоченные по дате и времени входа.
+    """
+    for date_str, day_records in groupby(records, key=lambda record: record[0]):
+        date_display = datetime.strptime(date_str, '%Y-%m-%d').strftime('%d.%m.%Y')
+        block = f"📅 {date_display}:\n"
+        day_total = 0
+
+        for i, record in enumerate(day_records, 1):
+            block += format_record_line(i, *record[1:], indent='  ')
+            if record[6] is not None:
+                day_total += record[6]
+
+        if day_total > 0:
+            block += f"  📈 Итого за день: {minutes_to_time_str(day_total)} часов\n"
+
+        yield block + "\n"
+
+
+# Дробление блока, который сам по себе не помещается в сообщение
+def _split_block(block, limit):
+    part = ''
+    for line in block.splitlines(keepends=True):
+        if part and text_length(part) + text_length(line) > limit:
+            yield part
+            part = ''
+        part += line
+    if part:
+        yield part
+
+
+def iter_report_pages(header, blocks, footer, limit=MESSAGE_LIMIT):
+    """Упаковывает блоки в страницы не длиннее limit.
+
+    Страница отдается, как только следующая часть в нее не помещается, поэтому первую
+    страницу можно отправлять, не форматируя весь период. footer - итог периода,
+    добавляется в конец последней страницы.
+    """
+    page = header
+    for block in blocks:
+        parts = _split_block(block, limit) if text_length(block) > limit else (block,)
+        for part in parts:
+            if page and text_length(page) + text_length(part) > limit:
+                yield page
+                page = ''
+            page += part
+    if page and text_length(page) + text_length(footer) > limit:
+        yield page
+        page = ''
+    yield page + footer
+
+
+# Детализированный отчет за неделю или месяц по записям get_detailed_records_period:
+# итог в минутах и генератор страниц (тот же текст и для запроса, и для рассылки сводок)
+def render_period_report(period, start_date, end_date, detailed_records):
+    period_name = 'неделю' if period == 'week' else 'месяц'
+    summary = summarize(rows_to_arrays(detailed_records))
+    header = f"📊 Детализированный отчет за {period_name} "
+    header += f"(с {start_date.strftime('%d.%m.%Y')} по {end_date.strftime('%d.%m.%Y')}):\n\n"
+    footer = f"📊 Всего за {period_name}: {minutes_to_time_str(summary.total_minutes)} часов"
+    if summary.overtime_minutes:
+        footer += f"\n➕ Переработка: {minutes_to_time_str(summary.overtime_minutes)} часов"
+    return summary.total_minutes, iter_report_pages(header, iter_day_blocks(detailed_records), footer)
+
+
+# Строки с переработкой/недоработкой относительно нормы
+def format_norm_lines(summary):
+    lines = ''
+    if summary.overtime_minutes:
+        lines += f"➕ Переработка: {minutes_to_time_str(summary.overtime_minutes)} часов\n"
+    if summary.undertime_minutes:
+        lines += f"➖ Недоработка: {minutes_to_time_str(summary.undertime_minutes)} часов\n"
+    return lines
+
+
+# Отчет "Статистика" по итогам периода из analytics.summarize
+def format_statistics(summary, start_date, end_date):
+    message = f"📈 Статистика (с {start_date.strftime('%d.%m.%Y')} по {end_date.strftime('%d.%m.%Y')}):\n\n"
+    if not summary.days_worked:
+        return message + "ℹ️ За этот период нет завершенных записей."
+
+    message += f"⏱ Всего: {minutes_to_time_str(summary.total_minutes)} часов\n"
+    message += f"📅 Рабочих дней: {summary.days_worked} (сессий: {summary.sessions})\n"
+    message += f"📊 В среднем за день: {minutes_to_time_str(summary.average_day_minutes)} часов\n"
+    message += f"⏰ Средний приход: {minutes_to_clock_str(summary.average_start)}, "
+    message += f"уход: {minutes_to_clock_str(summary.average_end)}\n"
+    message += f"🍽 Средний обед: {summary.average_lunch} мин\n"
+    message += f"📏 Норма дня: {minutes_to_time_str(summary.norm_minutes)} часов\n"
+    message += format_norm_lines(summary)
+
+    message += "\nПо дням недели:\n"
+    for name, minutes, days in zip(WEEKDAY_NAMES, summary.weekday_minutes, summary.weekday_days):
+        if days:
+            message += f"{name}: {minutes_to_time_str(minutes)} ч. за {days} дн., "
+            message += f"в среднем {minutes_to_time_str(minutes // days)}\n"
+    return message.rstrip('\n')
+
+
+# Итог команды за период: всего, переработка и недоработка по всем участникам
+def format_team_summary(team_name, rows, start_date, end_date):
+    total = sum(row.minutes for row in rows)
+    message = f"👥 Команда «{team_name}» "
+    message += f"(с {start_date.strftime('%d.%m.%Y')} по {end_date.strftime('%d.%m.%Y')}):\n"
+    message += f"👤 Участников: {len(rows)}, отмечались: {sum(1 for row in rows if row.days)}\n"
+    message += f"⏱ Всего: {minutes_to_time_str(total)} часов"
+    overtime = sum(row.overtime_minutes for row in rows)
+    undertime = sum(row.undertime_minutes for row in rows)
+    if overtime:
+        message += f"\n➕ Переработка: {minutes_to_time_str(overtime)} часов"
+    if undertime:
+        message += f"\n➖ Недоработка: {minutes_to_time_str(undertime)} часов"
+    return message
+
+
+# Строка сотрудника в отчете по команде: часы, дни и отклонение от нормы
+def format_member_line(number, row):
+    line = f"{number}. {row.name}: {minutes_to_time_str(row.minutes)} ч. за {row.days} дн."
+    if row.overtime_minutes:
+        line += f" ➕{minutes_to_time_str(row.overtime_minutes)}"
+    if row.undertime_minutes:
+        line += f" ➖{minutes_to_time_str(row.undertime_minutes)}"
+    return line + "\n"
@@ -0,0 +1,140 @@
+"""Напоминания о выходе и закрытие забытых сессий по расписанию.
+
+Раз в SWEEP_INTERVAL секунд задача JobQueue приложения получает все открытые
+сессии одним вызовом хранилища (в SQLite - из реестра открытых сессий, без
+запроса к базе; в PostgreSQL - один проход по частичному индексу по
+time_out IS NULL) и для каждой решает в памяти:
+
+- если задан AUTO_CLOSE_HOURS и сессия открыта дольше - она закрывается
+  автоматически: выход равен входу, время не засчитывается, запись помечается
+  auto_closed, а пользователь получает сообщение, как внести смену вручную.
+  По умолчанию закрытие выключено: суточные и многодневные смены (см. shifts.py)
+  не должны терять время без ведома пользователя;
+- у пользователя задано время напоминания (/reminder 18:30) и оно наступило по
+  его поясу - приходит напоминание отметить «Выход» (не чаще раза в день).
+
+    SWEEP_INTERVAL=60       период проверки в секундах (0 отключает)
+    AUTO_CLOSE_HOURS=0      через сколько часов сессия считается забытой (0 - не закрывать)
+
+Для JobQueue нужен python-telegram-bot[job-queue]; без него бот работает, но
+напоминаний и закрытия нет.
+"""
+import logging
+import os
+import warnings
+from collections import namedtuple
+
+from telegram.error import Forbidden
+from telegram.warnings import PTBUserWarning
+
+from notifications import ThrottledSender
+from reports import minutes_to_clock_str
+from shifts import MINUTES_PER_DAY, day_number
+
+logger = logging.getLogger(__name__)
+
+SWEEP_INTERVAL = int(os.environ.get('SWEEP_INTERVAL', 60))
+AUTO_CLOSE_HOURS = float(os.environ.get('AUTO_CLOSE_HOURS', 0))
+# Сколько минут после заданного времени напоминание еще отправляется (пропущенные из-за перезапуска проверки)
+REMINDER_WINDOW = 60
+
+SweepResult = namedtuple('SweepResult', ['open_sessions', 'reminded', 'auto_closed'])
+
+
+def format_session_start(session, today):
+    """«09:00» для сессии, начатой сегодня, иначе «16.10.2026 в 09:00»"""
+    clock = minutes_to_clock_str(session.time_in)
+    if day_number(session.date) == today.toordinal():
+        return clock
+    day, month, year = session.date[8:], session.date[5:7], session.date[:4]
+    return f"{day}.{month}.{year} в {clock}"
+
+
+class SessionSweeper:
+    """Периодическая проверка открытых сессий: напоминания и автоматическое закрытие.
+
+    Используется из цикла событий; отметки об уже отправленных напоминаниях
+    хранятся в памяти, поэтому после перезапуска напоминание в пределах
+    REMINDER_WINDOW может прийти повторно.
+    """
+
+    def __init__(self, repo, auto_close_hours=AUTO_CLOSE_HOURS, sender=None):
+        self._repo = repo
+        self._sender = sender or ThrottledSender()
+        self._auto_close_minutes = int(auto_close_hours * 60)
+        # user_id -> дата (по поясу пользователя), за которую напоминание уже отправлено
+        self._reminded = {}
+
+    def schedule(self, application, interval=SWEEP_INTERVAL):
+        """Ставит проверку в JobQueue; False, если JobQueue недоступна или проверка отключена"""
+        if not interval:
+            return False
+        with warnings.catch_warnings():
+            # Вместо предупреждения PTB - свое, с тем, что именно отключается
+            warnings.simplefilter('ignore', PTBUserWarning)
+            job_queue = application.job_queue
+        if job_queue is None:
+            logger.warning("JobQueue недоступна: напоминания и закрытие забытых сессий отключены. "
+                           "Установите python-telegram-bot[job-queue]")
+            return False
+        job_queue.run_repeating(self._run_job, interval=interval, first=interval, name='session-sweep')
+        return True
+
+    async def _run_job(self, context):
+        await self.sweep(context.bot)
+
+    async def sweep(self, bot, now=None):
+        """Одна проверка; now (секунды эпохи) задается в проверках"""
+        sessions = await self._repo.all_open_sessions()
+        clock = self._repo.clock
+        reminders = self._repo.reminders
+        to_close = []
+        to_remind = []
+        for user_id, session in sessions:
+            today, minutes = clock.now_minutes(user_id, now)
+            elapsed = (today.toordinal() - day_number(session.date)) * MINUTES_PER_DAY + minutes - session.time_in
+            if self._auto_close_minutes and elapsed >= self._auto_close_minutes:
+                to_close.append((user_id, session, today))
+                continue
+            reminder_time = reminders.get(user_id)
+            if reminder_time is None or self._reminded.get(user_id) == today:
+                continue
+            since_reminder = minutes - reminder_time
+            # Сессия должна быть начата раньше времени напоминания: вечерний вход не напоминает о выходе
+            if 0 <= since_reminder < REMINDER_WINDOW and elapsed > since_reminder:
+                to_remind.append((user_id, session, today))
+
+        # Отметки о напоминаниях нужны только тем, кто еще на работе
+        open_users = {user_id for user_id, session in sessions}
+        self._reminded = {user_id: day for user_id, day in self._reminded.items() if user_id in open_users}
+
+        closed = 0
+        for user_id, session, today in to_close:
+            if await self._repo.auto_close(user_id, session.record_id) is None:
+                # Пользователь успел закрыть сессию сам
+                continue
+            closed += 1
+            await self._send(bot, user_id,
+                             f"⚠️ Вход {format_session_start(session, today)} не был закрыт "
+                             f"больше {self._auto_close_minutes // 60} ч., запись закрыта автоматически "
+                             f"без учета времени.\n"
+                             f"Чтобы внести смену, удалите этот день через «Коррекция журнала» "
+                             f"и добавьте ее через «Добавить запись».")
+        for user_id, session, today in to_remind:
+            self._reminded[user_id] = today
+            await self._send(bot, user_id,
+                             f"⏰ Вы на работе с {format_session_start(session, today)}. "
+                             f"Не забудьте отметить «Выход».")
+
+        result = SweepResult(len(sessions), len(to_remind), closed)
+        if to_remind or closed:
+            logger.info(f"Проверка открытых сессий: {result}")
+        return result
+
+    # Личный чат с пользователем имеет тот же id
+    async def _send(self, bot, user_id, text):
+        try:
+            return await self._sender.send(bot, user_id, text)
+        except Forbidden:
+            # Пользователь заблокировал бота
+            return False
@@ -0,0 +1,400 @@
+"""Шардирование хранилища: пользователи распределены по нескольким файлам SQLite.
+
+В режиме WAL у файла только один писатель, поэтому все отметки всех компаний
+стоят в одной очереди. С DB_SHARDS=N у каждого из N файлов свой поток записи и
+свой пул чтения, и записи разных шардов идут параллельно.
+
+    DB_SHARDS=4                 число шардов (1 - обычный Repository без маршрутизации)
+    DB_REBALANCE=1              после запуска бота в фоне перенести пользователей,
+                                размещенных не по текущему числу шардов
+
+Шард 0 - основной файл DB_PATH: в нем, кроме данных своих пользователей, лежат
+состояние бота, настройки пользователей и таблица размещения shard_map. Шард i -
+файл timesheet-i.db рядом. Новый пользователь получает шард по crc32(user_id) % N
+и запоминается в shard_map, поэтому смена числа шардов не теряет данные: старые
+пользователи остаются на месте, пока их не перенесет rebalance. Файлы шардов
+открываются при первом обращении к ним (существующие - при запуске, чтобы
+реестры открытых сессий были прогреты).
+
+Перенос пользователя идет без остановки бота: новые записи этого пользователя
+ждут окончания переноса, остальные пользователи не блокируются. Вне бота:
+
+    python sharding.py status
+    python sharding.py rebalance --shards 4
+"""
+import argparse
+import asyncio
+import logging
+import os
+import zlib
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from analytics import DAILY_NORM_MINUTES
+from backend import StorageBackend
+from db_paths import DB_PATH, shard_path
+from report_cache import ReportCache
+from storage import Repository
+from teams import merge_member_totals
+from timezones import UserClock
+
+logger = logging.getLogger(__name__)
+
+DB_SHARDS = int(os.environ.get('DB_SHARDS', 1))
+DB_REBALANCE = os.environ.get('DB_REBALANCE', '') not in ('', '0')
+
+
+class ShardRouter:
+    """user_id -> номер шарда: сначала явное размещение из shard_map, иначе хэш"""
+
+    def __init__(self, shard_count, placement=None):
+        self.shard_count = shard_count
+        self.placement = dict(placement or {})
+
+    def hashed_shard(self, user_id):
+        return zlib.crc32(str(user_id).encode()) % self.shard_count
+
+    def shard_for(self, user_id):
+        shard = self.placement.get(user_id)
+        return self.hashed_shard(user_id) if shard is None else shard
+
+    def misplaced(self):
+        """Пользователи, чей шард не совпадает с хэшем при текущем числе шардов"""
+        return sorted(user_id for user_id, shard in self.placement.items() if shard != self.hashed_shard(user_id))
+
+
+class ShardedRepository(StorageBackend):
+    """Тот же интерфейс, что у Repository, поверх нескольких Repository-шардов.
+
+    cache (отчеты) и clock (пояса) общие; пояса, состояние бота и shard_map хранятся
+    в шарде 0. Методы с user_id направляются в шард пользователя.
+    """
+
+    def __init__(self, db_path=DB_PATH, shard_count=DB_SHARDS, rebalance=DB_REBALANCE, **repository_options):
+        self._db_path = db_path
+        self._options = repository_options
+        self._rebalance_on_start = rebalance
+        self.router = ShardRouter(shard_count)
+        self.cache = ReportCache()
+        self.clock = UserClock()
+        self._shards = {}
+        self._opening = {}
+        # Пользователь в процессе переноса -> событие окончания; его записи в полете
+        self._moving = {}
+        self._writes_in_flight = Counter()
+        self._rebalance_task = None
+        self._closed = True
+
+    @property
+    def main(self):
+        return self._shards[0]
+
+    async def start(self):
+        if not self._closed:
+            return
+        await self._open_shard(0)
+        self.router.placement = await self.main.load_shard_map(adopt_shard=0)
+        # Уже существующие файлы открываются сразу: их открытые сессии должны быть в реестрах
+        for shard in range(1, self.router.shard_count):
+            if Path(shard_path(self._db_path, shard)).exists():
+                await self._open_shard(shard)
+        for shard in set(self.router.placement.values()) - set(self._shards):
+            # Шард за пределами текущего числа (число уменьшили) нужен, пока из него не перенесут
+            await self._open_shard(shard)
+        self._closed = False
+        logger.info(f"Шардов: {self.router.shard_count}, открыто файлов: {len(self._shards)}")
+        if self._rebalance_on_start:
+            self._rebalance_task = asyncio.create_task(self.rebalance())
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._rebalance_task is not None:
+            self._rebalance_task.cancel()
+            await asyncio.gather(self._rebalance_task, return_exceptions=True)
+        for shard in self._shards.values():
+            await shard.close()
+
+    async def _open_shard(self, shard):
+        repository = self._shards.get(shard)
+        if repository is not None:
+            return repository
+        opening = self._opening.get(shard)
+        if opening is None:
+            opening = self._opening[shard] = asyncio.ensure_future(self._start_shard(shard))
+        return await asyncio.shield(opening)
+
+    async def _start_shard(self, shard):
+        repository = Repository(shard_path(self._db_path, shard), cache=self.cache, clock=self.clock,
+                                **self._options)
+        try:
+            await repository.start()
+        finally:
+            self._opening.pop(shard, None)
+        self._shards[shard] = repository
+        return repository
+
+    async def _wait_move(self, user_id):
+        moving = self._moving.get(user_id)
+        while moving is not None:
+            await moving.wait()
+            moving = self._moving.get(user_id)
+
+    async def _shard(self, user_id, wait_move=True):
+        if wait_move:
+            await self._wait_move(user_id)
+        shard = self.router.placement.get(user_id)
+        if shard is None:
+            # Первое обращение нового пользователя: размещение по хэшу запоминается
+            shard = self.router.hashed_shard(user_id)
+            self.router.placement[user_id] = shard
+            await self.main.set_user_shard(user_id, shard)
+        return await self._open_shard(shard)
+
+    async def _read(self, method, user_id, *args):
+        if self._closed:
+            raise RuntimeError('Хранилище закрыто')
+        shard = await self._shard(user_id)
+        return await getattr(shard, method)(user_id, *args)
+
+    async def _write(self, method, user_id, *args):
+        if self._closed:
+            raise RuntimeError('Хранилище закрыто')
+        await self._wait_move(user_id)
+        # Счетчик растет до выбора шарда (между проверкой и ним нет await): перенос, начатый позже,
+        # ждет, пока запись, направленная в старый шард, не завершится, даже если шард еще открывается
+        self._writes_in_flight[user_id] += 1
+        try:
+            shard = await self._shard(user_id, wait_move=False)
+            return await getattr(shard, method)(user_id, *args)
+        finally:
+            self._writes_in_flight[user_id] -= 1
+            if not self._writes_in_flight[user_id]:
+                del self._writes_in_flight[user_id]
+
+    # Перенос между шардами
+
+    async def move_user(self, user_id, target):
+        """Переносит строки пользователя в шард target, не останавливая остальных"""
+        source = self.router.shard_for(user_id)
+        if source == target or user_id in self._moving:
+            return 0
+        done = self._moving[user_id] = asyncio.Event()
+        try:
+            while self._writes_in_flight[user_id]:
+                await asyncio.sleep(0.01)
+            source_shard = await self._open_shard(source)
+            target_shard = await self._open_shard(target)
+            # Копия, затем смена размещения, затем удаление: при сбое между шагами данные
+            # остаются в источнике, а повторный перенос заменяет неполную копию
+            rows = await source_shard.export_user(user_id)
+            count = await target_shard.import_user(user_id, rows)
+            await self.main.set_user_shard(user_id, target)
+            self.router.placement[user_id] = target
+            await source_shard.drop_user(user_id)
+        finally:
+            del self._moving[user_id]
+            done.set()
+        logger.info(f"Пользователь {user_id} перенесен из шарда {source} в {target}: {count} строк")
+        return count
+
+    async def rebalance(self, limit=None):
+        """Переносит пользователей, размещенных не по хэшу текущего числа шардов"""
+        moved = 0
+        for user_id in self.router.misplaced()[:limit]:
+            await self.move_user(user_id, self.router.hashed_shard(user_id))
+            moved += 1
+        if moved:
+            logger.info(f"Перебалансировка завершена: перенесено пользователей {moved}")
+        return moved
+
+    def shard_sizes(self):
+        """Число пользователей в каждом шарде по shard_map"""
+        return dict(sorted(Counter(self.router.placement.values()).items()))
+
+    # Интерфейс Repository
+
+    def db_stats(self):
+        totals = Counter()
+        for shard in self._shards.values():
+            totals.update(shard.db_stats())
+        return dict(totals)
+
+    def queue_depths(self):
+        depths = {}
+        for number, shard in sorted(self._shards.items()):
+            for name, depth in shard.queue_depths().items():
+                depths[f'{name}-{number}'] = depth
+        return depths
+
+    @property
+    def reminders(self):
+        return self.main.reminders
+
+    @property
+    def digests(self):
+        return self.main.digests
+
+    async def set_timezone(self, user_id, timezone):
+        await self.main.set_timezone(user_id, timezone)
+
+    async def set_reminder(self, user_id, reminder_time):
+        await self.main.set_reminder(user_id, reminder_time)
+
+    async def set_digest(self, user_id, digest):
+        await self.main.set_digest(user_id, digest)
+
+    async def auto_close(self, user_id, record_id):
+        return await self._write('auto_close', user_id, record_id)
+
+    async def all_open_sessions(self):
+        sessions = []
+        for shard in list(self._shards.values()):
+            sessions.extend(await shard.all_open_sessions())
+        return sessions
+
+    async def open_session(self, user_id):
+        # Шард, который еще не открывали, не содержит сессий
+        shard = self._shards.get(self.router.shard_for(user_id))
+        return await shard.open_session(user_id) if shard is not None else None
+
+    async def at_work(self, date=None):
+        return sum([await shard.at_work(date) for shard in list(self._shards.values())])
+
+    def open_sessions_count(self):
+        return sum(shard.open_sessions_count() for shard in list(self._shards.values()))
+
+    async def save_bot_state(self, changes):
+        await self.main.save_bot_state(changes)
+
+    async def load_bot_state(self):
+        return await self.main.load_bot_state()
+
+    # Команды хранятся в шарде 0, итоги участников - в их шардах
+
+    async def create_team(self, owner_id, name, owner_name):
+        return await self.main.create_team(owner_id, name, owner_name)
+
+    async def join_team(self, user_id, join_code, name):
+        return await self.main.join_team(user_id, join_code, name)
+
+    async def set_team_role(self, team_id, user_id, role):
+        await self.main.set_team_role(team_id, user_id, role)
+
+    async def user_teams(self, user_id):
+        return await self.main.user_teams(user_id)
+
+    async def member_totals(self, user_ids, start_date, end_date, norm_minutes=DAILY_NORM_MINUTES):
+        users_by_shard = defaultdict(list)
+        for user_id in user_ids:
+            users_by_shard[self.router.shard_for(user_id)].append(user_id)
+        # По одному сгруппированному запросу на шард, шарды читаются параллельно
+        results = await asyncio.gather(*(
+            shard.member_totals(users_by_shard[number], start_date, end_date, norm_minutes)
+            for number, shard in list(self._shards.items()) if number in users_by_shard))
+        totals = {}
+        for result in results:
+            totals.update(result)
+        return totals
+
+    async def team_report(self, team_id, start_date, end_date, norm_minutes=DAILY_NORM_MINUTES):
+        members = await self.main.team_members(team_id)
+        totals = await self.member_totals([user_id for user_id, name, role in members], start_date, end_date,
+                                          norm_minutes)
+        return merge_member_totals(members, totals)
+
+    async def punch_in(self, user_id, date, time_in):
+        await self._write('punch_in', user_id, date, time_in)
+
+    async def punch_out(self, user_id, date, time_out):
+        await self._write('punch_out', user_id, date, time_out)
+
+    async def lunch_start(self, user_id, date, lunch_start):
+        await self._write('lunch_start', user_id, date, lunch_start)
+
+    async def lunch_end(self, user_id, date, lunch_end):
+        await self._write('lunch_end', user_id, date, lunch_end)
+
+    async def lunch_minutes(self, user_id, date, lunch_minutes):
+        await self._write('lunch_minutes', user_id, date, lunch_minutes)
+
+    async def add_record(self, user_id, date, time_in, time_out, lunch_start=None, lunch_end=None,
+                         lunch_minutes=None):
+        return await self._write('add_record', user_id, date, time_in, time_out, lunch_start, lunch_end,
+                                 lunch_minutes)
+
+    async def add_records(self, user_id, rows):
+        return await self._write('add_records', user_id, rows)
+
+    async def delete_day(self, user_id, date):
+        return await self._write('delete_day', user_id, date)
+
+    async def records_by_date(self, user_id, date):
+        return await self._read('records_by_date', user_id, date)
+
+    async def map_user_records(self, user_ids, start_date, end_date, func):
+        users_by_shard = defaultdict(list)
+        for user_id in user_ids:
+            users_by_shard[self.router.shard_for(user_id)].append(user_id)
+        # Шарды читаются параллельно, каждый одним проходом
+        results = await asyncio.gather(*(
+            shard.map_user_records(users_by_shard[number], start_date, end_date, func)
+            for number, shard in list(self._shards.items()) if number in users_by_shard))
+        mapped = {}
+        for result in results:
+            mapped.update(result)
+        return mapped
+
+    async def records_period(self, user_id, start_date, end_date):
+        return await self._read('records_period', user_id, start_date, end_date)
+
+    async def report(self, user_id, period):
+        return await self._read('report', user_id, period)
+
+    async def today_details(self, user_id):
+        return await self._read('today_details', user_id)
+
+    async def period_summary(self, user_id, start_date, end_date, norm_minutes=DAILY_NORM_MINUTES):
+        return await self._read('period_summary', user_id, start_date, end_date, norm_minutes)
+
+    async def export(self, user_id, start_date, end_date, file_format):
+        return await self._read('export', user_id, start_date, end_date, file_format)
+
+
+def open_repository(db_path=DB_PATH, shard_count=DB_SHARDS):
+    """Repository для одного файла, ShardedRepository - для нескольких"""
+    if shard_count > 1:
+        return ShardedRepository(db_path, shard_count)
+    return Repository(db_path)
+
+
+async def _run_command(args):
+    repo = ShardedRepository(args.db, args.shards, rebalance=False)
+    await repo.start()
+    try:
+        if args.command == 'rebalance':
+            moved = await repo.rebalance(args.limit)
+            print(f"Перенесено пользователей: {moved}")
+        print(f"Шардов: {args.shards}, ожидают переноса: {len(repo.router.misplaced())}")
+        for shard, users in repo.shard_sizes().items():
+            print(f"  шард {shard} ({shard_path(args.db, shard)}): пользователей {users}")
+    finally:
+        await repo.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Размещение пользователей по шардам')
+    parser.add_argument('command', choices=('status', 'rebalance'))
+    parser.add_argument('--db', default=DB_PATH, help='основной файл (шард 0)')
+    parser.add_argument('--shards', type=int, default=DB_SHARDS)
+    parser.add_argument('--limit', type=int, help='перенести не больше стольких пользователей')
+    args = parser.parse_args(argv)
+    if args.shards < 1:
+        parser.error('--shards должно быть не меньше 1')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_run_command(args))
+
+
+if __name__ == '__main__':
+    main()
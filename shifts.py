@@ -0,0 +1,122 @@
+"""Смены, переходящие через полночь.
+
+Время в записях хранится в минутах от полуночи дня записи (records.date - день
+начала смены), поэтому выход в 06:00 следующего дня - это 1800, а выход через
+двое суток - больше 2880. Так смена любой длины остается одной записью, а
+calculate_work_minutes считает ее длительность простым вычитанием.
+
+Выход и обед относятся к открытой сессии, только если от ее входа прошло не
+больше MAX_SHIFT_HOURS часов: иначе сессия считается забытой (StaleSessionError),
+и ее нужно исправить вручную, а не закрывать смену на несколько суток.
+
+Агрегаты daily_totals/monthly_totals считаются по календарным дням: минуты
+смены делятся между днями, на которые она пришлась (split_by_day).
+"""
+import os
+from datetime import date as date_type, timedelta
+
+MINUTES_PER_DAY = 24 * 60
+# Наибольшая длина смены: отметки позже относятся не к открытой сессии, а к забытой
+MAX_SHIFT_HOURS = float(os.environ.get('MAX_SHIFT_HOURS', 24))
+SAME_TIME_ERROR = "время выхода совпадает со временем входа"
+
+
+class StaleSessionError(Exception):
+    """Открытая сессия начата раньше, чем MAX_SHIFT_HOURS часов до отметки; отметка не сохранена"""
+
+    def __init__(self, session_date):
+        super().__init__(f"открытая сессия от {session_date} длиннее {MAX_SHIFT_HOURS:g} ч")
+        self.session_date = session_date
+
+
+# Номер дня от 1970-01-01 по строке 'ГГГГ-ММ-ДД'
+def day_number(date_str):
+    return date_type.fromisoformat(date_str).toordinal()
+
+
+def day_offset(session_date, date, minutes):
+    """Время суток minutes дня date в минутах от полуночи дня session_date"""
+    return (day_number(date) - day_number(session_date)) * MINUTES_PER_DAY + minutes
+
+
+def session_minutes(session_date, time_in, date, minutes, is_time_out=False):
+    """Время суток, отмеченное в день date, в минутах от начала дня сессии: время
+    раньше входа в тот же день относится к следующему; выход, равный входу, - ошибка
+    ввода, ValueError (те же правила, что у normalize_shift). Время дальше
+    MAX_SHIFT_HOURS от входа - StaleSessionError"""
+    minutes = day_offset(session_date, date, minutes)
+    if is_time_out and minutes == time_in:
+        raise ValueError(SAME_TIME_ERROR)
+    if minutes < time_in:
+        minutes += MINUTES_PER_DAY
+    check_session_age(session_date, time_in, minutes)
+    return minutes
+
+
+def check_session_age(session_date, time_in, minutes):
+    """StaleSessionError, если время minutes (от начала дня сессии) дальше MAX_SHIFT_HOURS от входа"""
+    if minutes - time_in > MAX_SHIFT_HOURS * 60:
+        raise StaleSessionError(session_date)
+
+
+def normalize_shift(time_in, time_out, lunch_start=None, lunch_end=None):
+    """Переводит введенное время суток в минуты от начала дня смены: выход раньше
+    входа и обед до входа относятся к следующему дню. Выход, равный входу, скорее
+    опечатка или двойное нажатие, чем смена на сутки: ValueError"""
+    if time_out is not None and time_out == time_in:
+        raise ValueError(SAME_TIME_ERROR)
+    if time_out is not None and time_out < time_in:
+        time_out += MINUTES_PER_DAY
+    if lunch_start is not None and lunch_start < time_in:
+        lunch_start += MINUTES_PER_DAY
+    if lunch_end is not None and lunch_end < time_in:
+        lunch_end += MINUTES_PER_DAY
+    if lunch_start is not None and lunch_end is not None and lunch_end < lunch_start:
+        lunch_end += MINUTES_PER_DAY
+    return time_in, time_out, lunch_start, lunch_end
+
+
+def _overlap(start, end, day_start, day_end):
+    return max(0, min(end, day_end) - max(start, day_start))
+
+
+def split_by_day(time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes):
+    """Делит отработанные минуты смены по календарным дням.
+
+    Возвращает список (смещение дня от даты записи, минуты), первый элемент -
+    всегда день записи. Время смены в каждом дне уменьшается на часть интервала
+    обеда в этом же дне; обед, заданный только минутами, вычитается из первого дня. Сумма по дням всегда равна worked_minutes.
+    Смена внутри одних суток дает один элемент без дополнительных расчетов.
+    """
+    if time_out <= MINUTES_PER_DAY:
+        return [(0, worked_minutes)]
+
+    lunch_taken = worked_minutes < time_out - time_in
+    parts = []
+    for offset in range(time_out // MINUTES_PER_DAY + 1):
+        day_start = offset * MINUTES_PER_DAY
+        day_end = day_start + MINUTES_PER_DAY
+        minutes = _overlap(time_in, time_out, day_start, day_end)
+        if lunch_taken and lunch_start is not None and lunch_end is not None:
+            minutes = max(0, minutes - _overlap(lunch_start, lunch_end, day_start, day_end))
+        if minutes > 0 or offset == 0:
+            parts.append([offset, minutes])
+
+    # Остаток (обед минутами или обед за пределами смены) снимается с дней по порядку
+    excess = sum(minutes for offset, minutes in parts) - worked_minutes
+    for part in parts:
+        taken = min(part[1], excess)
+        part[1] -= taken
+        excess -= taken
+    return [(offset, minutes) for offset, minutes in parts if minutes or offset == 0]
+
+
+def shift_totals(totals, date, time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes):
+    """Добавляет вклад смены в агрегаты по календарным дням: totals[date] = (минуты, сессии).
+    Сессия считается в день начала смены, минуты - в те дни, на которые они пришлись"""
+    parts = split_by_day(time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes)
+    for offset, minutes in parts:
+        day = date if offset == 0 else (date_type.fromisoformat(date) + timedelta(days=offset)).isoformat()
+        day_minutes, day_sessions = totals.get(day, (0, 0))
+        totals[day] = (day_minutes + minutes, day_sessions + (offset == 0))
+    return totals
@@ -0,0 +1,1124 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+
+from analytics import DAILY_NORM_MINUTES, period_summary
+from backend import StorageBackend
+from db_paths import DB_PATH
+from exporter import build_export
+from metrics import TimedConnection
+from open_sessions import OpenSession, OpenSessions
+from report_cache import ReportCache
+from shifts import MINUTES_PER_DAY, check_session_age, day_offset, normalize_shift, session_minutes, shift_totals
+from teams import create_team, join_team, member_totals, set_member_role, team_members, team_report, user_teams
+from time_parser import parse_time
+from timezones import UserClock
+
+logger = logging.getLogger(__name__)
+
+
+# Версия схемы хранится в PRAGMA user_version:
+# 0 - исходная схема (время текстом 'ЧЧ:ММ', total_hours REAL),
+# 1 - время в минутах от полуночи (INTEGER), отработанное время в worked_minutes,
+# 2 - время в минутах от полуночи дня записи: выход и обед после полуночи больше 1440 (см. shifts.py),
+#     агрегаты делят смену по календарным дням,
+# 3 - records.auto_closed и user_settings.reminder_time (см. scheduler.py),
+# 4 - user_settings.digest (см. digest.py)
+SCHEMA_VERSION = 4
+
+
+def _create_schema(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS records
+                      (
+                          id             INTEGER PRIMARY KEY AUTOINCREMENT,
+                          user_id        INTEGER NOT NULL,
+                          date           TEXT    NOT NULL,
+                          time_in        INTEGER,
+                          time_out       INTEGER,
+                          lunch_start    INTEGER,
+                          lunch_end      INTEGER,
+                          lunch_minutes  INTEGER,
+                          worked_minutes INTEGER,
+                          auto_closed    INTEGER NOT NULL DEFAULT 0
+                      )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_date ON records (user_id, date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user ON records (user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_date ON records (date)')
+    # Частичный индекс только по незакрытым сессиям: прогрев реестра и поиск открытой записи
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_records_open ON records (user_id, date) WHERE time_out IS NULL')
+
+    # Агрегаты по дням и месяцам: отчеты читают их вместо суммирования сырых записей
+    cursor.execute('''CREATE TABLE IF NOT EXISTS daily_totals
+                      (
+                          user_id  INTEGER NOT NULL,
+                          date     TEXT    NOT NULL,
+                          minutes  INTEGER NOT NULL DEFAULT 0,
+                          sessions INTEGER NOT NULL DEFAULT 0,
+                          PRIMARY KEY (user_id, date)
+                      ) WITHOUT ROWID''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS monthly_totals
+                      (
+                          user_id  INTEGER NOT NULL,
+                          month    TEXT    NOT NULL,
+                          minutes  INTEGER NOT NULL DEFAULT 0,
+                          sessions INTEGER NOT NULL DEFAULT 0,
+                          PRIMARY KEY (user_id, month)
+                      ) WITHOUT ROWID''')
+
+    # Состояние бота между перезапусками (user_data, диалоги) в виде JSON, см. persistence.py
+    cursor.execute('''CREATE TABLE IF NOT EXISTS bot_state
+                      (
+                          kind TEXT NOT NULL,
+                          key  TEXT NOT NULL,
+                          data TEXT NOT NULL,
+                          PRIMARY KEY (kind, key)
+                      ) WITHOUT ROWID''')
+
+    # Настройки пользователя; timezone - имя пояса IANA, NULL - пояс по умолчанию;
+    # reminder_time - время напоминания о выходе в минутах от полуночи по поясу пользователя;
+    # digest - период рассылаемой сводки ('week' или 'month'), NULL - сводка не нужна
+    cursor.execute('''CREATE TABLE IF NOT EXISTS user_settings
+                      (
+                          user_id       INTEGER PRIMARY KEY,
+                          timezone      TEXT,
+                          reminder_time INTEGER,
+                          digest        TEXT
+                      ) WITHOUT ROWID''')
+
+    # Размещение пользователей по файлам-шардам (ведется только в основном файле, см. sharding.py)
+    cursor.execute('''CREATE TABLE IF NOT EXISTS shard_map
+                      (
+                          user_id INTEGER PRIMARY KEY,
+                          shard   INTEGER NOT NULL
+                      ) WITHOUT ROWID''')
+
+    # Команды и их участники (только в основном файле, см. teams.py); name - имя для отчета руководителя
+    cursor.execute('''CREATE TABLE IF NOT EXISTS teams
+                      (
+                          id        INTEGER PRIMARY KEY AUTOINCREMENT,
+                          name      TEXT    NOT NULL,
+                          join_code TEXT    NOT NULL UNIQUE,
+                          owner_id  INTEGER NOT NULL
+                      )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS team_members
+                      (
+                          team_id INTEGER NOT NULL,
+                          user_id INTEGER NOT NULL,
+                          name    TEXT    NOT NULL,
+                          role    TEXT    NOT NULL,
+                          PRIMARY KEY (team_id, user_id)
+                      ) WITHOUT ROWID''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_team_members_user ON team_members (user_id)')
+
+
+# Столбцы, добавленные в версиях 3 и 4, в таблицах, созданных до них
+def _migrate_columns(cursor):
+    for table, column, definition in (('records', 'auto_closed', 'INTEGER NOT NULL DEFAULT 0'),
+                                      ('user_settings', 'reminder_time', 'INTEGER'),
+                                      ('user_settings', 'digest', 'TEXT')):
+        columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({table})')]
+        if columns and column not in columns:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+# Перенос записей из текстовой схемы в минутную на месте, в транзакции init_db
+def _migrate_to_minutes(cursor):
+    def to_minutes(value):
+        try:
+            return parse_time(value) if value else None
+        except ValueError:
+            return None
+
+    cursor.execute('ALTER TABLE records RENAME TO records_legacy')
+    for index_name in ('idx_user_date', 'idx_user', 'idx_date'):
+        cursor.execute(f'DROP INDEX IF EXISTS {index_name}')
+    cursor.execute('DROP TABLE IF EXISTS daily_totals')
+    cursor.execute('DROP TABLE IF EXISTS monthly_totals')
+    _create_schema(cursor)
+
+    legacy = cursor.connection.execute('''SELECT id, user_id, date, time_in, time_out,
+                                                 lunch_start, lunch_end, lunch_minutes
+                                          FROM records_legacy''')
+    while True:
+        rows = legacy.fetchmany(1000)
+        if not rows:
+            break
+        converted = []
+        for record_id, user_id, date, time_in, time_out, lunch_start, lunch_end, lunch_minutes in rows:
+            time_in, time_out = to_minutes(time_in), to_minutes(time_out)
+            lunch_start, lunch_end = to_minutes(lunch_start), to_minutes(lunch_end)
+            worked_minutes = None
+            if time_in is not None and time_out is not None:
+                worked_minutes = calculate_work_minutes(time_in, time_out, lunch_start, lunch_end, lunch_minutes)
+            converted.append((record_id, user_id, date, time_in, time_out, lunch_start, lunch_end,
+                              lunch_minutes, worked_minutes))
+        cursor.executemany('''INSERT INTO records
+                              (id, user_id, date, time_in, time_out, lunch_start, lunch_end,
+                               lunch_minutes, worked_minutes)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', converted)
+    cursor.execute('DROP TABLE records_legacy')
+
+
+# Ночные смены, сохраненные до версии 2 с выходом раньше входа (и нулевым временем), пересчитываются;
+# записи с выходом, равным входу, normalize_shift не принимает, они остаются как есть
+def _migrate_overnight(cursor):
+    rows = cursor.execute('''SELECT id, time_in, time_out, lunch_start, lunch_end, lunch_minutes
+                             FROM records
+                             WHERE (time_out < time_in OR lunch_start < time_in OR lunch_end < lunch_start)
+                               AND time_out IS NOT time_in''').fetchall()
+    converted = []
+    for record_id, time_in, time_out, lunch_start, lunch_end, lunch_minutes in rows:
+        time_in, time_out, lunch_start, lunch_end = normalize_shift(time_in, time_out, lunch_start, lunch_end)
+        worked_minutes = None
+        if time_out is not None:
+            worked_minutes = calculate_work_minutes(time_in, time_out, lunch_start, lunch_end, lunch_minutes)
+        converted.append((time_out, lunch_start, lunch_end, worked_minutes, record_id))
+    cursor.executemany('''UPDATE records
+                          SET time_out=?, lunch_start=?, lunch_end=?, worked_minutes=?
+                          WHERE id=?''', converted)
+    if converted:
+        logger.info(f"Пересчитано ночных смен: {len(converted)}")
+
+
+# Инициализация базы данных с оптимизацией и миграцией схемы
+def init_db(db_path=DB_PATH):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    cursor = conn.cursor()
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        if version < SCHEMA_VERSION:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='records'")
+            if cursor.fetchone() is not None:
+                logger.info(f"Миграция схемы БД с версии {version} до {SCHEMA_VERSION}")
+                if version < 1:
+                    _migrate_to_minutes(cursor)
+                if version < 2:
+                    _migrate_overnight(cursor)
+                _migrate_columns(cursor)
+        _create_schema(cursor)
+        if version < SCHEMA_VERSION:
+            if version < 2:
+                rebuild_totals(conn)
+            cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        cursor.execute('COMMIT')
+    except Exception:
+        if conn.in_transaction:
+            cursor.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+
+# Полный пересчет агрегатов по таблице records (для существующих баз)
+def rebuild_totals(conn, user_id=None):
+    cursor = conn.cursor()
+    user_filter = '' if user_id is None else ' AND user_id = :user_id'
+    cursor.execute('DELETE FROM daily_totals WHERE 1' + user_filter, {'user_id': user_id})
+    cursor.execute('DELETE FROM monthly_totals WHERE 1' + user_filter, {'user_id': user_id})
+    # Смены в пределах суток суммируются запросом, переходящие через полночь делятся по дням
+    cursor.execute('''INSERT INTO daily_totals (user_id, date, minutes, sessions)
+                      SELECT user_id, date, SUM(worked_minutes), COUNT(*)
+                      FROM records
+                      WHERE worked_minutes IS NOT NULL AND time_out <= :day''' + user_filter + '''
+                      GROUP BY user_id, date''', {'user_id': user_id, 'day': MINUTES_PER_DAY})
+    overnight = conn.execute('''SELECT user_id, date, time_in, time_out, lunch_start, lunch_end,
+                                       lunch_minutes, worked_minutes
+                                FROM records
+                                WHERE worked_minutes IS NOT NULL AND time_out > :day''' + user_filter,
+                             {'user_id': user_id, 'day': MINUTES_PER_DAY})
+    for row_user_id, date, *shift in overnight.fetchall():
+        for day, (minutes, sessions) in shift_totals({}, date, *shift).items():
+            cursor.execute('''INSERT INTO daily_totals (user_id, date, minutes, sessions)
+                              VALUES (?, ?, ?, ?)
+                              ON CONFLICT (user_id, date) DO UPDATE
+                              SET minutes  = minutes + excluded.minutes,
+                                  sessions = sessions + excluded.sessions''',
+                           (row_user_id, day, minutes, sessions))
+    cursor.execute('''INSERT INTO monthly_totals (user_id, month, minutes, sessions)
+                      SELECT user_id, substr(date, 1, 7), SUM(minutes), SUM(sessions)
+                      FROM daily_totals
+                      WHERE 1''' + user_filter + '''
+                      GROUP BY user_id, substr(date, 1, 7)''', {'user_id': user_id})
+
+
+# Передача результата задачи в future из потока-писателя
+def _resolve_future(future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class DbWriter:
+    """Единственный поток, выполняющий все записи в БД.
+
+    Задачи приходят через очередь; задачи, поступившие в пределах короткого окна,
+    выполняются в одной транзакции (каждая под своим SAVEPOINT), а результат
+    возвращается ожидающему обработчику через asyncio.Future.
+    """
+
+    def __init__(self, db_path=DB_PATH, batch_window=0.002, max_batch=200, sessions=None):
+        self._db_path = db_path
+        # Реестр открытых сессий фиксируется и откатывается вместе с транзакциями
+        self._sessions = sessions
+        self._batch_window = batch_window
+        self._max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        # Счетчики для бенчмарков и метрик: меняются только в потоке записи
+        self.busy_time = 0.0
+        self.jobs = 0
+        self.batches = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Дожидается выполнения уже поставленных задач и останавливает поток"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, func, *args):
+        """Ставит func(conn, *args) в очередь и возвращает future с ее результатом"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((func, args, future, loop))
+        return future
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        conn = sqlite3.connect(self._db_path, isolation_level=None, factory=TimedConnection)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        try:
+            stopping = False
+            while not stopping:
+                job = self._queue.get()
+                if job is None:
+                    break
+                batch = [job]
+                stopping = self._collect_batch(batch)
+                self._execute_batch(conn, batch)
+        finally:
+            conn.close()
+
+    # Добираем задачи, пришедшие в окне объединения; True - получен сигнал остановки
+    def _collect_batch(self, batch):
+        deadline = time.monotonic() + self._batch_window
+        while len(batch) < self._max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    job = self._queue.get(timeout=timeout)
+                else:
+                    job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                return True
+            batch.append(job)
+        return False
+
+    def _execute_batch(self, conn, batch):
+        started = time.perf_counter()
+        results = []
+        sessions = self._sessions
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for func, args, future, loop in batch:
+                conn.execute('SAVEPOINT job')
+                try:
+                    result = func(conn, *args)
+                except Exception as e:
+                    # Ошибка одной задачи не должна откатывать остальные задачи пачки
+                    conn.execute('ROLLBACK TO job')
+                    conn.execute('RELEASE job')
+                    if sessions is not None:
+                        sessions.rollback_job()
+                    results.append((future, loop, None, e))
+                else:
+                    conn.execute('RELEASE job')
+                    if sessions is not None:
+                        sessions.release_job()
+                    results.append((future, loop, result, None))
+            conn.execute('COMMIT')
+            if sessions is not None:
+                sessions.commit()
+        except Exception as e:
+            # Не только sqlite3.Error: ошибка реестра сессий или учета не должна останавливать поток записи,
+            # иначе ожидающие и все следующие задачи не дождутся результата
+            logger.exception(f"Ошибка записи пачки из {len(batch)} задач: {e}")
+            try:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                if sessions is not None:
+                    sessions.rollback()
+            except Exception:
+                logger.exception("Ошибка отката пачки")
+            results = [(future, loop, None, e) for func, args, future, loop in batch]
+        self.busy_time += time.perf_counter() - started
+        self.jobs += len(batch)
+        self.batches += 1
+
+        for future, loop, result, error in results:
+            try:
+                loop.call_soon_threadsafe(_resolve_future, future, result, error)
+            except RuntimeError:
+                # Цикл событий уже закрыт - результат никто не ждет
+                pass
+
+
+class ReadPool:
+    """Ограниченный пул соединений только для чтения (отчеты и выборки).
+
+    Работает на собственном пуле потоков, отдельном от потока записи: в режиме WAL
+    читатели не ждут писателя, поэтому отчеты не встают в очередь за отметками.
+    Соединения открываются лениво, не больше одного на поток пула.
+    """
+
+    def __init__(self, db_path=DB_PATH, size=None):
+        self._db_path = db_path
+        self._size = size or min(8, os.cpu_count() or 4)
+        self._connections = queue.Queue()
+        self._executor = None
+        self._stats_lock = threading.Lock()
+        # Суммарное время запросов во всех потоках пула и их число
+        self.busy_time = 0.0
+        self.calls = 0
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._size, thread_name_prefix='db-reader')
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+    def run(self, func, *args):
+        """Выполняет func(conn, *args) на свободном соединении и возвращает awaitable"""
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, self._call, func, args)
+
+    def queue_depth(self):
+        # Задачи, еще не взятые потоками пула
+        return self._executor._work_queue.qsize() if self._executor is not None else 0
+
+    def _connect(self):
+        uri = Path(self._db_path).resolve().as_uri() + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, factory=TimedConnection)
+        conn.execute('PRAGMA query_only=ON')
+        return conn
+
+    def _call(self, func, args):
+        try:
+            conn = self._connections.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        started = time.perf_counter()
+        try:
+            return func(conn, *args)
+        finally:
+            self._connections.put(conn)
+            elapsed = time.perf_counter() - started
+            with self._stats_lock:
+                self.busy_time += elapsed
+                self.calls += 1
+
+
+# Расчет отработанных минут с учетом обеда (только если >4 часов)
+def calculate_work_minutes(time_in, time_out, lunch_start=None, lunch_end=None, lunch_minutes=None):
+    # Общее время между входом и выходом
+    total_minutes = time_out - time_in
+
+    # Вычитаем время обеда только если рабочее время больше 4 часов
+    if total_minutes > 4 * 60:
+        if lunch_start is not None and lunch_end is not None:
+            total_minutes -= lunch_end - lunch_start
+        elif lunch_minutes:
+            total_minutes -= lunch_minutes
+
+    return max(0, total_minutes)
+
+
+# Получение записей за определенную дату
+def get_records_by_date(conn, user_id, date):
+    cursor = conn.cursor()
+    cursor.execute('''SELECT id, time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes,
+                             auto_closed
+                      FROM records
+                      WHERE user_id = ? AND date =?
+                      ORDER BY time_in''', (user_id, date))
+    records = cursor.fetchall()
+    return records
+
+
+# Получение детализированных записей за период
+def get_detailed_records_period(conn, user_id, start_date, end_date):
+    cursor = conn.cursor()
+    cursor.execute('''SELECT date, time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes,
+                             auto_closed
+                      FROM records
+                      WHERE user_id=? AND date BETWEEN ? AND ?
+                      ORDER BY date, time_in''',
+                   (user_id, start_date, end_date))
+    records = cursor.fetchall()
+    return records
+
+
+# Записи нескольких пользователей за период одним проходом по idx_user_date в порядке user_id:
+# func(user_id, записи как у get_detailed_records_period) вызывается для каждого пользователя с записями
+# по мере чтения курсора, в памяти одновременно только записи одного пользователя
+def map_user_records(conn, user_ids, start_date, end_date, func):
+    cursor = conn.execute('''SELECT user_id, date, time_in, time_out, lunch_start, lunch_end, lunch_minutes,
+                                    worked_minutes, auto_closed
+                             FROM records
+                             WHERE user_id IN (SELECT value FROM json_each(?)) AND date BETWEEN ? AND ?
+                             ORDER BY user_id, date, time_in''',
+                          (json.dumps(sorted(user_ids)), start_date, end_date))
+    return {user_id: func(user_id, [row[1:] for row in rows])
+            for user_id, rows in groupby(cursor, key=itemgetter(0))}
+
+
+# Функции чтения выше выполняются в ReadPool, функции записи ниже - только в потоке DbWriter: conn передает писатель,
+# а фиксацию транзакции делает он же, поэтому commit здесь не вызывается
+
+# Изменение агрегатов за день и месяц в той же транзакции, что и запись
+def _apply_totals(cursor, user_id, date, minutes, sessions):
+    for table, key_column, key in (('daily_totals', 'date', date), ('monthly_totals', 'month', date[:7])):
+        cursor.execute(f'''INSERT INTO {table} (user_id, {key_column}, minutes, sessions)
+                           VALUES (?, ?, ?, ?)
+                           ON CONFLICT (user_id, {key_column}) DO UPDATE
+                           SET minutes  = minutes + excluded.minutes,
+                               sessions = sessions + excluded.sessions''',
+                       (user_id, key, minutes, sessions))
+        if sessions < 0 or minutes < 0:
+            # День, куда пришлось только продолжение ночной смены, хранит минуты без сессий
+            cursor.execute(f'''DELETE FROM {table}
+                               WHERE user_id=? AND {key_column}=? AND sessions <= 0 AND minutes <= 0''',
+                           (user_id, key))
+
+
+def _apply_shift_totals(cursor, user_id, totals, sign=1):
+    for date, (minutes, sessions) in totals.items():
+        _apply_totals(cursor, user_id, date, sign * minutes, sign * sessions)
+
+
+# Удаление записей за определенную дату
+def delete_records_by_date(conn, user_id, date, sessions=None):
+    cursor = conn.cursor()
+    cursor.execute('''SELECT time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes
+                      FROM records
+                      WHERE user_id = ? AND date = ? AND worked_minutes IS NOT NULL''', (user_id, date))
+    totals = {}
+    for shift in cursor.fetchall():
+        shift_totals(totals, date, *shift)
+    cursor.execute('DELETE FROM records WHERE user_id=? AND date=?', (user_id, date))
+    deleted_count = cursor.rowcount
+    _apply_shift_totals(cursor, user_id, totals, -1)
+    if sessions is not None and getattr(sessions.get(user_id), 'date', None) == date:
+        sessions.set(user_id, _latest_open_session(cursor, user_id))
+    return deleted_count
+
+
+# Добавление полной записи
+def add_complete_record(conn, user_id, date, time_in, time_out, lunch_start=None, lunch_end=None,
+                        lunch_minutes=None):
+    cursor = conn.cursor()
+
+    time_in, time_out, lunch_start, lunch_end = normalize_shift(time_in, time_out, lunch_start, lunch_end)
+    worked_minutes = calculate_work_minutes(time_in, time_out, lunch_start, lunch_end, lunch_minutes)
+
+    cursor.execute('''INSERT INTO records
+                      (user_id, date, time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                   (user_id, date, time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes))
+    _apply_shift_totals(cursor, user_id, shift_totals({}, date, time_in, time_out, lunch_start, lunch_end,
+                                                       lunch_minutes, worked_minutes))
+    return worked_minutes
+
+
+# Добавление пачки полных записей (импорт): одна вставка executemany и
+# одно обновление агрегатов на каждый затронутый день
+def add_complete_records(conn, user_id, rows):
+    cursor = conn.cursor()
+    values = []
+    totals_by_date = {}
+    for date, time_in, time_out, lunch_start, lunch_end, lunch_minutes in rows:
+        time_in, time_out, lunch_start, lunch_end = normalize_shift(time_in, time_out, lunch_start, lunch_end)
+        worked_minutes = calculate_work_minutes(time_in, time_out, lunch_start, lunch_end, lunch_minutes)
+        values.append((user_id, date, time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes))
+        shift_totals(totals_by_date, date, time_in, time_out, lunch_start, lunch_end, lunch_minutes,
+                      worked_minutes)
+
+    cursor.executemany('''INSERT INTO records
+                          (user_id, date, time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', values)
+    _apply_shift_totals(cursor, user_id, totals_by_date)
+    return len(values)
+
+
+# Открытая сессия пользователя: из реестра, если он есть, иначе по частичному индексу.
+# same_day=True ищет сессию, начатую именно в date; иначе - последнюю начатую не позже date
+# (выход и обед ночной смены приходятся на следующий день; сессию старше MAX_SHIFT_HOURS
+# отклоняет session_minutes)
+def _open_session(cursor, user_id, date, sessions=None, same_day=False):
+    if sessions is not None:
+        session = sessions.get(user_id)
+        if session is None:
+            # В реестре нет - открытых сессий у пользователя нет вовсе
+            return None
+        if session.date == date or (not same_day and session.date < date):
+            return session
+    cursor.execute(f'''SELECT id, date, time_in, lunch_start, lunch_end, lunch_minutes
+                       FROM records
+                       WHERE user_id=? AND date {'=' if same_day else '<='} ? AND time_out IS NULL
+                       ORDER BY date DESC, id DESC
+                       LIMIT 1''', (user_id, date))
+    row = cursor.fetchone()
+    return OpenSession(*row) if row else None
+
+
+# Последняя открытая сессия пользователя на любую дату (для реестра)
+def _latest_open_session(cursor, user_id):
+    cursor.execute('''SELECT id, date, time_in, lunch_start, lunch_end, lunch_minutes
+                      FROM records
+                      WHERE user_id=? AND time_out IS NULL
+                      ORDER BY date DESC, id DESC
+                      LIMIT 1''', (user_id,))
+    row = cursor.fetchone()
+    return OpenSession(*row) if row else None
+
+
+# Все открытые сессии для прогрева реестра: последняя по каждому пользователю
+def load_open_sessions(conn):
+    cursor = conn.cursor()
+    cursor.execute('''SELECT user_id, id, date, time_in, lunch_start, lunch_end, lunch_minutes
+                      FROM records
+                      WHERE time_out IS NULL
+                      ORDER BY user_id, date, id''')
+    return {row[0]: OpenSession(*row[1:]) for row in cursor.fetchall()}
+
+
+# Автоматическое закрытие забытой сессии (см. scheduler.py): выход равен входу, время не
+# засчитывается, запись помечается auto_closed. Возвращает закрытую OpenSession или None,
+# если сессия уже закрыта пользователем
+def auto_close_session(conn, user_id, record_id, sessions=None):
+    cursor = conn.cursor()
+    cursor.execute('''SELECT id, date, time_in, lunch_start, lunch_end, lunch_minutes
+                      FROM records
+                      WHERE id = ? AND user_id = ? AND time_out IS NULL''', (record_id, user_id))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    session = OpenSession(*row)
+    cursor.execute('''UPDATE records
+                      SET time_out=time_in,
+                          worked_minutes=0,
+                          auto_closed=1
+                      WHERE id = ?''', (record_id,))
+    _apply_shift_totals(cursor, user_id, shift_totals({}, session.date, session.time_in, session.time_in,
+                                                       None, None, None, 0))
+    _forget_session(cursor, user_id, session, sessions)
+    return session
+
+
+# Добавление записи о входе
+def add_time_in(conn, user_id, date, time_in, sessions=None):
+    cursor = conn.cursor()
+
+    # Повторный вход за тот же день исправляет время незакрытой записи
+    session = _open_session(cursor, user_id, date, sessions, same_day=True)
+
+    if session:
+        cursor.execute('UPDATE records SET time_in=? WHERE id=?', (time_in, session.record_id))
+        session = session._replace(time_in=time_in)
+    else:
+        cursor.execute('INSERT INTO records (user_id, date, time_in) VALUES (?, ?, ?)',
+                       (user_id, date, time_in))
+        session = OpenSession(cursor.lastrowid, date, time_in, None, None, None)
+    if sessions is not None and session.date >= getattr(sessions.get(user_id), 'date', ''):
+        sessions.set(user_id, session)
+
+
+# Обновление записи о выходе и расчет отработанных минут
+def add_time_out(conn, user_id, date, time_out, sessions=None):
+    cursor = conn.cursor()
+    session = _open_session(cursor, user_id, date, sessions)
+
+    if session:
+        time_out = session_minutes(session.date, session.time_in, date, time_out, is_time_out=True)
+        worked_minutes = calculate_work_minutes(session.time_in, time_out, session.lunch_start,
+                                                session.lunch_end, session.lunch_minutes)
+
+        cursor.execute('''UPDATE records
+                          SET time_out=?,
+                              worked_minutes=?
+                          WHERE id = ?''', (time_out, worked_minutes, session.record_id))
+        _apply_shift_totals(cursor, user_id, shift_totals({}, session.date, session.time_in, time_out,
+                                                           session.lunch_start, session.lunch_end,
+                                                           session.lunch_minutes, worked_minutes))
+        _forget_session(cursor, user_id, session, sessions)
+
+
+# Сессия закрыта или удалена: реестр переходит на предыдущую открытую, если она есть
+def _forget_session(cursor, user_id, session, sessions):
+    if sessions is not None and sessions.get(user_id) == session:
+        sessions.set(user_id, _latest_open_session(cursor, user_id))
+
+
+# Изменение обеда открытой сессии одним UPDATE по первичному ключу
+def _update_lunch(conn, user_id, date, sessions, **fields):
+    cursor = conn.cursor()
+    session = _open_session(cursor, user_id, date, sessions)
+
+    if session:
+        # Минуты обеда без времени суток: возраст сессии проверяется по началу дня отметки
+        check_session_age(session.date, session.time_in, day_offset(session.date, date, 0))
+        fields = {column: value if column == 'lunch_minutes'
+                  else session_minutes(session.date, session.time_in, date, value)
+                  for column, value in fields.items()}
+        assignments = ', '.join(f'{column}=?' for column in fields)
+        cursor.execute(f'UPDATE records SET {assignments} WHERE id=?', (*fields.values(), session.record_id))
+        if sessions is not None and sessions.get(user_id) == session:
+            sessions.set(user_id, session._replace(**fields))
+
+
+# Добавление времени начала обеда
+def add_lunch_start(conn, user_id, date, lunch_start, sessions=None):
+    _update_lunch(conn, user_id, date, sessions, lunch_start=lunch_start)
+
+
+# Добавление времени конца обеда
+def add_lunch_end(conn, user_id, date, lunch_end, sessions=None):
+    _update_lunch(conn, user_id, date, sessions, lunch_end=lunch_end)
+
+
+# Добавление минут обеда
+def add_lunch_minutes(conn, user_id, date, lunch_minutes, sessions=None):
+    _update_lunch(conn, user_id, date, sessions, lunch_minutes=lunch_minutes)
+
+
+# Пояса пользователей, у которых он задан: {user_id: timezone}
+def load_user_timezones(conn):
+    return dict(conn.execute('SELECT user_id, timezone FROM user_settings WHERE timezone IS NOT NULL'))
+
+
+# Сохранение пояса пользователя; None возвращает пояс по умолчанию
+def set_user_timezone(conn, user_id, timezone):
+    conn.execute('''INSERT INTO user_settings (user_id, timezone) VALUES (?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET timezone = excluded.timezone''', (user_id, timezone))
+
+
+# Время напоминаний: {user_id: минуты от полуночи}
+def load_user_reminders(conn):
+    return dict(conn.execute('SELECT user_id, reminder_time FROM user_settings WHERE reminder_time IS NOT NULL'))
+
+
+# Сохранение времени напоминания; None отключает напоминание
+def set_user_reminder(conn, user_id, reminder_time):
+    conn.execute('''INSERT INTO user_settings (user_id, reminder_time) VALUES (?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET reminder_time = excluded.reminder_time''',
+                 (user_id, reminder_time))
+
+
+# Подписки на сводки: {user_id: 'week' или 'month'}
+def load_user_digests(conn):
+    return dict(conn.execute('SELECT user_id, digest FROM user_settings WHERE digest IS NOT NULL'))
+
+
+# Сохранение периода сводки; None отключает рассылку
+def set_user_digest(conn, user_id, digest):
+    conn.execute('''INSERT INTO user_settings (user_id, digest) VALUES (?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET digest = excluded.digest''', (user_id, digest))
+
+
+# Таблицы с данными пользователя, которые переносятся между шардами
+USER_TABLES = ('records', 'daily_totals', 'monthly_totals')
+
+
+# Все строки пользователя для переноса в другой шард: {таблица: (столбцы, строки)}
+def export_user_rows(conn, user_id):
+    rows = {}
+    for table in USER_TABLES:
+        cursor = conn.execute(f'SELECT * FROM {table} WHERE user_id=?', (user_id,))
+        columns = [column[0] for column in cursor.description]
+        if table == 'records':
+            # id назначает шард-получатель: последовательности у файлов свои
+            rows[table] = (columns[1:], [row[1:] for row in cursor.fetchall()])
+        else:
+            rows[table] = (columns, cursor.fetchall())
+    return rows
+
+
+# Запись строк пользователя в шард-получатель; прежние строки (от прерванного переноса) заменяются
+def import_user_rows(conn, user_id, rows, sessions=None):
+    for table in USER_TABLES:
+        columns, values = rows[table]
+        conn.execute(f'DELETE FROM {table} WHERE user_id=?', (user_id,))
+        conn.executemany(f'''INSERT INTO {table} ({', '.join(columns)})
+                             VALUES ({', '.join('?' * len(columns))})''', values)
+    if sessions is not None:
+        sessions.set(user_id, _latest_open_session(conn.cursor(), user_id))
+    return sum(len(values) for columns, values in rows.values())
+
+
+# Удаление всех строк пользователя из шарда-источника после переноса
+def delete_user_rows(conn, user_id, sessions=None):
+    for table in USER_TABLES:
+        conn.execute(f'DELETE FROM {table} WHERE user_id=?', (user_id,))
+    if sessions is not None:
+        sessions.set(user_id, None)
+
+
+# Размещение пользователей: {user_id: номер шарда}
+def load_shard_map(conn):
+    return dict(conn.execute('SELECT user_id, shard FROM shard_map'))
+
+
+# Пользователи, уже записанные в файл до включения шардирования, остаются в нем
+def adopt_unmapped_users(conn, shard):
+    conn.execute('''INSERT OR IGNORE INTO shard_map (user_id, shard)
+                    SELECT DISTINCT user_id, ? FROM records''', (shard,))
+
+
+def set_user_shard(conn, user_id, shard):
+    conn.execute('''INSERT INTO shard_map (user_id, shard) VALUES (?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET shard = excluded.shard''', (user_id, shard))
+
+
+# Все сохраненное состояние бота: строки (kind, key, data)
+def load_bot_state(conn):
+    return conn.execute('SELECT kind, key, data FROM bot_state').fetchall()
+
+
+# Запись изменений состояния бота; data = None удаляет ключ
+def save_bot_state(conn, changes):
+    conn.executemany('''INSERT INTO bot_state (kind, key, data) VALUES (?, ?, ?)
+                        ON CONFLICT (kind, key) DO UPDATE SET data = excluded.data''',
+                     [change for change in changes if change[2] is not None])
+    conn.executemany('DELETE FROM bot_state WHERE kind = ? AND key = ?',
+                     [(kind, key) for kind, key, data in changes if data is None])
+
+
+# Границы периода отчета (обе даты включительно); today - дата в поясе пользователя,
+# поэтому результат зависит только от (period, today) и кэшируется
+@lru_cache(maxsize=1024)
+def period_bounds(period, today):
+    if period == 'today':
+        return today, today
+    if period == 'week':
+        # С понедельника по воскресенье
+        start_of_week = today - timedelta(days=today.weekday())
+        return start_of_week, start_of_week + timedelta(days=6)
+    if period == 'month':
+        start_of_month = today.replace(day=1)
+        next_month = (start_of_month + timedelta(days=32)).replace(day=1)
+        return start_of_month, next_month - timedelta(days=1)
+    # year и stats - последние 365 дней
+    return today - timedelta(days=365), today
+
+
+# Генерация отчетов за период (в минутах) по агрегатам daily_totals/monthly_totals
+def generate_report(conn, user_id, period, today):
+    cursor = conn.cursor()
+
+    start_date, end_date = period_bounds(period, today)
+
+    if period == 'today':
+        cursor.execute('''SELECT minutes
+                          FROM daily_totals
+                          WHERE user_id = ? AND date = ?''', (user_id, today.strftime('%Y-%m-%d')))
+    elif period == 'week':
+        cursor.execute('''SELECT SUM(minutes)
+                          FROM daily_totals
+                          WHERE user_id = ? AND date BETWEEN ? AND ?''',
+                       (user_id, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
+    elif period == 'month':
+        cursor.execute('''SELECT minutes
+                          FROM monthly_totals
+                          WHERE user_id = ? AND month = ?''', (user_id, today.strftime('%Y-%m')))
+    else:  # year
+        # Неполный первый месяц берем по дням, остальные - из помесячных итогов
+        next_month = (start_date.replace(day=1) + timedelta(days=32)).replace(day=1)
+        cursor.execute('''SELECT (SELECT IFNULL(SUM(minutes), 0)
+                                  FROM daily_totals
+                                  WHERE user_id = :user_id AND date >= :start AND date < :next_month)
+                               + (SELECT IFNULL(SUM(minutes), 0)
+                                  FROM monthly_totals
+                                  WHERE user_id = :user_id AND month >= :next_month_key)''',
+                       {'user_id': user_id, 'start': start_date.strftime('%Y-%m-%d'),
+                        'next_month': next_month.strftime('%Y-%m-%d'), 'next_month_key': next_month.strftime('%Y-%m')})
+
+    result = cursor.fetchone()
+    return (result[0] if result else 0) or 0
+
+
+# Получение деталей за сегодня (current_date - сегодня в поясе пользователя)
+def get_today_details(conn, user_id, current_date):
+    cursor = conn.cursor()
+
+    cursor.execute('''SELECT time_in, time_out, lunch_start, lunch_end, lunch_minutes, worked_minutes, auto_closed
+                      FROM records
+                      WHERE user_id = ? AND date =?
+                      ORDER BY time_in''', (user_id, current_date))
+    records = cursor.fetchall()
+    return records
+
+
+class Repository(StorageBackend):
+    """Асинхронный интерфейс хранилища для обработчиков бота.
+
+    Владеет потоком записи и пулом чтения: start() открывает их, close() дожидается
+    незавершенных запросов и закрывает соединения. Число одновременно ожидающих
+    записей ограничено семафором, чтение ограничено размером пула. Любая запись
+    пользователя сбрасывает его отчеты в cache.
+
+    Шарды (sharding.ShardedRepository) - это несколько Repository с общими cache и clock.
+    """
+
+    def __init__(self, db_path=DB_PATH, read_pool_size=None, max_pending_writes=1000, cache=None, clock=None):
+        self._db_path = db_path
+        self.sessions = OpenSessions()
+        self.clock = clock or UserClock()
+        # Время напоминаний о выходе: {user_id: минуты}, ведет set_reminder
+        self.reminders = {}
+        # Подписки на сводки: {user_id: период}, ведет set_digest
+        self.digests = {}
+        self._writer = DbWriter(db_path, sessions=self.sessions)
+        self._readers = ReadPool(db_path, read_pool_size)
+        self._max_pending_writes = max_pending_writes
+        self._write_slots = None
+        self._pending = set()
+        self._closed = True
+        self.cache = cache or ReportCache()
+
+    async def start(self):
+        if not self._closed:
+            return
+        init_db(self._db_path)
+        self._warm()
+        self._writer.start()
+        self._readers.start()
+        self._write_slots = asyncio.Semaphore(self._max_pending_writes)
+        self._closed = False
+
+    # Реестр открытых сессий и пояса пользователей заполняются до запуска потока записи;
+    # дальше реестр ведет только он, а пояса - set_timezone
+    def _warm(self):
+        conn = sqlite3.connect(self._db_path)
+        try:
+            self.sessions.load(load_open_sessions(conn))
+            self.clock.load(load_user_timezones(conn))
+            self.reminders.update(load_user_reminders(conn))
+            self.digests.update(load_user_digests(conn))
+        finally:
+            conn.close()
+        logger.info(f"Открытых сессий при запуске: {self.sessions.count()}")
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        self._readers.close()
+        self._writer.stop()
+        logger.info(f"Статистика кэша отчетов: {self.cache.stats()}")
+
+    def db_stats(self):
+        """Время, проведенное в БД потоком записи и пулом чтения"""
+        return {
+            'write_busy_seconds': self._writer.busy_time,
+            'write_jobs': self._writer.jobs,
+            'write_batches': self._writer.batches,
+            'read_busy_seconds': self._readers.busy_time,
+            'read_calls': self._readers.calls,
+        }
+
+    def queue_depths(self):
+        return {'writer': self._writer.queue_depth(), 'reader': self._readers.queue_depth()}
+
+    async def _track(self, future):
+        self._pending.add(future)
+        try:
+            return await future
+        finally:
+            self._pending.discard(future)
+
+    async def _write(self, func, user_id, *args):
+        if self._closed:
+            raise RuntimeError('Хранилище закрыто')
+        try:
+            async with self._write_slots:
+                return await self._track(self._writer.submit(func, user_id, *args))
+        finally:
+            self.cache.invalidate_user(user_id)
+
+    async def _read(self, func, *args):
+        if self._closed:
+            raise RuntimeError('Хранилище закрыто')
+        return await self._track(self._readers.run(func, *args))
+
+    async def punch_in(self, user_id, date, time_in):
+        await self._write(add_time_in, user_id, date, time_in, self.sessions)
+
+    async def punch_out(self, user_id, date, time_out):
+        await self._write(add_time_out, user_id, date, time_out, self.sessions)
+
+    async def lunch_start(self, user_id, date, lunch_start):
+        await self._write(add_lunch_start, user_id, date, lunch_start, self.sessions)
+
+    async def lunch_end(self, user_id, date, lunch_end):
+        await self._write(add_lunch_end, user_id, date, lunch_end, self.sessions)
+
+    async def lunch_minutes(self, user_id, date, lunch_minutes):
+        await self._write(add_lunch_minutes, user_id, date, lunch_minutes, self.sessions)
+
+    async def add_record(self, user_id, date, time_in, time_out, lunch_start=None, lunch_end=None,
+                         lunch_minutes=None):
+        return await self._write(add_complete_record, user_id, date, time_in, time_out,
+                                 lunch_start, lunch_end, lunch_minutes)
+
+    async def add_records(self, user_id, rows):
+        return await self._write(add_complete_records, user_id, rows)
+
+    async def delete_day(self, user_id, date):
+        return await self._write(delete_records_by_date, user_id, date, self.sessions)
+
+    # Настройки пишутся тем же путем, что и отметки: со сбросом кэша отчетов пользователя
+
+    async def set_timezone(self, user_id, timezone):
+        await self._write(set_user_timezone, user_id, timezone)
+        self.clock.set(user_id, timezone)
+
+    async def set_reminder(self, user_id, reminder_time):
+        await self._write(set_user_reminder, user_id, reminder_time)
+        if reminder_time is None:
+            self.reminders.pop(user_id, None)
+        else:
+            self.reminders[user_id] = reminder_time
+
+    async def set_digest(self, user_id, digest):
+        await self._write(set_user_digest, user_id, digest)
+        if digest is None:
+            self.digests.pop(user_id, None)
+        else:
+            self.digests[user_id] = digest
+
+    async def auto_close(self, user_id, record_id):
+        return await self._write(auto_close_session, user_id, record_id, self.sessions)
+
+    # Открытые сессии берутся из реестра, без запроса к базе
+
+    async def open_session(self, user_id):
+        return self.sessions.committed(user_id)
+
+    async def all_open_sessions(self):
+        return self.sessions.items()
+
+    async def at_work(self, date=None):
+        return self.sessions.count(date)
+
+    def open_sessions_count(self):
+        return self.sessions.count()
+
+    # Перенос пользователя между шардами (см. sharding.ShardedRepository.move_user)
+
+    async def export_user(self, user_id):
+        return await self._write(export_user_rows, user_id)
+
+    async def import_user(self, user_id, rows):
+        return await self._write(import_user_rows, user_id, rows, self.sessions)
+
+    async def drop_user(self, user_id):
+        await self._write(delete_user_rows, user_id, self.sessions)
+
+    async def load_shard_map(self, adopt_shard=None):
+        if adopt_shard is not None:
+            await self._write_global(adopt_unmapped_users, adopt_shard)
+        return await self._read(load_shard_map)
+
+    async def set_user_shard(self, user_id, shard):
+        await self._write_global(set_user_shard, user_id, shard)
+
+    # Запись, не относящаяся к отчетам пользователя: кэш не сбрасывается
+    async def _write_global(self, func, *args):
+        if self._closed:
+            raise RuntimeError('Хранилище закрыто')
+        async with self._write_slots:
+            return await self._track(self._writer.submit(func, *args))
+
+    async def save_bot_state(self, changes):
+        await self._write_global(save_bot_state, changes)
+
+    # Команды
+
+    async def create_team(self, owner_id, name, owner_name):
+        return await self._write_global(create_team, owner_id, name, owner_name)
+
+    async def join_team(self, user_id, join_code, name):
+        return await self._write_global(join_team, user_id, join_code, name)
+
+    async def set_team_role(self, team_id, user_id, role):
+        await self._write_global(set_member_role, team_id, user_id, role)
+
+    async def user_teams(self, user_id):
+        return await self._read(user_teams, user_id)
+
+    async def team_members(self, team_id):
+        return await self._read(team_members, team_id)
+
+    async def team_report(self, team_id, start_date, end_date, norm_minutes=DAILY_NORM_MINUTES):
+        return await self._read(team_report, team_id, start_date, end_date, norm_minutes)
+
+    async def member_totals(self, user_ids, start_date, end_date, norm_minutes=DAILY_NORM_MINUTES):
+        return await self._read(member_totals, user_ids, start_date, end_date, norm_minutes)
+
+    async def load_bot_state(self):
+        return await self._read(load_bot_state)
+
+    async def records_by_date(self, user_id, date):
+        return await self._read(get_records_by_date, user_id, date)
+
+    async def records_period(self, user_id, start_date, end_date):
+        return await self._read(get_detailed_records_period, user_id, start_date, end_date)
+
+    # func выполняется в потоке чтения
+    async def map_user_records(self, user_ids, start_date, end_date, func):
+        return await self._read(map_user_records, user_ids, start_date, end_date, func)
+
+    async def report(self, user_id, period):
+        return await self._read(generate_report, user_id, period, self.clock.today(user_id))
+
+    async def today_details(self, user_id):
+        return await self._read(get_today_details, user_id, self.today(user_id))
+
+    async def period_summary(self, user_id, start_date, end_date, norm_minutes=DAILY_NORM_MINUTES):
+        return await self._read(period_summary, user_id, start_date, end_date, norm_minutes)
+
+    async def export(self, user_id, start_date, end_date, file_format):
+        return await self._read(build_export, user_id, start_date, end_date, file_format)
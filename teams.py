@@ -0,0 +1,130 @@
+"""Команды сотрудников и отчет руководителя.
+
+Команду создает руководитель (/team_create), сотрудники вступают по коду
+(/team_join). Роль manager дает право смотреть /team_report и менять роли.
+Таблицы teams и team_members лежат в основном файле (при шардировании - в
+шарде 0), как и остальные общие данные.
+
+Отчет по команде считается одним сгруппированным запросом по daily_totals:
+для каждого сотрудника сумма минут, число дней и сессий, переработка и
+недоработка относительно нормы дня. Сырые записи не читаются, поэтому месяц
+по команде из сотен человек - это несколько тысяч строк агрегатов по индексу.
+"""
+import json
+import secrets
+from collections import namedtuple
+
+ROLE_MANAGER = 'manager'
+ROLE_MEMBER = 'member'
+ROLES = (ROLE_MANAGER, ROLE_MEMBER)
+ROLE_NAMES = {ROLE_MANAGER: 'руководитель', ROLE_MEMBER: 'сотрудник'}
+
+Team = namedtuple('Team', ['id', 'name', 'join_code'])
+# Команда пользователя: его роль и число участников
+Membership = namedtuple('Membership', ['team', 'role', 'members'])
+# Итоги пользователя за период по агрегатам по дням (минуты)
+DayTotals = namedtuple('DayTotals', ['minutes', 'days', 'sessions', 'overtime_minutes', 'undertime_minutes'])
+# Итоги сотрудника за период (минуты)
+MemberTotals = namedtuple('MemberTotals', ['user_id', 'name', 'role', 'minutes', 'days', 'sessions',
+                                           'overtime_minutes', 'undertime_minutes'])
+
+
+def new_join_code():
+    return secrets.token_urlsafe(6)
+
+
+# Итоги одного пользователя по строкам daily_totals (minutes за каждый день)
+def day_totals(day_minutes, sessions, norm_minutes):
+    return DayTotals(sum(day_minutes), len(day_minutes), sessions,
+                     sum(max(minutes - norm_minutes, 0) for minutes in day_minutes),
+                     sum(max(norm_minutes - minutes, 0) for minutes in day_minutes))
+
+
+# Функции для SQLite: записи выполняются в потоке записи, чтение - в пуле чтения
+
+def create_team(conn, owner_id, name, owner_name):
+    cursor = conn.execute('INSERT INTO teams (name, join_code, owner_id) VALUES (?, ?, ?)',
+                          (name, new_join_code(), owner_id))
+    team_id = cursor.lastrowid
+    conn.execute('INSERT INTO team_members (team_id, user_id, name, role) VALUES (?, ?, ?, ?)',
+                 (team_id, owner_id, owner_name, ROLE_MANAGER))
+    return Team(*conn.execute('SELECT id, name, join_code FROM teams WHERE id=?', (team_id,)).fetchone())
+
+
+# Вступление по коду; повторное вступление только обновляет имя. None - код не найден
+def join_team(conn, user_id, join_code, name):
+    row = conn.execute('SELECT id, name, join_code FROM teams WHERE join_code=?', (join_code,)).fetchone()
+    if row is None:
+        return None
+    conn.execute('''INSERT INTO team_members (team_id, user_id, name, role) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (team_id, user_id) DO UPDATE SET name = excluded.name''',
+                 (row[0], user_id, name, ROLE_MEMBER))
+    return Team(*row)
+
+
+def set_member_role(conn, team_id, user_id, role):
+    if role not in ROLES:
+        raise ValueError(f"неизвестная роль {role!r}, доступны: {', '.join(ROLES)}")
+    current = conn.execute('SELECT role FROM team_members WHERE team_id=? AND user_id=?',
+                           (team_id, user_id)).fetchone()
+    if current is None:
+        raise ValueError("пользователь не состоит в команде")
+    if current[0] == ROLE_MANAGER and role != ROLE_MANAGER:
+        managers = conn.execute('SELECT COUNT(*) FROM team_members WHERE team_id=? AND role=?',
+                                (team_id, ROLE_MANAGER)).fetchone()[0]
+        if managers == 1:
+            raise ValueError("в команде должен остаться хотя бы один руководитель")
+    conn.execute('UPDATE team_members SET role=? WHERE team_id=? AND user_id=?', (role, team_id, user_id))
+
+
+def user_teams(conn, user_id):
+    rows = conn.execute('''SELECT t.id, t.name, t.join_code, m.role,
+                                  (SELECT COUNT(*) FROM team_members WHERE team_id = t.id)
+                           FROM team_members m
+                                    JOIN teams t ON t.id = m.team_id
+                           WHERE m.user_id = ?
+                           ORDER BY t.id''', (user_id,))
+    return [Membership(Team(*row[:3]), row[3], row[4]) for row in rows]
+
+
+# Участники команды: (user_id, name, role)
+def team_members(conn, team_id):
+    return conn.execute('''SELECT user_id, name, role FROM team_members
+                           WHERE team_id = ?
+                           ORDER BY name, user_id''', (team_id,)).fetchall()
+
+
+# Итоги команды за период одним запросом: участники, присоединенные к своим агрегатам по дням
+def team_report(conn, team_id, start_date, end_date, norm_minutes):
+    rows = conn.execute('''SELECT m.user_id, m.name, m.role,
+                                  IFNULL(SUM(t.minutes), 0), COUNT(t.date), IFNULL(SUM(t.sessions), 0),
+                                  IFNULL(SUM(MAX(t.minutes - :norm, 0)), 0),
+                                  IFNULL(SUM(MAX(:norm - t.minutes, 0)), 0)
+                           FROM team_members m
+                                    LEFT JOIN daily_totals t
+                                              ON t.user_id = m.user_id AND t.date BETWEEN :start AND :end
+                           WHERE m.team_id = :team_id
+                           GROUP BY m.user_id
+                           ORDER BY m.name, m.user_id''',
+                        {'team_id': team_id, 'start': start_date, 'end': end_date, 'norm': norm_minutes})
+    return [MemberTotals(*row) for row in rows]
+
+
+# Итоги произвольного списка пользователей в одном файле (для шардов, где участники
+# команды и их агрегаты лежат в разных файлах, и для отчета за год): {user_id: DayTotals}
+def member_totals(conn, user_ids, start_date, end_date, norm_minutes):
+    rows = conn.execute('''SELECT user_id, SUM(minutes), COUNT(*), SUM(sessions),
+                                  SUM(MAX(minutes - :norm, 0)), SUM(MAX(:norm - minutes, 0))
+                           FROM daily_totals
+                           WHERE user_id IN (SELECT value FROM json_each(:user_ids))
+                             AND date BETWEEN :start AND :end
+                           GROUP BY user_id''',
+                        {'user_ids': json.dumps(list(user_ids)), 'start': start_date, 'end': end_date,
+                         'norm': norm_minutes})
+    return {row[0]: DayTotals(*row[1:]) for row in rows}
+
+
+# Строки отчета по участникам и их итогам; у кого нет агрегатов за период - нули
+def merge_member_totals(members, totals):
+    return [MemberTotals(user_id, name, role, *totals.get(user_id, (0, 0, 0, 0, 0)))
+            for user_id, name, role in members]
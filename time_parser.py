@@ -0,0 +1,56 @@
+"""Быстрый разбор времени суток, введенного пользователем.
+
+Поддерживаются форматы ЧЧ:ММ, Ч:ММ, ЧЧММ и ЧЧ.ММ. Все допустимые варианты для
+1440 минут суток заранее разложены в таблицу, поэтому обычный ввод разбирается
+одним поиском в словаре без datetime.strptime (он берет блокировку и кэш regex).
+Нестандартный ввод (пробелы, однозначные минуты) разбирается вручную.
+"""
+
+_DIGITS = frozenset('0123456789')
+_SEPARATORS = ':.'
+
+
+def _build_memo():
+    memo = {}
+    for minutes in range(24 * 60):
+        hours, mins = divmod(minutes, 60)
+        for text in (f'{hours:02d}:{mins:02d}', f'{hours}:{mins:02d}',
+                     f'{hours:02d}{mins:02d}', f'{hours}{mins:02d}',
+                     f'{hours:02d}.{mins:02d}', f'{hours}.{mins:02d}'):
+            memo[text] = minutes
+    return memo
+
+
+_MEMO = _build_memo()
+
+
+def _to_int(part):
+    if not part or len(part) > 2 or not _DIGITS.issuperset(part):
+        return None
+    return int(part)
+
+
+def _parse_slow(text):
+    text = text.strip()
+    for i, ch in enumerate(text):
+        if ch in _SEPARATORS:
+            hours, mins = _to_int(text[:i].strip()), _to_int(text[i + 1:].strip())
+            break
+    else:
+        # Без разделителя: последние две цифры - минуты (900, 0930)
+        if len(text) not in (3, 4):
+            return None
+        hours, mins = _to_int(text[:-2]), _to_int(text[-2:])
+    if hours is None or mins is None or hours > 23 or mins > 59:
+        return None
+    return hours * 60 + mins
+
+
+def parse_time(text):
+    """Возвращает минуты от полуночи или бросает ValueError для неверного ввода"""
+    minutes = _MEMO.get(text)
+    if minutes is None:
+        minutes = _parse_slow(text)
+        if minutes is None:
+            raise ValueError(f"Неверный формат времени: {text!r}")
+    return minutes
@@ -0,0 +1,94 @@
+"""Часовые пояса пользователей.
+
+«Сегодня» для отметок и отчетов считается в поясе пользователя (/timezone), а не
+по часам сервера. Пояс без настройки - DEFAULT_TIMEZONE из окружения, если он
+не задан - локальное время сервера, как раньше.
+
+Пояса пользователей держит в памяти UserClock (загружается из user_settings при
+старте). Смещение от UTC для пояса запоминается по 15-минутным интервалам:
+переходы на летнее время во всех поясах приходятся на границы таких интервалов,
+поэтому на каждый запрос приходится поиск в словаре, а zoneinfo вызывается
+один раз на пояс и интервал.
+"""
+import os
+import time
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+DEFAULT_TIMEZONE = os.environ.get('DEFAULT_TIMEZONE') or None
+
+# Шаг таблицы смещений в секундах
+OFFSET_STEP = 15 * 60
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def get_zone(name):
+    """ZoneInfo по имени IANA (Europe/Moscow) или ValueError"""
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Неизвестный часовой пояс: {name!r}")
+
+
+class UserClock:
+    """Текущая дата в поясе каждого пользователя.
+
+    Используется из цикла событий; set() вызывается после фиксации записи в
+    user_settings, поэтому блокировки не нужны.
+    """
+
+    def __init__(self, default_timezone=DEFAULT_TIMEZONE):
+        self._default = default_timezone
+        self._zones = {}
+        # (пояс, номер 15-минутного интервала) -> смещение от UTC в секундах
+        self._offsets = {}
+
+    # Добавляет пояса из файла; у шардов общий UserClock, и каждый загружает свои
+    def load(self, zones):
+        self._zones.update(zones)
+
+    def set(self, user_id, timezone):
+        if timezone is None:
+            self._zones.pop(user_id, None)
+        else:
+            self._zones[user_id] = timezone
+
+    def timezone(self, user_id):
+        """Имя пояса пользователя; None - локальное время сервера"""
+        return self._zones.get(user_id, self._default)
+
+    def _offset(self, timezone, now):
+        step = int(now // OFFSET_STEP)
+        offset = self._offsets.get((timezone, step))
+        if offset is None:
+            moment = datetime.fromtimestamp(step * OFFSET_STEP, get_zone(timezone))
+            offset = self._offsets[(timezone, step)] = int(moment.utcoffset().total_seconds())
+            if len(self._offsets) > 4096:
+                # Устаревшие интервалы больше не понадобятся
+                self._offsets = {key: value for key, value in self._offsets.items() if key[1] >= step}
+        return offset
+
+    def now_minutes(self, user_id, now=None):
+        """(дата, минуты от полуночи) в поясе пользователя"""
+        now = time.time() if now is None else now
+        timezone = self.timezone(user_id)
+        if timezone is None:
+            local = datetime.fromtimestamp(now)
+            return local.date(), local.hour * 60 + local.minute
+        days, seconds = divmod(int(now) + self._offset(timezone, now), 24 * 60 * 60)
+        return date.fromordinal(_EPOCH_ORDINAL + days), seconds // 60
+
+    def today(self, user_id, now=None):
+        return self.now_minutes(user_id, now)[0]
+
+    def today_str(self, user_id, now=None):
+        return self.today(user_id, now).strftime('%Y-%m-%d')
+
+
+# Смещение пояса для показа пользователю: UTC+03:00
+def format_offset(timezone, now=None):
+    moment = datetime.fromtimestamp(time.time() if now is None else now, get_zone(timezone))
+    offset = moment.utcoffset()
+    sign = '+' if offset >= timedelta(0) else '-'
+    hours, minutes = divmod(abs(int(offset.total_seconds())) // 60, 60)
+    return f"UTC{sign}{hours:02d}:{minutes:02d}"
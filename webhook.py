@@ -0,0 +1,230 @@
+"""Режим webhook: Telegram сам присылает обновления на встроенный HTTP-сервер.
+
+Включается переменными окружения:
+
+    BOT_MODE=webhook
+    WEBHOOK_URL=https://bot.example.com   внешний адрес; без него webhook не регистрируется,
+                                          сервер только принимает обновления (локальная проверка)
+    WEBHOOK_PATH=/telegram                путь для обновлений
+    WEBHOOK_SECRET=...                    значение заголовка X-Telegram-Bot-Api-Secret-Token
+    WEBHOOK_HOST=0.0.0.0, WEBHOOK_PORT=8080
+
+GET /healthz отвечает 200, пока приложение запущено, - для балансировщика.
+Сервер построен на aiohttp, он нужен только в этом режиме.
+
+Для проверки без Telegram обновления можно отправить вручную:
+
+    python webhook.py send --secret ... --user 5 Вход
+"""
+import argparse
+import asyncio
+import hmac
+import itertools
+import json
+import logging
+import os
+import secrets
+import signal
+import time
+import urllib.request
+from collections import namedtuple
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+HEALTH_PATH = '/healthz'
+
+
+class WebhookConfig(namedtuple('WebhookConfig', ['enabled', 'url', 'path', 'secret', 'host', 'port'])):
+    """Настройки режима webhook из переменных окружения"""
+
+    @classmethod
+    def from_env(cls):
+        enabled = os.environ.get('BOT_MODE', 'polling').lower() == 'webhook'
+        secret = os.environ.get('WEBHOOK_SECRET')
+        if enabled and not secret:
+            # Случайный секрет годится для одного экземпляра; за балансировщиком
+            # у всех экземпляров должен быть один и тот же WEBHOOK_SECRET
+            secret = secrets.token_urlsafe(32)
+            logger.warning("WEBHOOK_SECRET не задан, используется случайный секрет")
+        return cls(
+            enabled=enabled,
+            url=os.environ.get('WEBHOOK_URL', '').rstrip('/'),
+            path='/' + os.environ.get('WEBHOOK_PATH', '/telegram').lstrip('/'),
+            secret=secret or '',
+            host=os.environ.get('WEBHOOK_HOST', '0.0.0.0'),
+            port=int(os.environ.get('WEBHOOK_PORT', 8080)),
+        )
+
+    @property
+    def webhook_url(self):
+        return self.url + self.path if self.url else None
+
+
+def _import_web():
+    try:
+        from aiohttp import web
+    except ImportError:
+        raise SystemExit("Для режима webhook нужен aiohttp: pip install aiohttp")
+    return web
+
+
+def create_web_app(application, config):
+    """aiohttp-приложение: прием обновлений по config.path и проверка живости"""
+    web = _import_web()
+
+    async def handle_update(request):
+        token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token.encode(), config.secret.encode()):
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        try:
+            update = Update.de_json(data, application.bot)
+        except Exception as e:
+            # Неполное или чужое тело: 200, чтобы Telegram не повторял доставку того же обновления
+            logger.warning(f"Не удалось разобрать обновление webhook, пропущено: {e!r}")
+            return web.Response()
+        # Обработка идет в цикле приложения; Telegram получает ответ сразу
+        await application.update_queue.put(update)
+        return web.Response()
+
+    async def handle_health(request):
+        status = 200 if application.running else 503
+        return web.json_response({
+            'status': 'ok' if application.running else 'stopped',
+            'pending_updates': application.update_queue.qsize(),
+        }, status=status)
+
+    web_app = web.Application()
+    web_app.router.add_post(config.path, handle_update)
+    web_app.router.add_get(HEALTH_PATH, handle_health)
+    return web_app
+
+
+async def serve_webhook(application, config, web_app=None):
+    """Жизненный цикл как у run_polling: initialize, post_init, start ... shutdown, post_shutdown"""
+    web = _import_web()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: остановка по Ctrl+C через KeyboardInterrupt
+            pass
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    runner = web.AppRunner(web_app or create_web_app(application, config))
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, config.host, config.port).start()
+        if config.webhook_url:
+            await application.bot.set_webhook(
+                url=config.webhook_url,
+                secret_token=config.secret,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            logger.info(f"Webhook зарегистрирован: {config.webhook_url}")
+        else:
+            logger.info("WEBHOOK_URL не задан, webhook в Telegram не регистрируется")
+        logger.info(f"Сервер webhook слушает {config.host}:{config.port}{config.path}")
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run_webhook(application, config, web_app=None):
+    try:
+        asyncio.run(serve_webhook(application, config, web_app))
+    except KeyboardInterrupt:
+        pass
+
+
+# Генератор обновлений в формате Bot API для проверки без Telegram
+
+_update_ids = itertools.count(1)
+
+
+def _user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+
+
+def make_text_update(user_id, text, update_id=None):
+    """Текстовое сообщение пользователя в личном чате; /команда получает entity"""
+    update_id = update_id or next(_update_ids)
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': _user(user_id),
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def make_callback_update(user_id, data, message_id=1, update_id=None):
+    """Нажатие inline-кнопки с callback_data под сообщением бота message_id"""
+    update_id = update_id or next(_update_ids)
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id),
+        'chat_instance': str(user_id),
+        'from': _user(user_id),
+        'data': data,
+        'message': {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'text': '',
+        },
+    }}
+
+
+def post_update(url, secret, update):
+    """Отправляет обновление на сервер webhook и возвращает HTTP-статус"""
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode(),
+        headers={'Content-Type': 'application/json', SECRET_HEADER: secret},
+    )
+    with urllib.request.urlopen(request) as response:
+        return response.status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Отправка тестовых обновлений на сервер webhook')
+    commands = parser.add_subparsers(dest='command', required=True)
+    send_parser = commands.add_parser('send', help='отправить текстовые сообщения от пользователя')
+    send_parser.add_argument('--url', default='http://127.0.0.1:8080/telegram')
+    send_parser.add_argument('--secret', default=os.environ.get('WEBHOOK_SECRET', ''))
+    send_parser.add_argument('--user', type=int, default=1, help='user_id отправителя')
+    send_parser.add_argument('--callback', action='store_true', help='тексты - callback_data кнопок')
+    send_parser.add_argument('texts', nargs='+')
+    args = parser.parse_args(argv)
+
+    for text in args.texts:
+        update = make_callback_update(args.user, text) if args.callback else make_text_update(args.user, text)
+        started = time.perf_counter()
+        status = post_update(args.url, args.secret, update)
+        print(f"{text!r}: HTTP {status}, {(time.perf_counter() - started) * 1000:.1f} мс")
+
+
+if __name__ == '__main__':
+    main()